@@ -5,14 +5,12 @@
 # margarine is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
-import pymongo
 import logging
-import os
-import pyrax
+import re
+import uuid
 
 from margarine.parameters import Parameters
-from margarine.parameters import CONFIGURATION_DIRECTORY
-from margarine.helpers import URI
+from margarine.helpers import get_connection_spec
 
 logger = logging.getLogger(__name__)
 
@@ -22,125 +20,508 @@ Parameters("datastore", parameters = [
         "default": "mongodb://localhost/test",
         "help": \
                 "The URL endpoint of the data store mechanism.  This can be " \
-                "a local sqlite database but typically will be set to a " \
-                "MongoDB instance.",
-        }
+                "a local sqlite database (sqlite:///PATH) but typically " \
+                "will be set to a MongoDB instance.",
+        },
+    { # --datastore-indexes=WHEN; WHEN ← startup
+        "options": [ "--indexes" ],
+        "choices": [ "startup", "manual" ],
+        "default": "startup",
+        "help": \
+                "When the declared indexes are applied: once per process " \
+                "when the datastore is first used (startup) or only by " \
+                "margarine-migrate (manual); default: %(default)s.",
+        },
+    { # --datastore-codec=CODEC; CODEC ← plain
+        "options": [ "--codec" ],
+        "choices": [ "plain", "compact" ],
+        "default": "plain",
+        "help": \
+                "How documents are stored: with their field names as is " \
+                "(plain) or with short field names, binary UUIDs, and " \
+                "derived fields omitted (compact).  Existing documents are " \
+                "not converted; choose this before loading data.  Default: " \
+                "%(default)s.",
+        },
     ])
 
-DATASTORE_CONNECTION = None
+ASCENDING = 1
+DESCENDING = -1
 
-def get_collection(collection):
-    """Using the datastore.url parameter we get a collection for storing data.
+INDEXES = {}
+MULTIKEY_FIELDS = {}
 
-    If a connection has already been established we'll re-use that connection;
-    otherwise, we'll create the connection and return the requested collection.
+def register_index(collection, keys, multikey = (), **options):
+    """Declare an index on collection.
 
-    .. note::
-        Currently we only work with a Mongo datastore using the pymongo binding
-        layer.  If we decide to use other datastores we'll have to re-evaluate
-        this architecture.
+    Declared indexes are applied by ensure_indexes.
 
     Parameters
     ----------
 
-    :collection: The MongoDB collection to return after connecting.
+    :collection: The name of the collection to index.
+    :keys:       A list of ( field, direction ) tuples (direction is one of
+                 ASCENDING or DESCENDING).
+    :multikey:   The fields of keys whose values are arrays (i.e. tags).
+                 MongoDB handles these transparently but the SQLite
+                 datastore can't index them and queries them element-wise
+                 (see margarine.sqlitestore).
+    :options:    Index options (i.e. unique, sparse, background, &c).
+
+    """
+
+    INDEXES.setdefault(collection, []).append(( keys, options ))
+
+    MULTIKEY_FIELDS.setdefault(collection, set()).update(multikey)
+
+register_index("users", [ ( "username", ASCENDING ), ], unique = True, drop_dups = True, background = True)
+
+# Articles are looked up by URL, listed by tag, popularity (votes), and
+# recency (created_at), and re-parsed when stale (parsed_at).  See
+# margarine.tools.queries for the queries these serve and their plans.
+
+register_index("articles", [ ( "url", ASCENDING ), ], unique = True, background = True)
+register_index("articles", [ ( "tags", ASCENDING ), ( "created_at", DESCENDING ), ], multikey = [ "tags" ], background = True)
+register_index("articles", [ ( "votes", DESCENDING ), ( "created_at", DESCENDING ), ], background = True)
+register_index("articles", [ ( "created_at", DESCENDING ), ], background = True)
+register_index("articles", [ ( "parsed_at", ASCENDING ), ( "_id", ASCENDING ), ], background = True)
+
+# Notations are paginated by location within an article (see
+# margarine.notations).
+
+register_index("notations", [ ( "article_id", ASCENDING ), ( "location", ASCENDING ), ], unique = True, background = True)
+
+class CompactCodec(object):
+    """Translates between logical documents and their compact stored form.
+
+    Handlers only ever see logical documents (and write logical queries);
+    CompactCollection applies the codec to everything crossing the datastore
+    boundary.  Fields that aren't named are stored as is.
+
+    Parameters
+    ----------
+
+    :fields:  A dict of logical field names to stored field names.
+    :uuids:   Logical fields holding UUID hex strings that are stored as
+              binary UUIDs (16 bytes rather than a 32 character string).
+    :derived: A dict of logical field names to ( dependencies, derive,
+              query ) for fields that aren't stored when they can be derived
+              from other fields: derive(document) computes the value from
+              the dependencies (logical fields) and query(value) translates
+              an equality condition on the field to logical conditions.
+
+    """
+
+    def __init__(self, fields, uuids = (), derived = None):
+        self.fields = fields
+        self.uuids = frozenset(uuids)
+        self.derived = derived or {}
+
+        self.names = dict([ ( stored, logical ) for logical, stored in fields.items() ])
+
+    def _encode_value(self, field, value):
+        if field not in self.uuids or value is None or isinstance(value, uuid.UUID):
+            return value
+
+        if isinstance(value, dict):
+            return dict([ ( operator, self._encode_value(field, _) ) for operator, _ in value.items() ])
+
+        if isinstance(value, list):
+            return [ self._encode_value(field, _) for _ in value ]
+
+        return uuid.UUID(value)
+
+    def _derivable(self, field, document):
+        dependencies, derive, _ = self.derived[field]
+
+        try:
+            return all([ _ in document for _ in dependencies ]) and derive(document) == document[field]
+        except Exception:
+            return False
+
+    def encode(self, document, context = None):
+        """The stored form of the logical document.
+
+        context supplies dependencies of derived fields that aren't in the
+        document (i.e. the _id of an update's query).
+
+        """
+
+        context = dict(context or {}, **document)
+
+        return dict([ ( self.fields.get(field, field), self._encode_value(field, value) ) for field, value in document.items() if field not in self.derived or not self._derivable(field, context) ])
+
+    def decode(self, document):
+        """The logical form of the stored document."""
+
+        if document is None:
+            return None
+
+        document = dict([ ( self.names.get(field, field), value.hex if isinstance(value, uuid.UUID) and self.names.get(field, field) in self.uuids else value ) for field, value in document.items() ])
+
+        for field, ( dependencies, derive, _ ) in self.derived.items():
+            if field not in document and all([ _ in document for _ in dependencies ]):
+                document[field] = derive(document)
+
+        return document
+
+    def encode_spec(self, spec):
+        """The stored form of the logical query, spec."""
+
+        if spec is None:
+            return None
+
+        if not isinstance(spec, dict):
+            spec = { "_id": spec }
+
+        encoded = {}
+
+        for field, condition in spec.items():
+            if field in self.derived:
+                dependencies, _, query = self.derived[field]
+
+                if isinstance(condition, dict) and "$exists" in condition:
+                    encoded.update(self.encode_spec(dict([ ( _, condition ) for _ in dependencies if _ != "_id" ])))
+                else:
+                    encoded.update(self.encode_spec(query(condition)))
+
+                continue
+
+            encoded[self.fields.get(field, field)] = self._encode_value(field, condition)
+
+        return encoded
+
+    def encode_fields(self, fields):
+        """The stored form of the projection, fields."""
+
+        if fields is None:
+            return None
+
+        if isinstance(fields, ( list, tuple )):
+            fields = dict([ ( _, 1 ) for _ in fields ])
+
+        encoded = {}
+
+        for field, value in fields.items():
+            if field in self.derived:
+                if value:
+                    encoded.update([ ( self.fields.get(_, _), 1 ) for _ in self.derived[field][0] ])
+
+                continue
+
+            encoded[self.fields.get(field, field)] = value
+
+        return encoded
+
+    def encode_keys(self, keys):
+        """The stored form of index or sort keys."""
+
+        return [ ( self.fields.get(field, field), direction ) for field, direction in keys ]
+
+    def encode_update(self, spec, document):
+        """The stored form of an update ($set and $unset or a replacement)."""
+
+        if not any([ _.startswith("$") for _ in document ]):
+            return self.encode(document)
+
+        context = dict([ _ for _ in ( spec or {} ).items() if not isinstance(_[1], dict) ])
+
+        encoded = {}
+
+        for operator, fields in document.items():
+            if operator == "$set":
+                encoded[operator] = self.encode(fields, context)
+            else:
+                encoded[operator] = dict([ ( self.fields.get(field, field), value ) for field, value in fields.items() if field not in self.derived ])
+
+        return dict([ _ for _ in encoded.items() if len(_[1]) ])
+
+class CompactCursor(object):
+    """A cursor decoding the documents of CompactCollection.find."""
+
+    def __init__(self, cursor, codec):
+        self.cursor = cursor
+        self.codec = codec
+
+    def sort(self, key_or_list, direction = 1):
+        if not isinstance(key_or_list, list):
+            key_or_list = [ ( key_or_list, direction ) ]
+
+        self.cursor = self.cursor.sort(self.codec.encode_keys(key_or_list))
+
+        return self
+
+    def skip(self, skip):
+        self.cursor = self.cursor.skip(skip)
+
+        return self
+
+    def limit(self, limit):
+        self.cursor = self.cursor.limit(limit)
+
+        return self
+
+    def count(self):
+        return self.cursor.count()
+
+    def __iter__(self):
+        for document in self.cursor:
+            yield self.codec.decode(document)
+
+class CompactCollection(object):
+    """A collection that stores documents with a CompactCodec.
+
+    Parameters
+    ----------
+
+    :collection: The underlying collection (pymongo or SQLiteCollection).
+    :codec:      The CompactCodec for the collection.
+
+    """
+
+    def __init__(self, collection, codec):
+        self.collection = collection
+        self.codec = codec
+
+    def __repr__(self):
+        return "CompactCollection({0!r})".format(self.collection)
+
+    def find(self, spec = None, fields = None, **kwargs):
+        return CompactCursor(self.collection.find(self.codec.encode_spec(spec), self.codec.encode_fields(fields), **kwargs), self.codec)
+
+    def find_one(self, spec = None, fields = None, **kwargs):
+        return self.codec.decode(self.collection.find_one(self.codec.encode_spec(spec), self.codec.encode_fields(fields), **kwargs))
+
+    def count(self):
+        return self.collection.count()
+
+    def insert(self, doc_or_docs, **kwargs):
+        documents = doc_or_docs if isinstance(doc_or_docs, list) else [ doc_or_docs ]
+
+        encoded = [ self.codec.encode(_) for _ in documents ]
+
+        self.collection.insert(encoded, **kwargs)
+
+        for document, stored in zip(documents, encoded):
+            document.setdefault("_id", self.codec.decode({ "_id": stored["_id"] })["_id"])
+
+        return [ _["_id"] for _ in documents ] if isinstance(doc_or_docs, list) else doc_or_docs["_id"]
+
+    def update(self, spec, document, **kwargs):
+        return self.collection.update(self.codec.encode_spec(spec), self.codec.encode_update(spec, document), **kwargs)
+
+    def remove(self, spec = None, **kwargs):
+        return self.collection.remove(self.codec.encode_spec(spec), **kwargs)
+
+    def drop(self):
+        return self.collection.drop()
+
+    def ensure_index(self, keys, **options):
+        return self.collection.ensure_index(self.codec.encode_keys(keys), **options)
+
+COMPACT_CODECS = {}
+
+def register_compact_codec(collection, codec):
+    """Declare the CompactCodec used for collection when datastore.codec is compact."""
+
+    COMPACT_CODECS[collection] = codec
+
+register_compact_codec("users", CompactCodec({
+    "username": "u",
+    "email": "e",
+    "name": "n",
+    "hash": "h",
+    }))
+
+def _article_location(article):
+    from margarine.objectstores import get_article_location
+
+    layout = article["text_layout"]
+
+    return get_article_location(article["_id"], int(layout.split("-")[1]) if layout.startswith("hashed-") else 0)
+
+def _article_layout(container_name):
+    match = re.match(r"^margarine-(\d+)-[0-9a-f]+$", container_name)
+
+    return { "text_layout": "hashed-{0}".format(match.group(1)) if match else "uuid" }
+
+# Article bodies' container and object names are derived from the _id and
+# text_layout (see margarine.objectstores.get_article_location).
+
+register_compact_codec("articles", CompactCodec({
+    "url": "u",
+    "tags": "t",
+    "notations": "n",
+    "votes": "v",
+    "created_at": "c",
+    "etag": "e",
+    "original_etag": "o",
+    "parsed_at": "p",
+    "size": "s",
+    "stored_size": "ss",
+    "encoding": "z",
+    "text": "x",
+    "text_layout": "l",
+    }, uuids = [ "_id" ], derived = {
+        "text_container_name": ( [ "_id", "text_layout" ], lambda _: _article_location(_)[0], _article_layout ),
+        "text_object_name": ( [ "_id", "text_layout" ], lambda _: _article_location(_)[1], lambda _: {} ),
+        }))
+
+register_compact_codec("notations", CompactCodec({
+    "article_id": "a",
+    "location": "l",
+    "note": "n",
+    }, uuids = [ "article_id" ]))
+
+DATASTORE_CONNECTION = None
+DATASTORE_DATABASE = None
+DATASTORE_COLLECTIONS = {}
+
+def get_database():
+    """Using the datastore.url parameter we get the database for margarine.
+
+    The connection is established (and, if datastore.indexes is startup, the
+    declared indexes are applied) the first time this is called in a process.
+
+    Any MongoDB connection options can be passed in the query string of the
+    datastore.url as well as the following:
+
+    :max_pool_size: The maximum number of connections to keep in the pool.
+
+    A datastore.url of sqlite:///PATH selects a SQLite database file instead
+    (see margarine.sqlitestore) which accepts the following option:
+
+    :timeout: The number of seconds to wait for a locked database.
 
     Returns
     -------
 
-    A collection for datastore interaction.
+    The database named by the path of datastore.url (or a SQLiteDatabase).
 
     """
 
     global DATASTORE_CONNECTION
+    global DATASTORE_DATABASE
 
-    url = Parameters()["datastore.url"]
+    if DATASTORE_DATABASE is None:
+        spec = get_connection_spec("datastore.url")
 
-    uri = URI(url)
+        if spec.scheme == "sqlite":
+            from margarine.sqlitestore import SQLiteDatabase
 
-    logger.debug("url: %s", url)
-    logger.debug("uri: %s", uri)
+            database = SQLiteDatabase(spec.path, timeout = spec.option("timeout", 5.0, float), multikey = _multikey_fields(Parameters()["datastore.codec"] == "compact"))
+        else:
+            import pymongo
 
-    if DATASTORE_CONNECTION is None:
-        DATASTORE_CONNECTION = pymongo.MongoClient(url)
+            if DATASTORE_CONNECTION is None:
+                DATASTORE_CONNECTION = pymongo.MongoClient(spec.without("max_pool_size"), max_pool_size = spec.option("max_pool_size", 10, int))
 
-    database_name = uri.path
+            database_name = spec.path
 
-    logger.debug("database_name: %s", database_name)
+            if "/" in database_name:
+                database_name = database_name.replace("/", "", 1).replace("/", "_")
 
-    if "/" in database_name:
-        database_name = database_name.replace("/", "", 1).replace("/", "_")
+            database = DATASTORE_CONNECTION[database_name]
 
-    database = DATASTORE_CONNECTION[database_name]
+        if Parameters()["datastore.indexes"] == "startup":
+            ensure_indexes(database)
 
-    indexes = {
-            "users": [
-                [
-                    [ ( "username", pymongo.ASCENDING ), ],
-                    { 
-                        "unique": True,
-                        "drop_dups": True,
-                        "background": True,
-                        },
-                    ],
-                ],
-            }
+        DATASTORE_DATABASE = database
 
-    logger.debug("collection: %s", collection)
+    return DATASTORE_DATABASE
 
-    for index in indexes.get(collection, []):
-        logger.debug("index: %s", index)
-        logger.debug("index-args: %s", index[0])
-        logger.debug("index-kwargs: %s", index[1])
+def _multikey_fields(compact = False):
+    """The stored names of the declared multikey fields of each collection."""
 
-        database[collection].ensure_index(index[0], **index[1])
+    fields = {}
 
-    return database[collection]
+    for collection, logical in MULTIKEY_FIELDS.items():
+        keys = [ ( _, ASCENDING ) for _ in sorted(logical) ]
 
-Parameters("pyrax", parameters = [
-    { # --pyrax-configuration=FILE; FILE ← CONFIGURATION_DIRECTORY/pyrax.ini
-        "options": [ "--configuration" ],
-        "default": os.path.join(CONFIGURATION_DIRECTORY, "pyrax.ini"),
-        "help": \
-                "The configuration file containing the pyrax credentials " \
-                "used by %(prog)s.  Default: %(default)s.",
-        },
-    { # --pyrax-type=TYPE; TYPE ← rackspace
-        "options": [ "--type" ],
-        "default": "rackspace",
-        "help": \
-                "The identity type for pyrax.  This needs to be set outside " \
-                "of the pyrax configuration due to the pyrax " \
-                "implementation.  This defaults to %(default)s but can be " \
-                "over-ridden if required.",
-        },
-    ])
+        if compact and collection in COMPACT_CODECS:
+            keys = COMPACT_CODECS[collection].encode_keys(keys)
 
-def get_container(container):
-    """Using the pyrax interface retrieve a container object for storing data.
+        fields[collection] = [ _[0] for _ in keys ]
 
-    Reconnects for every container provided.  
+    return fields
 
-    .. note::
-        This needs to be checked for correctness.  This needs to be checked
-        that the container does indeed hold open the connection and that the
-        connection is closed properly when the container goes out of scope.
+def get_collection(collection):
+    """Using the datastore.url parameter we get a collection for storing data.
+
+    Collection handles are cached so, after the first call for a collection,
+    this is a dict lookup.  See get_database for the connection details.  If
+    datastore.codec is compact, collections with a registered CompactCodec
+    are wrapped in a CompactCollection.
 
     Parameters
     ----------
 
-    :container: The name of the container to return for interaction.
+    :collection: The MongoDB collection to return after connecting.
 
     Returns
     -------
 
-    A container for datastore interaction.
+    A collection for datastore interaction.
+
+    """
+
+    try:
+        return DATASTORE_COLLECTIONS[collection]
+    except KeyError:
+        logger.debug("collection: %s", collection)
+
+        handle = get_database()[collection]
+
+        if Parameters()["datastore.codec"] == "compact" and collection in COMPACT_CODECS:
+            handle = CompactCollection(handle, COMPACT_CODECS[collection])
+
+        return DATASTORE_COLLECTIONS.setdefault(collection, handle)
+
+def ensure_indexes(database = None):
+    """Apply every declared index (see register_index) to the database.
+
+    Creating an index that already exists is a no-op in MongoDB but still costs
+    a round trip per index; this should be invoked once per process (see
+    datastore.indexes) or by margarine-migrate.
+
+    Parameters
+    ----------
+
+    :database: The database to index; defaults to get_database().
 
     """
 
-    pyrax.settings.set('identity_type', Parameters()["pyrax.type"])
+    if database is None:
+        database = get_database()
+
+    compact = Parameters()["datastore.codec"] == "compact"
+
+    for collection, indexes in sorted(INDEXES.items()):
+        for keys, options in indexes:
+            if compact and collection in COMPACT_CODECS:
+                keys = COMPACT_CODECS[collection].encode_keys(keys)
+
+            logger.info("Ensuring index on %s: %s (%s)", collection, keys, options)
+
+            database[collection].ensure_index(keys, **options)
+
+def _reset_datastore(key, previous, current):
+    """Drop the datastore connection when datastore.url (or codec) changes.
+
+    The connection is rebuilt lazily by get_collection.  Collections still in
+    use by in-flight requests keep working until they're released.
+
+    """
+
+    global DATASTORE_CONNECTION
+    global DATASTORE_DATABASE
+    global DATASTORE_COLLECTIONS
 
-    pyrax.set_credential_file(Parameters()["pyrax.configuration"])
+    logger.info("Resetting datastore connection for %s", current)
 
-    return pyrax.cloudfiles.create_container(container)
+    DATASTORE_CONNECTION = None
+    DATASTORE_DATABASE = None
+    DATASTORE_COLLECTIONS = {}
 
+Parameters().subscribe("datastore.url", _reset_datastore)
+Parameters().subscribe("datastore.codec", _reset_datastore)
@@ -49,11 +49,8 @@ Fields
   :etag:           Original article's ETAG
 
 :tags:             List of tags for this article
-:notations:        List of notations (sub-documents):
-
-  :location:       Where the notation is attached
-  :note:           Text of the notation
-
+:notations:        Notations (see Notation) aren't embedded; reads include
+                   a notation_count and the first page of notations.
 :subscriber_count: Count of subscribers (article:user map is stored elsewhere)
 :created_at:       Time of creation
 :parsed_at:        Last time of parsing
@@ -75,6 +72,23 @@ Actions
 * Tag an article
 * View an article
 
+Notation
+--------
+
+A margin note on an article.  Notations are kept out of the article document
+so it doesn't grow with every note and are read a page at a time.
+
+Fields
+
+
+:article_id: ID of the article the notation is attached to
+:location:   Where the notation is attached
+:note:       Text of the notation
+
+.. note::
+    ``article_id`` and ``location`` are (uniquely) indexed together so pages
+    are range reads of the index.
+
 Subscription
 ------------
 
@@ -105,6 +119,8 @@ URL Summary
 :``/users/<username>``:          GET,PUT,DELETE
 :``/users/<username>/password``: GET,POST
 :``/users/<username>/token``:    GET
+:``/articles/<id>/notations``:   GET
+:``/status/keystore``:           GET
 
 """
 
@@ -112,14 +128,17 @@ import logging
 import socket
 
 from flask import Flask
+from flask import make_response
 from flask import url_for
 
 from margarine.parameters import Parameters
 from margarine.parameters import configure_logging
+from margarine.parameters import watch_configuration
 
 configure_logging()
 
 from margarine.blend import information
+from margarine.communication import UnconfirmedError
 
 from margarine.blend.user import USER
 from margarine.blend.user import UnauthorizedError
@@ -127,6 +146,7 @@ from margarine.blend.user import http_401_handler
 
 from margarine.blend.article import ARTICLE
 from margarine.blend.tag import TAG
+from margarine.blend.status import STATUS
 
 logger = logging.getLogger(__name__)
 
@@ -182,13 +202,32 @@ def _prefix(name):
 BLEND.register_blueprint(USER, url_prefix = _prefix("users"))
 BLEND.register_blueprint(ARTICLE, url_prefix = _prefix("articles"))
 BLEND.register_blueprint(TAG, url_prefix = _prefix("tags"))
+BLEND.register_blueprint(STATUS, url_prefix = _prefix("status"))
 
 logger.debug("user resource directory: %s", USER.root_path)
 logger.debug("article resource directory: %s", ARTICLE.root_path)
 logger.debug("tag resource directory: %s", TAG.root_path)
+logger.debug("status resource directory: %s", STATUS.root_path)
 
 BLEND.error_handler_spec[None][401] = http_401_handler
 
+@BLEND.errorhandler(UnconfirmedError)
+def http_503_handler(error):
+    """Sends a 503 Service Unavailable for submissions the queue didn't confirm.
+
+    The submission may or may not be processed; clients should retry after
+    queue.wait seconds.
+
+    """
+
+    logger.warning("Unconfirmed submission: %s", error)
+
+    response = make_response("", 503)
+
+    response.headers["Retry-After"] = str(Parameters()["queue.wait"])
+
+    return response
+
 logger.debug("error_handlers: %s", BLEND.error_handler_spec)
 
 # TODO Find out why this might be necessary.
@@ -225,5 +264,9 @@ def _extract_flask_parameters(parameters):
     return flask_parameters
 
 def main():
-    BLEND.run(**_extract_flask_parameters(Parameters().parse()))
+    parameters = Parameters().parse()
+
+    watch_configuration()
+
+    BLEND.run(**_extract_flask_parameters(parameters))
 
@@ -13,7 +13,7 @@ The properties we're starting with are the following:
     * url—unique index
     * text → sent to object store upon save (MQ)
     * tags—index
-    * notations
+    * notations—separate collection (see margarine.notations)
 
       * location
       * note
@@ -39,20 +39,25 @@ The properties we're starting with are the following:
 import uuid
 import json
 import logging
-import pika
 import re
 import socket
 
 from flask import request
 from flask import Blueprint
+from flask import Response
 from flask import abort
 from flask import make_response
 from flask import url_for
-from bson import json_util
+from werkzeug.wsgi import wrap_file
 
 from margarine.aggregates import get_collection
-from margarine.aggregates import get_container
-from margarine.communication import get_channel
+from margarine.objectstores import get_container
+from margarine.communication import publish
+from margarine.compression import content_coding
+from margarine.compression import decompress
+from margarine.loggers import abbreviate
+from margarine.notations import count_notations
+from margarine.notations import get_notations
 from margarine.parameters import Parameters
 
 logger = logging.getLogger(__name__)
@@ -85,6 +90,9 @@ def submit_article():
         HTTP/1.0 202 Accepted
         Location: /44d85795-248d-5899-b8ca-ac2bd8233755
 
+    The 202 is sent once the queue has confirmed the submission; otherwise,
+    the response is a 503 Service Unavailable (see queue.confirms).
+
     """
 
     logger.debug("request.form[url]: '%s'", request.form["url"])
@@ -96,21 +104,12 @@ def submit_article():
     logger.debug("type(_id): %s", type(_id.hex))
     logger.debug("_id: %s", _id.hex)
 
-    message_properties = pika.BasicProperties()
-    message_properties.content_type = "application/json"
-    message_properties.durable = False
-
     message = {
             "_id": str(_id.hex),
             "url": request.form["url"],
             }
 
-    message = json.dumps(message)
-
-    channel = get_channel()
-    channel.exchange_declare(exchange = "margarine.articles.topic", type = "topic", auto_delete = False)
-    channel.basic_publish(body = message, exchange = "margarine.articles.topic", properties = message_properties, routing_key = "articles.create")
-    channel.close()
+    publish("margarine.articles.topic", "articles.create", message)
 
     response = make_response("", 202)
     response.headers["Location"] = url_for(".article", article_id = _id)
@@ -160,29 +159,84 @@ def article(article_id):
           "size": 9964
         }
 
+    Requests that prefer text/html (i.e. Accept: text/html) receive the body
+    alone.  It's streamed from the object store (with sendfile when the WSGI
+    server provides a file wrapper and the object store is local) rather than
+    read into memory and encoded in the JSON document.  Compressed bodies
+    are sent as stored (with a Content-Encoding) to clients that accept the
+    coding and are only decompressed for other clients.
+
     """
 
     article = get_collection("articles").find_one({ "_id": uuid.UUID(article_id).hex })
 
-    logger.debug("article: %s", article)
+    logger.debug("article: %s", abbreviate(article))
 
     if article is None or "etag" not in article:
         # 404 not only if the object doesn't exist but also if we haven't
         # sanitized the body yet.
         abort(404)
 
-    container_name, object_name = article.pop("text_container_name"), article.pop("text_object_name")
+    # Small bodies are stored inline (see inline.threshold).
+    text = article.pop("text", None)
 
-    logger.debug("article: %s", article)
+    container_name, object_name = article.pop("text_container_name", None), article.pop("text_object_name", None)
+
+    # Bodies are stored compressed (see compression.codec).
+    encoding = article.pop("encoding", None)
+
+    logger.debug("article: %s", abbreviate(article))
 
     # TODO Catch connection issues and return Temporarily Unavailable.
-    if request.method != "HEAD":
-        data = get_container(container_name).get_object(object_name).fetch()
+    if request.accept_mimetypes.best_match([ "application/json", "text/html" ]) == "text/html":
+        coding = content_coding(encoding)
+
+        passthrough = encoding is None or request.accept_encodings[coding] > 0
+
+        if text is not None:
+            response = make_response(text if encoding is None else ( bytes(text) if passthrough else decompress(encoding, bytes(text)) ), 200)
+            response.mimetype = "text/html"
+        elif passthrough:
+            body = get_container(container_name).open_object(object_name)
+
+            response = Response(wrap_file(request.environ, body), 200, mimetype = "text/html", direct_passthrough = True)
+            response.content_length = len(body)
+        else:
+            response = make_response(decompress(encoding, get_container(container_name).fetch_object(object_name)), 200)
+            response.mimetype = "text/html"
+
+        if encoding is not None:
+            response.vary.add("Accept-Encoding")
+
+            if passthrough:
+                response.content_encoding = coding
+
+        response.headers["Access-Control-Allow-Origin"] = Parameters()["server.domain"]
+
+        return response
+
+    if text is not None:
+        article["body"] = text if encoding is None else decompress(encoding, bytes(text)).decode("utf-8")
+    elif request.method != "HEAD":
+        data = get_container(container_name).fetch_object(object_name)
 
         logger.debug("type(data): %s", type(data))
         logger.debug("len(data): %s", len(data))
 
-        article["body"] = data
+        article["body"] = data if encoding is None else decompress(encoding, data).decode("utf-8")
+
+    embedded = article.pop("notations", None)
+
+    if embedded is not None: # Not yet moved by margarine-migrate.
+        article["notation_count"] = len(embedded)
+        article["notations"] = sorted(embedded, key = lambda _: _["location"])[:int(Parameters()["notations.page"])]
+    else:
+        article["notations"], after = get_notations(article["_id"])
+
+        # Only a full page needs another round trip for the count.
+        article["notation_count"] = len(article["notations"]) if after is None else count_notations(article["_id"])
+
+    from bson import json_util
 
     response = make_response(json.dumps(article, default = json_util.default), 200)
 
@@ -192,3 +246,55 @@ def article(article_id):
 
     return response
 
+@ARTICLE.route('/<article_id>/notations')
+def notations(article_id):
+    """Retrieve a page of an article's notations (in location order).
+
+    Request
+    -------
+
+    ::
+
+        GET /44d85795-248d-5899-b8ca-ac2bd8233755/notations?after=120&limit=20
+
+    The after parameter is the (JSON encoded) location of the last notation of
+    the previous page and is omitted for the first page.
+
+    Response
+    --------
+
+    ::
+
+        HTTP/1.0 200 Ok
+
+        {
+          "notations": [ { "location": 135, "note": "…" }, … ],
+          "next": "/44d85795-248d-5899-b8ca-ac2bd8233755/notations?after=512&limit=20"
+        }
+
+    """
+
+    article_id = uuid.UUID(article_id).hex
+
+    try:
+        after = json.loads(request.args["after"]) if "after" in request.args else None
+        limit = int(request.args.get("limit", Parameters()["notations.page"]))
+    except ValueError:
+        abort(400)
+
+    limit = max(1, min(limit, 100))
+
+    page, after = get_notations(article_id, after = after, limit = limit)
+
+    result = {
+            "notations": page,
+            "next": None if after is None else url_for(".notations", article_id = uuid.UUID(article_id), after = json.dumps(after), limit = limit),
+            }
+
+    response = make_response(json.dumps(result), 200)
+
+    response.mimetype = "application/json"
+
+    response.headers["Access-Control-Allow-Origin"] = Parameters()["server.domain"]
+
+    return response
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""URL endpoints that report the health of margarine's backing services.
+
+These are meant for operators and load balancers rather than clients and
+don't require authentication; they report only whether each service is up.
+Hosts, errors, and connection pool statistics are logged rather than returned
+so operators find them in blend's log at the load balancer's polling
+interval.
+
+.. note::
+    This blueprint has all methods documented with an assumed prefix.  Thus,
+    the path '/' is in fact something like (defined elsewhere) '/v1/status/'.
+
+"""
+
+import json
+import logging
+
+from flask import Blueprint
+
+from margarine.keystores import get_keystore_status
+
+logger = logging.getLogger(__name__)
+
+STATUS = Blueprint("status", __name__)
+
+@STATUS.route('/keystore')
+def keystore():
+    """Report whether each keystore shard is up.
+
+    Shards are identified by their position in keystore.url.  Each shard's
+    name and connection pool statistics (connections, idle connections, and
+    max_connections for Redis shards) are logged (INFO) with its position.
+
+    Request
+    -------
+
+    ::
+
+        GET /keystore
+
+    Response
+    --------
+
+    ::
+
+        HTTP/1.0 200 OK
+
+        [
+          { "shard": 0, "healthy": true },
+          { "shard": 1, "healthy": true }
+        ]
+
+    Possible Errors
+    ---------------
+
+    :503: Service Unavailable—At least one shard is unhealthy; the body is the
+          same report.
+
+    """
+
+    shards = get_keystore_status()
+
+    for index, shard in enumerate(shards):
+        logger.info("Keystore shard %s (%s): healthy: %s, pool: %s", index, shard["shard"], shard["healthy"], shard.get("pool"))
+
+        if not shard["healthy"]:
+            logger.warning("Keystore shard %s (%s) is unhealthy: %s", index, shard["shard"], shard.get("error"))
+
+    report = [ { "shard": index, "healthy": shard["healthy"] } for index, shard in enumerate(shards) ]
+
+    status = 200 if all([ _["healthy"] for _ in report ]) else 503
+
+    return json.dumps(report), status, { "Content-Type": "application/json" }
@@ -39,7 +39,6 @@ on /<username>/token.
 """
 
 import uuid
-import pika
 import json
 import logging
 import werkzeug.exceptions
@@ -56,9 +55,18 @@ from flask import render_template
 
 from margarine.blend import information
 from margarine.parameters import Parameters
-from margarine.communication import get_channel
+from margarine.communication import publish
 from margarine.aggregates import get_collection
+from margarine.keystores import delete_if_equal
 from margarine.keystores import get_keyspace
+from margarine.keystores import promote
+from margarine.tokens import TOKEN_LIFETIME
+from margarine.tokens import is_signed
+from margarine.tokens import issue
+from margarine.tokens import revoke
+from margarine.tokens import signing_enabled
+from margarine.tokens import verify
+from margarine.loggers import abbreviate
 
 logger = logging.getLogger(__name__)
 
@@ -126,6 +134,24 @@ def http_401_handler(error):
 
     return response
 
+def authenticate(token):
+    """Return the username the token (X-Auth-Token) was issued to.
+
+    Signed tokens are verified locally (see margarine.tokens); other tokens
+    are looked up in the tokens keyspace.
+
+    Returns
+    -------
+
+    The username or None if the token isn't valid.
+
+    """
+
+    if is_signed(token):
+        return verify(token)
+
+    return get_keyspace("tokens").get(token)
+
 USER = Blueprint("user", __name__)
 
 class UserInterface(MethodView):
@@ -205,11 +231,7 @@ class UserInterface(MethodView):
 
         user = get_collection("users").find_one({ "username": username })
         
-        logger.debug("user: %s", user)
-
-        message_properties = pika.BasicProperties()
-        message_properties.content_type = "application/json"
-        message_properties.durable = False
+        logger.debug("user: %s", abbreviate(user))
 
         message = {
                 "username": request.form.get("username", username),
@@ -226,19 +248,14 @@ class UserInterface(MethodView):
 
             logger.debug("X-Auth-Token: %s", request.headers.get("X-Auth-Token"))
 
-            if get_keyspace("tokens").get(request.headers.get("X-Auth-Token")) != username:
+            if authenticate(request.headers.get("X-Auth-Token")) != username:
                 # TODO Redirect to token URL?
                 raise UnauthorizedError(username = username)
 
         if message["email"] is None and routing_key == "users.create":
             abort(400)
 
-        message = json.dumps(message)
-
-        channel = get_channel()
-        channel.exchange_declare(exchange = "margarine.users.topic", type = "topic", auto_delete = False)
-        channel.basic_publish(body = message, exchange = "margarine.users.topic", properties = message_properties, routing_key = routing_key)
-        channel.close()
+        publish("margarine.users.topic", routing_key, message)
 
         return "", 202
     
@@ -277,7 +294,7 @@ class UserInterface(MethodView):
 
         # TODO Should this be an authenticated action?
 
-        logger.debug("user: %s", user)
+        logger.debug("user: %s", abbreviate(user))
 
         if user is None:
             abort(404)
@@ -316,13 +333,20 @@ class UserInterface(MethodView):
 
         """
 
-        if get_keyspace("tokens").get(request.headers.get("X-Auth-Token")) != username:
+        token = request.headers.get("X-Auth-Token")
+
+        if authenticate(token) != username:
             # TODO Redirect to token URL?
             raise UnauthorizedError(username = username)
 
         # TODO Submit queued job and not write from this API?
         get_collection("users").remove({ "username": username })
 
+        if is_signed(token):
+            revoke(token)
+        else:
+            get_keyspace("tokens").delete(token)
+
         return ""
 
 USER.add_url_rule('/<username>', view_func = UserInterface.as_view("users_api"))
@@ -416,24 +440,17 @@ class UserPasswordInterface(MethodView):
         elif len(tokens) == 1:
             verification = tokens[0]
 
-            if get_keyspace("tokens").get(verification) == username:
+            if not is_signed(verification):
+                promote("tokens", "verifications", verification, username, datetime.timedelta(minutes = 3))
+            elif verify(verification) == username:
                 get_keyspace("verifications").setex(verification, username, datetime.timedelta(minutes = 3))
 
             logger.debug("verification token: %s", verification)
 
             return render_template("password_mechanism.html", username = username, verification = verification)
 
-        message_properties = pika.BasicProperties()
-        message_properties.content_type = "application/json"
-        message_properties.durable = False
-
         message = { "username": username, }
-        message = json.dumps(message)
-
-        channel = get_channel()
-        channel.exchange_declare(exchange = "margarine.users.topic", type = "topic", auto_delete = False)
-        channel.basic_publish(body = message, exchange = "margarine.users.topic", properties = message_properties, routing_key = "users.email")
-        channel.close()
+        publish("margarine.users.topic", "users.email", message)
 
         return "", 202
 
@@ -466,12 +483,6 @@ class UserPasswordInterface(MethodView):
 
         verification = request.args.get("verification")
 
-        if get_keyspace("verifications").get(verification) != username:
-            logger.error("verification token not valid")
-            logger.debug("verification: %s", verification)
-
-            abort(400)
-
         password = request.form.get("password-0")
 
         if password is None or password != request.form.get("password-1"):
@@ -482,26 +493,24 @@ class UserPasswordInterface(MethodView):
 
             abort(400)
 
-        message_properties = pika.BasicProperties()
-        message_properties.content_type = "application/json"
-        message_properties.durable = False
+        # The verification is consumed in the same round trip that checks it
+        # so it can't be used twice.
+
+        if not delete_if_equal("verifications", verification, username):
+            logger.error("verification token not valid")
+            logger.debug("verification: %s", verification)
+
+            abort(400)
 
         message = { 
                 "username": username, 
                 "password": password,
                 }
 
-        message = json.dumps(message)
-
-        channel = get_channel()
-        channel.exchange_declare(exchange = "margarine.users.topic", type = "topic", auto_delete = False)
-        channel.basic_publish(body = message, exchange = "margarine.users.topic", properties = message_properties, routing_key = "users.password")
-        channel.close()
+        publish("margarine.users.topic", "users.password", message)
 
         logger.info("Sent Password Update")
 
-        get_keyspace("verifications").delete(verification)
-
         return "", 202
 
 USER.add_url_rule('/<username>/password', view_func = UserPasswordInterface.as_view("users_password_api"))
@@ -574,7 +583,7 @@ def login(username):
 
     user = get_collection("users").find_one({ "username": username })
 
-    logger.debug("user: %s", user)
+    logger.debug("user: %s", abbreviate(user))
 
     if user is None:
         abort(404)
@@ -593,9 +602,12 @@ def login(username):
     if request.authorization.response != h3:
         raise UnauthorizedError(username = username)
 
+    if signing_enabled():
+        return issue(username)
+
     token = uuid.uuid4()
 
-    get_keyspace("tokens").setex(str(token), username, datetime.timedelta(hours = 6))
+    get_keyspace("tokens").setex(str(token), username, TOKEN_LIFETIME)
 
     return str(token)
 
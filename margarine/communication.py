@@ -7,21 +7,45 @@
 
 """All communication mechanisms.
 
-This module includes queue channel acquisition and email handlers.
+This module includes queue channel acquisition, message publishing, and email
+handlers.
+
+Publishing
+----------
+
+Messages are published with publish(exchange, routing_key, payload) on a pool
+of long-lived publishers (a connection and channel each) shared by the
+process' threads.  A publisher is checked out for a single publish (so a
+channel is never used by two threads at once), checked for health (open and
+created in this process), and returned to the pool afterwards.  Each
+publisher declares an exchange (with the type registered in EXCHANGES) the
+first time it publishes to it and remembers it for the life of its
+connection; a steady-state publish is a single basic.publish.  Payloads are
+encoded in versioned envelopes with the messages.codec codec (see
+margarine.messages).
+
+With queue.confirms = batch (the default) a publisher's channel is in
+confirm mode but publishes don't wait for their confirm; the delivery tag is
+tracked as outstanding and the publisher goes straight back to the pool so
+other threads publish on the same channel.  Each publishing thread then waits
+(at most queue.deadline seconds) for its tag; one waiting thread at a time
+reads from the connection (waiting for the socket without holding the
+publisher's lock so other threads keep publishing), the broker acknowledges
+the outstanding tags in batches (basic.ack with multiple), and the reader
+resolves the tags of every waiting thread and wakes them.
 
 """
 
-import pika
 import logging
+import os
+import select
 import socket
-import smtplib
-import email.mime.text
+import threading
 import time
 
-from flask import url_for
-
 from margarine.parameters import Parameters
-from margarine.helpers import URI
+from margarine.helpers import get_connection_spec
+from margarine.messages import encode
 
 logger = logging.getLogger(__name__)
 
@@ -44,20 +68,102 @@ Parameters("queue", parameters = [
                 "continually retries its connection every %(metavar)s " \
                 "seconds.",
         },
+    { # --queue-publishers=N; N ← 8
+        "options": [ "--publishers" ],
+        "default": 8,
+        "type": int,
+        "help": \
+                "The number of idle publishers (connections and channels) " \
+                "kept open for publishing; default: %(default)s.",
+        },
+    { # --queue-confirms=MODE; MODE ← batch
+        "options": [ "--confirms" ],
+        "default": "batch",
+        "choices": [ "none", "message", "batch" ],
+        "help": \
+                "How published messages are confirmed by the queue server: " \
+                "none (fire and forget), message (wait for each confirm " \
+                "before the next publish), or batch (publish without " \
+                "waiting and collect confirms as they arrive); default: " \
+                "%(default)s.",
+        },
+    { # --queue-deadline=T; T ← 5
+        "options": [ "--deadline" ],
+        "default": 5,
+        "type": float,
+        "help": \
+                "The number of seconds to wait for a published message to " \
+                "be confirmed before giving up on it; default: " \
+                "%(default)s.",
+        },
     ])
 
 CONNECTION_BROKER = None
 
+EMBEDDED_SCHEMES = [ "memory", "sqlite" ]
+
+def _connect():
+    """Open a new connection to the queue (retrying every queue.wait seconds).
+
+    Returns
+    -------
+
+    A pika.BlockingConnection to queue.url (or an EmbeddedConnection for an
+    embedded queue).
+
+    """
+
+    import pika
+
+    spec = get_connection_spec("queue.url")
+
+    if spec.scheme in EMBEDDED_SCHEMES:
+        from margarine.embeddedqueues import connect
+
+        return connect(spec)
+
+    credentials = None
+    if None not in (spec.username, spec.password):
+        credentials = pika.PlainCredentials(spec.username, spec.password)
+
+    # TODO Add SSL support?
+    connection_parameters = pika.ConnectionParameters(
+            host = spec.host,
+            port = spec.port,
+            virtual_host = spec.path,
+            credentials = credentials,
+            heartbeat_interval = spec.option("heartbeat", None, int),
+            connection_attempts = spec.option("connection_attempts", None, int),
+            retry_delay = spec.option("retry_delay", None, float),
+            socket_timeout = spec.option("socket_timeout", None, float),
+            )
+
+    while True:
+        try:
+            return pika.BlockingConnection(connection_parameters)
+        except (pika.exceptions.AMQPConnectionError) as e:
+            logger.exception(e)
+            time.sleep(int(Parameters()["queue.wait"]))
+
 def get_channel():
     """Using the communication.url parameter get a channel for the queue.
 
     If a connection has already been established we'll simply re-use that
     connection; otherwise, we'll create the connection and return a channel.
 
-    .. note::
-        Currently, we only work with an amqp queue and use pika as the
-        interaction layer.  If we decide to use other queues we'll have to
-        re-evaluate the architecture.
+    The following options are recognized in the query string of the
+    queue.url:
+
+    :heartbeat:           The AMQP heartbeat interval in seconds.
+    :connection_attempts: The number of attempts pika makes per connection.
+    :retry_delay:         The number of seconds between those attempts.
+    :socket_timeout:      The number of seconds to wait on the socket.
+    :prefetch_count:      The number of unacknowledged messages a consumer
+                          (spread) will accept.
+
+    A queue.url of memory:// or sqlite:///PATH selects an embedded queue
+    (see margarine.embeddedqueues) whose channels provide the parts of pika's
+    channel API margarine uses.
 
     Returns
     -------
@@ -69,31 +175,382 @@ def get_channel():
     global CONNECTION_BROKER
 
     if CONNECTION_BROKER is None or not CONNECTION_BROKER.is_open:
-        uri = URI(Parameters()["queue.url"])
+        CONNECTION_BROKER = _connect()
+
+    return CONNECTION_BROKER.channel()
+
+def get_message_properties(content_type = "application/json"):
+    """Create the properties for a message to be published on a channel.
+
+    Parameters
+    ----------
+
+    :content_type: The MIME type of the message body.
+
+    Returns
+    -------
+
+    The (non-durable) properties to pass with a published message.
+
+    """
+
+    import pika
+
+    message_properties = pika.BasicProperties()
+    message_properties.content_type = content_type
+    message_properties.durable = False
+
+    return message_properties
 
-        credentials = None
-        if None not in (uri.username, uri.password):
-            credentials = pika.PlainCredentials(uri.username, uri.password)
+EXCHANGES = {}
 
-        logger.debug("uri.port: %s", uri.port)
+def register_exchange(exchange, type = "topic"):
+    """Register the type exchange is declared with when it's published to.
 
-        # TODO Add SSL support?
-        connection_parameters = pika.ConnectionParameters(
-                host = uri.host,
-                port = uri.port,
-                virtual_host = uri.path,
-                credentials = credentials
-                )
+    Parameters
+    ----------
+
+    :exchange: The exchange's name.
+    :type:     The exchange's type (topic, fanout, direct, &c).
+
+    """
+
+    EXCHANGES[exchange] = type
+
+register_exchange("margarine.articles.topic", "topic")
+register_exchange("margarine.articles.create", "fanout")
+register_exchange("margarine.users.topic", "topic")
+
+class UnconfirmedError(Exception):
+    """A published message wasn't confirmed (nacked or timed out)."""
+
+    pass
+
+def _select_confirms(channel, callback):
+    """Put channel in confirm mode with confirms delivered to callback.
+
+    BlockingChannel.confirm_delivery makes every publish wait for its
+    confirm; the base Channel's delivers confirms to a callback instead.
+
+    """
+
+    import pika
+
+    if not isinstance(channel, pika.channel.Channel): # An embedded queue.
+        return channel.confirm_delivery(callback)
+
+    pika.channel.Channel.confirm_delivery(channel, callback)
+
+class Publisher(object):
+    """A long-lived connection and channel for publishing messages.
+
+    Exchanges declared through a publisher are remembered (declarations last
+    as long as the connection) so each is declared once per connection.
+
+    The channel is used under the publisher's lock so threads sharing the
+    publisher (to wait for batch confirms) don't interleave frames.
+
+    """
+
+    POLL_INTERVAL = 0.1 # The longest a waiting thread sleeps between checks.
+
+    def __init__(self, confirms = None):
+        self.pid = os.getpid()
+        self.url = Parameters()["queue.url"]
+        self.confirms = confirms if confirms is not None else Parameters()["queue.confirms"]
+
+        self.connection = _connect()
+        self.channel = self.connection.channel()
+
+        self.exchanges = set()
+
+        self.lock = threading.RLock()
+        self.confirmed = threading.Condition(self.lock)
+        self.reading = threading.Lock()
+
+        self.published = 0
+        self.outstanding = {}
+
+        if self.confirms == "message":
+            self.channel.confirm_delivery()
+        elif self.confirms == "batch":
+            _select_confirms(self.channel, self._on_confirm)
+
+    @property
+    def is_open(self):
+        """True if the publisher belongs to this process and is still open.
+
+        Publishers connected to an earlier queue.url (or confirming in an
+        earlier queue.confirms mode) are considered closed.
+
+        """
+
+        return self.pid == os.getpid() and self.url == Parameters()["queue.url"] and self.confirms == Parameters()["queue.confirms"] and self.connection.is_open and self.channel.is_open
+
+    def declare(self, exchange):
+        """Declare exchange (once for this connection)."""
+
+        with self.lock:
+            if exchange not in self.exchanges:
+                self.channel.exchange_declare(exchange = exchange, type = EXCHANGES.get(exchange, "topic"), auto_delete = False)
+                self.exchanges.add(exchange)
+
+    def publish(self, exchange, routing_key, body, properties):
+        """Publish body to exchange with routing_key.
+
+        Returns
+        -------
+
+        The delivery tag to wait for (with batch confirms) or None.
+
+        Raises UnconfirmedError if the message is nacked (with message
+        confirms).
+
+        """
+
+        with self.lock:
+            self.declare(exchange)
+
+            if self.confirms == "batch":
+                # Tracked first: an embedded queue confirms during the publish.
+                self.published += 1
+                self.outstanding[self.published] = None
 
-        while True:
             try:
-                CONNECTION_BROKER = pika.BlockingConnection(connection_parameters)
+                confirmed = self.channel.basic_publish(body = body, exchange = exchange, properties = properties, routing_key = routing_key)
+            except Exception:
+                self.outstanding.pop(self.published, None)
+
+                raise
+
+            if self.confirms == "message" and not confirmed:
+                raise UnconfirmedError("{0} nacked the message".format(exchange))
+
+            if self.confirms != "batch":
+                return None
+
+            return self.published
+
+    def wait(self, tag, deadline):
+        """Wait until deadline (a time.time()) for the broker to confirm tag.
+
+        Returns
+        -------
+
+        True if the message was acked, False if it was nacked, or None if the
+        deadline passed first.
+
+        """
+
+        try:
+            while True:
+                with self.lock:
+                    if self.outstanding[tag] is not None or time.time() >= deadline:
+                        return self.outstanding.pop(tag)
+
+                timeout = max(0, min(deadline - time.time(), self.POLL_INTERVAL))
+
+                if self.reading.acquire(False):
+                    try:
+                        self._read(timeout)
+                    finally:
+                        self.reading.release()
+
+                        with self.lock:
+                            self.confirmed.notify_all() # Another waiter reads next.
+                else:
+                    with self.lock:
+                        if self.outstanding[tag] is None:
+                            self.confirmed.wait(timeout)
+        except Exception:
+            with self.lock:
+                self.outstanding.pop(tag, None)
+
+            raise
+
+    def _read(self, timeout):
+        """Process the frames the broker sent (waiting up to timeout for them).
+
+        The wait for the socket is made without the publisher's lock; the lock
+        is only held to process frames that have already arrived.
+
+        """
+
+        fd = getattr(self.connection, "socket", None)
+
+        if fd is not None and not select.select([ fd ], [], [], timeout)[0]:
+            return
+
+        with self.lock:
+            self.connection.process_data_events()
+
+    def _on_confirm(self, frame):
+        """Resolve the tags confirmed by a basic.ack or basic.nack frame.
+
+        Wakes the threads waiting for confirms.
+
+        """
+
+        import pika
+
+        acked = isinstance(frame.method, pika.spec.Basic.Ack)
+
+        with self.lock:
+            if frame.method.multiple:
+                tags = [ _ for _ in self.outstanding.keys() if _ <= frame.method.delivery_tag ]
+            else:
+                tags = [ frame.method.delivery_tag ]
+
+            logger.debug("Confirmed %s messages (acked: %s)", len(tags), acked)
+
+            for tag in tags:
+                if self.outstanding.get(tag, False) is None:
+                    self.outstanding[tag] = acked
+
+            self.confirmed.notify_all()
+
+    def close(self):
+        """Close the connection (unless it was inherited from a parent)."""
+
+        if self.pid != os.getpid():
+            return
+
+        try:
+            self.connection.close()
+        except Exception as e:
+            logger.debug("Ignoring error closing publisher: %s", e)
+
+PUBLISHERS = []
+PUBLISHERS_LOCK = threading.Lock()
+
+def _checkout():
+    """An open publisher from the pool (or a new one)."""
+
+    while True:
+        with PUBLISHERS_LOCK:
+            if not len(PUBLISHERS):
                 break
-            except (pika.exceptions.AMQPConnectionError) as e:
-                logger.exception(e)
-                time.sleep(Parameters()["queue.wait"])
 
-    return CONNECTION_BROKER.channel()
+            publisher = PUBLISHERS.pop()
+
+        if publisher.is_open:
+            return publisher
+
+        logger.info("Discarding closed publisher")
+
+        publisher.close()
+
+    return Publisher()
+
+def _checkin(publisher):
+    """Return publisher to the pool (or close it if the pool is full).
+
+    Publishers with outstanding confirms are kept (even in a full pool) so
+    they aren't closed under their waiting threads.
+
+    """
+
+    with PUBLISHERS_LOCK:
+        if publisher.is_open and ( len(PUBLISHERS) < int(Parameters()["queue.publishers"]) or len(publisher.outstanding) ):
+            PUBLISHERS.append(publisher)
+
+            return
+
+    publisher.close()
+
+def publish(exchange, routing_key, payload, message_type = None):
+    """Publish payload (see margarine.messages) to exchange with routing_key.
+
+    The message is published on a pooled publisher; if the publisher's
+    connection has failed since it was last used the message is published
+    again on a new publisher.  Unless queue.confirms is none this returns
+    once the broker has confirmed the message.  On a memory:// queue the
+    payload isn't serialized (see margarine.messages).
+
+    Parameters
+    ----------
+
+    :exchange:     The exchange to publish to (see register_exchange).
+    :routing_key:  The message's routing key.
+    :payload:      The message's payload (a dict).
+    :message_type: The message's type (see margarine.messages.encode);
+                   defaults to routing_key.
+
+    Raises UnconfirmedError if the broker nacks the message or doesn't
+    confirm it within queue.deadline seconds.
+
+    """
+
+    import pika
+
+    codec = None
+
+    if get_connection_spec("queue.url").scheme == "memory":
+        codec = "object" # Never leaves the process (see margarine.messages).
+
+    body, content_type = encode(message_type or routing_key, payload, codec)
+    properties = get_message_properties(content_type)
+
+    deadline = time.time() + float(Parameters()["queue.deadline"])
+
+    for attempt in range(2):
+        publisher = _checkout()
+
+        try:
+            tag = publisher.publish(exchange, routing_key, body, properties)
+        except (pika.exceptions.AMQPError, socket.error) as e:
+            publisher.close()
+
+            if attempt:
+                raise
+
+            logger.warning("Publishing to %s failed (%s); retrying on a new connection", exchange, e)
+        except UnconfirmedError:
+            _checkin(publisher)
+
+            raise
+        else:
+            _checkin(publisher)
+
+            break
+
+    if tag is None:
+        return
+
+    try:
+        confirmed = publisher.wait(tag, deadline)
+    except (pika.exceptions.AMQPError, socket.error) as e:
+        raise UnconfirmedError("Connection lost before {0} confirmed the message: {1}".format(exchange, e))
+
+    if confirmed is None:
+        raise UnconfirmedError("{0} didn't confirm the message within {1} seconds".format(exchange, Parameters()["queue.deadline"]))
+
+    if not confirmed:
+        raise UnconfirmedError("{0} nacked the message".format(exchange))
+
+def _reset_broker(key, previous, current):
+    """Drop the queue connections when queue.url changes.
+
+    The connection is rebuilt lazily by get_channel.  Channels still in use
+    (i.e. a consumer in spread) keep working until they're closed.  Idle
+    publishers are closed; publishers in use are closed when they're returned.
+
+    """
+
+    global CONNECTION_BROKER
+
+    logger.info("Resetting queue connection for %s", current)
+
+    CONNECTION_BROKER = None
+
+    with PUBLISHERS_LOCK:
+        publishers = PUBLISHERS[:]
+        del PUBLISHERS[:]
+
+    for publisher in publishers:
+        publisher.close()
+
+Parameters().subscribe("queue.url", _reset_broker)
 
 Parameters("email", parameters = [
     { # --email-url=URL; URL ← smtp://localhost
@@ -130,6 +587,11 @@ def send_user_email(user, verification):
 
     """
 
+    import smtplib
+    import email.mime.text
+
+    from flask import url_for
+
     # TODO i18n this stuff!
     message_text = \
             "Thank you for registering for Margarine.  We hope you enjoy " \
@@ -152,14 +614,18 @@ def send_user_email(user, verification):
     message["From"] = "Margarine Verifications <" + Parameters()["email.from"] + ">"
     message["To"] = "{user[name]} <{user[email]}>".format(user = user)
 
-    uri = URI(Parameters()["email.url"])
+    spec = get_connection_spec("email.url")
 
     logger.info("Connecting to SMTP Server.")
+
+    options = {}
+    if spec.option("timeout") is not None:
+        options["timeout"] = spec.option("timeout", type = float)
     
-    _ = smtplib.SMTP(uri.host, uri.port)
+    _ = smtplib.SMTP(spec.host, spec.port, **options)
 
-    if uri.username is not None:
-        _.login(uri.username, uri.password)
+    if spec.username is not None:
+        _.login(spec.username, spec.password)
 
     _.sendmail(Parameters()["email.from"], [ user["email"] ], message.as_string())
     _.quit()
@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Compression of stored article bodies.
+
+Bodies are compressed by spread with the compression.codec codec and the
+codec's name is recorded in the article's encoding field.  Each codec is
+registered with the HTTP content-coding that carries the same bytes so blend
+can send a stored body to clients that accept that coding without
+decompressing it:
+
+:zlib: Content-Encoding: deflate (RFC 2616 deflate is the zlib format).
+:lzma: Content-Encoding: xz (the lzma module's default .xz container).  Only
+       registered (and a compression.codec choice) if the lzma module
+       (backports.lzma on python 2) is installed.
+
+"""
+
+import logging
+import zlib
+
+from margarine.parameters import Parameters
+
+logger = logging.getLogger(__name__)
+
+CODECS = {}
+
+def register_codec(name, content_coding, compress, decompress):
+    """Register a body codec.
+
+    Parameters
+    ----------
+
+    :name:           The name recorded in the article's encoding field.
+    :content_coding: The HTTP content-coding of the compressed bytes.
+    :compress:       A function of ( data, level ) returning the compressed
+                     data.
+    :decompress:     A function of data returning the original data.
+
+    """
+
+    CODECS[name] = ( content_coding, compress, decompress )
+
+def _lzma():
+    """The lzma module (or backports.lzma); None if neither is installed."""
+
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            return None
+
+    return lzma
+
+register_codec("zlib", "deflate", zlib.compress, zlib.decompress)
+
+LZMA = _lzma()
+
+if LZMA is not None:
+    register_codec("lzma", "xz", lambda data, level: LZMA.compress(data, preset = level), LZMA.decompress)
+
+Parameters("compression", parameters = [
+    { # --compression-codec=CODEC; CODEC ← zlib
+        "options": [ "--codec" ],
+        "default": "zlib",
+        "choices": [ "none" ] + sorted(CODECS.keys()),
+        "help": \
+                "The codec article bodies are compressed with when they're " \
+                "stored; default: %(default)s.",
+        },
+    { # --compression-level=N; N ← 6
+        "options": [ "--level" ],
+        "type": int,
+        "default": 6,
+        "help": \
+                "The compression level (zlib: 1–9, lzma: 0–9 preset); " \
+                "default: %(default)s.",
+        },
+    ])
+
+def get_codec():
+    """The configured codec name or None if bodies are stored uncompressed.
+
+    Raises ValueError if the codec isn't available (i.e. lzma without the
+    lzma module); spread checks this when it starts.
+
+    """
+
+    codec = Parameters()["compression.codec"]
+
+    if codec in ( None, "none" ):
+        return None
+
+    if codec not in CODECS:
+        raise ValueError("compression.codec {0} isn't available (lzma needs backports.lzma on python 2)".format(codec))
+
+    return codec
+
+def compress(codec, data):
+    """Compress data (a byte string) with codec (None leaves it as is)."""
+
+    if codec is None:
+        return data
+
+    return CODECS[codec][1](data, int(Parameters()["compression.level"]))
+
+def decompress(codec, data):
+    """Reverse compress(codec, data)."""
+
+    if codec is None:
+        return data
+
+    return CODECS[codec][2](data)
+
+def content_coding(codec):
+    """The HTTP content-coding of data compressed by codec (or None)."""
+
+    if codec is None:
+        return None
+
+    return CODECS[codec][0]
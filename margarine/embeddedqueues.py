@@ -0,0 +1,618 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Embedded queues speaking the subset of pika's channel API margarine uses.
+
+Small deployments don't need a message broker; a queue.url of one of the
+following selects an embedded queue instead:
+
+:memory://:      An in-process queue.  The first connection to it declares
+                 spread's topology and starts spread's consumers in a thread
+                 of the connecting process (i.e. blend however it's run) and
+                 messages are handed to them without leaving the process
+                 (blend must run as a single process).
+:sqlite:///PATH: A durable queue in a SQLite database file shared by the
+                 blend and spread processes on a host.  A delivered message
+                 is hidden from other consumers until it's acked (deleted) or
+                 its visibility timeout passes (and it's redelivered).
+
+Both route messages with the exchanges, queues, and bindings declared on
+their channels (i.e. by margarine.spread.users.register and
+margarine.spread.articles.register): topic, fanout, and direct exchanges
+deliver a copy of each message to every queue bound with a matching routing
+key and unroutable messages are dropped (as with AMQP).  The SQLite queue
+keeps its topology in the database so blend routes messages with the
+bindings spread declared.
+
+The following option is recognized in the query string of a memory
+queue.url:
+
+:max_deliveries: The number of times a message whose consumer fails is
+                 delivered before it's dropped (default: 5).
+
+The following options are recognized in the query string of a sqlite
+queue.url:
+
+:visibility_timeout: The number of seconds a delivered message is hidden
+                     before it's redelivered (default: 30).
+:poll_interval:      The number of seconds an idle consumer waits before
+                     checking for messages again (default: 0.1).
+:timeout:            The number of seconds to wait for a locked database
+                     (default: 5).
+
+Publisher confirms are given as soon as a message is queued (in memory or
+committed to the database).
+
+"""
+
+import collections
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+
+from margarine.sqlitestore import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+Method = collections.namedtuple("Method", [ "delivery_tag", "exchange", "routing_key", "redelivered" ])
+Properties = collections.namedtuple("Properties", [ "content_type" ])
+Frame = collections.namedtuple("Frame", [ "method" ])
+
+Delivery = collections.namedtuple("Delivery", [ "tag", "queue", "exchange", "routing_key", "body", "content_type", "redelivered" ])
+
+def _topic_matches(pattern, words):
+    """True if the words of a routing key match the words of a binding key.
+
+    ``*`` matches exactly one word and ``#`` matches zero or more words.
+
+    """
+
+    if not len(pattern):
+        return not len(words)
+
+    if pattern[0] == "#":
+        return any([ _topic_matches(pattern[1:], words[_:]) for _ in range(len(words) + 1) ])
+
+    return len(words) > 0 and pattern[0] in ( "*", words[0] ) and _topic_matches(pattern[1:], words[1:])
+
+def matches(type, binding_key, routing_key):
+    """True if a message with routing_key is routed by a binding_key binding.
+
+    Parameters
+    ----------
+
+    :type:        The exchange's type (topic, fanout, or direct).
+    :binding_key: The routing key of the queue's binding.
+    :routing_key: The routing key of the message.
+
+    """
+
+    if type == "fanout":
+        return True
+
+    if type == "topic":
+        return _topic_matches(( binding_key or "" ).split("."), ( routing_key or "" ).split("."))
+
+    return binding_key == routing_key
+
+class MemoryBroker(object):
+    """Exchanges, queues, and messages in this process' memory.
+
+    Parameters
+    ----------
+
+    :max_deliveries: The number of times a message whose consumer fails is
+                     delivered before it's dropped.
+
+    """
+
+    def __init__(self, max_deliveries = 5):
+        self.max_deliveries = max_deliveries
+
+        self.exchanges = {}
+        self.bindings = collections.defaultdict(set)
+        self.queues = {}
+
+        self._unacked = {}
+        self._tags = itertools.count(1)
+        self._offset = itertools.count()
+
+        self._condition = threading.Condition()
+
+    def declare_exchange(self, exchange, type):
+        with self._condition:
+            self.exchanges[exchange] = type
+
+    def declare_queue(self, queue):
+        with self._condition:
+            self.queues.setdefault(queue, collections.deque())
+
+    def bind(self, queue, exchange, routing_key):
+        with self._condition:
+            self.queues.setdefault(queue, collections.deque())
+            self.bindings[exchange].add(( queue, routing_key ))
+
+    def publish(self, exchange, routing_key, body, content_type):
+        with self._condition:
+            type = self.exchanges.get(exchange, "direct")
+
+            queues = set([ queue for queue, binding_key in self.bindings[exchange] if matches(type, binding_key, routing_key) ])
+
+            for queue in queues:
+                self.queues[queue].append(( exchange, routing_key, body, content_type, 0 ))
+
+            if len(queues):
+                self._condition.notify_all()
+
+    def get(self, queues, timeout = 0):
+        """The next message on one of queues.
+
+        Waits (at most timeout seconds) for a message to be published if the
+        queues are empty.
+
+        Returns
+        -------
+
+        A Delivery (or None if the queues are still empty).
+
+        """
+
+        deadline = time.time() + timeout
+
+        with self._condition:
+            while True:
+                offset = next(self._offset)
+
+                for index in range(len(queues)):
+                    queue = queues[( offset + index ) % len(queues)]
+
+                    if len(self.queues.get(queue, ())):
+                        message = self.queues[queue].popleft()
+                        message = message[:-1] + ( message[-1] + 1, ) # Deliveries.
+
+                        tag = next(self._tags)
+
+                        self._unacked[tag] = ( queue, message )
+
+                        return Delivery(tag, queue, *( message[:-1] + ( message[-1] > 1, ) ))
+
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    return None
+
+                self._condition.wait(remaining)
+
+    def ack(self, tag):
+        with self._condition:
+            self._unacked.pop(tag, None)
+
+    def reject(self, tag, requeue = True):
+        with self._condition:
+            queue, message = self._unacked.pop(tag, ( None, None ))
+
+            if requeue and queue is not None:
+                self.queues[queue].appendleft(message)
+                self._condition.notify_all()
+
+    def abandon(self, tag):
+        """Give up on a message whose consumer failed.
+
+        The message is requeued (behind the queue's other messages) until it's
+        been delivered max_deliveries times; then it's dropped.
+
+        """
+
+        with self._condition:
+            queue, message = self._unacked.pop(tag, ( None, None ))
+
+            if queue is None:
+                return
+
+            if message[-1] >= self.max_deliveries:
+                logger.warning("Dropping a message on %s after %s deliveries", queue, message[-1])
+
+                return
+
+            self.queues[queue].append(message)
+            self._condition.notify_all()
+
+    def purge(self, queue):
+        with self._condition:
+            self.queues.get(queue, collections.deque()).clear()
+
+    def delete_queue(self, queue):
+        with self._condition:
+            self.queues.pop(queue, None)
+
+            for bindings in self.bindings.values():
+                bindings.difference_update([ _ for _ in bindings if _[0] == queue ])
+
+    def delete_exchange(self, exchange):
+        with self._condition:
+            self.exchanges.pop(exchange, None)
+            self.bindings.pop(exchange, None)
+
+SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS exchanges ( name TEXT PRIMARY KEY, type TEXT NOT NULL )",
+        "CREATE TABLE IF NOT EXISTS queues ( name TEXT PRIMARY KEY )",
+        "CREATE TABLE IF NOT EXISTS bindings ( exchange TEXT NOT NULL, queue TEXT NOT NULL, routing_key TEXT NOT NULL, PRIMARY KEY ( exchange, queue, routing_key ) )",
+        "CREATE TABLE IF NOT EXISTS messages ( id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, exchange TEXT, routing_key TEXT, body BLOB, content_type TEXT, visible_at REAL NOT NULL, deliveries INTEGER NOT NULL DEFAULT 0 )",
+        "CREATE INDEX IF NOT EXISTS messages_queue_visible_at ON messages ( queue, visible_at, id )",
+        ]
+
+class SQLiteBroker(object):
+    """Exchanges, queues, and messages in a SQLite database file.
+
+    Parameters
+    ----------
+
+    :path:               The SQLite database file.
+    :visibility_timeout: The number of seconds a delivered message is hidden
+                         before it's redelivered.
+    :poll_interval:      The number of seconds between polls for messages.
+    :timeout:            The number of seconds to wait for a locked database.
+
+    """
+
+    def __init__(self, path, visibility_timeout = 30.0, poll_interval = 0.1, timeout = 5.0):
+        self.database = SQLiteDatabase(path, timeout = timeout)
+
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+
+        connection = self.database.connection()
+
+        for statement in SCHEMA:
+            connection.execute(statement)
+
+    def _transaction(self, statements):
+        """Execute ( sql, parameters ) statements in a write transaction."""
+
+        connection = self.database.connection()
+
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            for sql, parameters in statements:
+                connection.execute(sql, parameters)
+        except Exception:
+            connection.execute("ROLLBACK")
+
+            raise
+
+        connection.execute("COMMIT")
+
+    def declare_exchange(self, exchange, type):
+        self._transaction([ ( "INSERT OR REPLACE INTO exchanges ( name, type ) VALUES ( ?, ? )", [ exchange, type ] ) ])
+
+    def declare_queue(self, queue):
+        self._transaction([ ( "INSERT OR IGNORE INTO queues ( name ) VALUES ( ? )", [ queue ] ) ])
+
+    def bind(self, queue, exchange, routing_key):
+        self._transaction([
+            ( "INSERT OR IGNORE INTO queues ( name ) VALUES ( ? )", [ queue ] ),
+            ( "INSERT OR IGNORE INTO bindings ( exchange, queue, routing_key ) VALUES ( ?, ?, ? )", [ exchange, queue, routing_key or "" ] ),
+            ])
+
+    def publish(self, exchange, routing_key, body, content_type):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+
+        connection = self.database.connection()
+
+        row = connection.execute("SELECT type FROM exchanges WHERE name = ?", [ exchange ]).fetchone()
+
+        type = row[0] if row is not None else "direct"
+
+        bindings = connection.execute("SELECT queue, routing_key FROM bindings WHERE exchange = ?", [ exchange ]).fetchall()
+
+        queues = sorted(set([ queue for queue, binding_key in bindings if matches(type, binding_key, routing_key) ]))
+
+        if not len(queues):
+            logger.debug("Dropping unroutable message for %s (%s)", exchange, routing_key)
+
+            return
+
+        self._transaction([ ( "INSERT INTO messages ( queue, exchange, routing_key, body, content_type, visible_at ) VALUES ( ?, ?, ?, ?, ?, 0 )", [ queue, exchange, routing_key, sqlite3.Binary(body), content_type ] ) for queue in queues ])
+
+    def get(self, queues, timeout = 0):
+        """The next visible message on one of queues.
+
+        The message is hidden for visibility_timeout seconds; it must be acked
+        before then or it's redelivered.  If there isn't a visible message the
+        queues are polled every poll_interval seconds for at most timeout
+        seconds.
+
+        Returns
+        -------
+
+        A Delivery (or None if there still isn't a visible message).
+
+        """
+
+        deadline = time.time() + timeout
+
+        while True:
+            delivery = self._claim(queues)
+
+            if delivery is not None or time.time() + self.poll_interval > deadline:
+                return delivery
+
+            time.sleep(self.poll_interval)
+
+    def _claim(self, queues):
+        connection = self.database.connection()
+
+        sql = "SELECT id, queue, exchange, routing_key, body, content_type, deliveries FROM messages WHERE queue IN ( {0} ) AND visible_at <= ? ORDER BY id LIMIT 1".format(", ".join([ "?" ] * len(queues)))
+
+        if connection.execute(sql, list(queues) + [ time.time() ]).fetchone() is None:
+            return None # Checked without taking the write lock.
+
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            now = time.time()
+
+            row = connection.execute(sql, list(queues) + [ now ]).fetchone()
+
+            if row is not None:
+                connection.execute("UPDATE messages SET visible_at = ?, deliveries = deliveries + 1 WHERE id = ?", [ now + self.visibility_timeout, row[0] ])
+        except Exception:
+            connection.execute("ROLLBACK")
+
+            raise
+
+        connection.execute("COMMIT")
+
+        if row is None:
+            return None
+
+        return Delivery(row[0], row[1], row[2], row[3], bytes(row[4]), row[5], row[6] > 0)
+
+    def ack(self, tag):
+        self._transaction([ ( "DELETE FROM messages WHERE id = ?", [ tag ] ) ])
+
+    def reject(self, tag, requeue = True):
+        if requeue:
+            self._transaction([ ( "UPDATE messages SET visible_at = 0 WHERE id = ?", [ tag ] ) ])
+        else:
+            self.ack(tag)
+
+    def abandon(self, tag):
+        """Give up on a message whose consumer failed.
+
+        The message is left hidden and redelivered when its visibility timeout
+        passes.
+
+        """
+
+        pass
+
+    def purge(self, queue):
+        self._transaction([ ( "DELETE FROM messages WHERE queue = ?", [ queue ] ) ])
+
+    def delete_queue(self, queue):
+        self._transaction([
+            ( "DELETE FROM messages WHERE queue = ?", [ queue ] ),
+            ( "DELETE FROM bindings WHERE queue = ?", [ queue ] ),
+            ( "DELETE FROM queues WHERE name = ?", [ queue ] ),
+            ])
+
+    def delete_exchange(self, exchange):
+        self._transaction([
+            ( "DELETE FROM bindings WHERE exchange = ?", [ exchange ] ),
+            ( "DELETE FROM exchanges WHERE name = ?", [ exchange ] ),
+            ])
+
+class EmbeddedConnection(object):
+    """The connection to an embedded broker (there's nothing to connect)."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+        self.is_open = True
+
+    def channel(self):
+        return EmbeddedChannel(self)
+
+    def process_data_events(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+class EmbeddedChannel(object):
+    """A channel to an embedded broker.
+
+    Provides the parts of pika's BlockingChannel that margarine uses: topology
+    declarations, publishing (with confirms), consuming, and acks.
+
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+
+        self.is_open = True
+
+        self._consumers = collections.OrderedDict()
+        self._consuming = False
+
+        self._confirm = None
+        self._published = 0
+
+    def exchange_declare(self, exchange, type = "direct", auto_delete = False, **kwargs):
+        self.broker.declare_exchange(exchange, type)
+
+    def queue_declare(self, queue, auto_delete = False, **kwargs):
+        self.broker.declare_queue(queue)
+
+    def queue_bind(self, queue, exchange, routing_key = None, **kwargs):
+        self.broker.bind(queue, exchange, routing_key)
+
+    def queue_purge(self, queue):
+        self.broker.purge(queue)
+
+    def queue_delete(self, queue, **kwargs):
+        self.broker.delete_queue(queue)
+
+    def exchange_delete(self, exchange, **kwargs):
+        self.broker.delete_exchange(exchange)
+
+    def basic_qos(self, prefetch_count = 0, **kwargs):
+        pass # Messages are delivered one at a time.
+
+    def confirm_delivery(self, callback = None, nowait = False):
+        """Confirm publishes (to callback if given, else by their return)."""
+
+        self._confirm = callback or True
+
+    def basic_publish(self, exchange, routing_key, body, properties = None, mandatory = False, immediate = False):
+        import pika
+
+        if not self.is_open:
+            raise pika.exceptions.ChannelClosed()
+
+        self.broker.publish(exchange, routing_key, body, getattr(properties, "content_type", None))
+
+        if self._confirm is None:
+            return None
+
+        self._published += 1
+
+        if callable(self._confirm):
+            self._confirm(Frame(pika.spec.Basic.Ack(delivery_tag = self._published, multiple = False)))
+
+        return True
+
+    def basic_consume(self, consumer_callback, queue, no_ack = False, exclusive = False, consumer_tag = None, arguments = None):
+        self._consumers[queue] = ( consumer_callback, no_ack )
+
+        return consumer_tag
+
+    def basic_ack(self, delivery_tag = 0, multiple = False):
+        self.broker.ack(delivery_tag)
+
+    def basic_nack(self, delivery_tag = None, multiple = False, requeue = True):
+        self.broker.reject(delivery_tag, requeue)
+
+    def basic_reject(self, delivery_tag = None, requeue = True):
+        self.broker.reject(delivery_tag, requeue)
+
+    def start_consuming(self):
+        """Deliver messages to the consumers until stop_consuming or close.
+
+        A consumer that raises is logged and its message abandoned (see the
+        broker's abandon).
+
+        """
+
+        self._consuming = True
+
+        queues = list(self._consumers.keys())
+
+        while self._consuming and self.is_open:
+            delivery = self.broker.get(queues, 1.0)
+
+            if delivery is None:
+                continue
+
+            callback, no_ack = self._consumers[delivery.queue]
+
+            method = Method(delivery.tag, delivery.exchange, delivery.routing_key, delivery.redelivered)
+
+            try:
+                callback(self, method, Properties(delivery.content_type), delivery.body)
+            except Exception:
+                logger.exception("Consumer of %s failed", delivery.queue)
+
+                self.broker.abandon(delivery.tag)
+
+                continue
+
+            if no_ack:
+                self.broker.ack(delivery.tag)
+
+    def stop_consuming(self, consumer_tag = None):
+        self._consuming = False
+
+    def close(self):
+        self._consuming = False
+        self.is_open = False
+
+BROKERS = {}
+BROKERS_LOCK = threading.Lock()
+
+def _start_consumers(broker):
+    """Run spread's consumers on a new memory broker in a thread.
+
+    The topology is declared before returning so nothing published on the
+    broker is dropped (as unroutable) before the consumers are running.
+
+    Parameters
+    ----------
+
+    :broker: The new MemoryBroker.
+
+    """
+
+    from margarine.spread import articles
+    from margarine.spread import run
+    from margarine.spread import users
+
+    channel = EmbeddedConnection(broker).channel()
+
+    users.register(channel)
+    articles.register(channel)
+
+    channel.close()
+
+    logger.info("Consuming the in-process queue")
+
+    thread = threading.Thread(target = run, name = "spread")
+    thread.daemon = True
+    thread.start()
+
+def connect(spec):
+    """A connection to the embedded broker for a queue.url spec.
+
+    Brokers are shared by every connection in the process to the same URL.
+    The first connection to a memory:// broker starts spread's consumers (see
+    _start_consumers).
+
+    Parameters
+    ----------
+
+    :spec: The ConnectionSpec of a memory:// or sqlite:///PATH queue.url.
+
+    Returns
+    -------
+
+    An EmbeddedConnection.
+
+    """
+
+    with BROKERS_LOCK:
+        if spec.url not in BROKERS:
+            if spec.scheme == "memory":
+                BROKERS[spec.url] = MemoryBroker(max_deliveries = spec.option("max_deliveries", 5, int))
+
+                _start_consumers(BROKERS[spec.url])
+            elif spec.scheme == "sqlite":
+                BROKERS[spec.url] = SQLiteBroker(
+                        spec.path,
+                        visibility_timeout = spec.option("visibility_timeout", 30.0, float),
+                        poll_interval = spec.option("poll_interval", 0.1, float),
+                        timeout = spec.option("timeout", 5.0, float),
+                        )
+            else:
+                raise ValueError("Unsupported embedded queue: {0}".format(spec.url))
+
+        return EmbeddedConnection(BROKERS[spec.url])
@@ -6,8 +6,26 @@
 import logging
 import re
 
+try:
+    import urlparse
+    import urllib
+except ImportError:
+    import urllib.parse as urlparse
+    import urllib.parse as urllib
+
+from margarine.parameters import Parameters
+
 logger = logging.getLogger(__name__)
 
+URI_PATTERN = re.compile( \
+        r'((?P<scheme>[^:]+)://)?' \
+        r'((?P<username>[^:]+)(:(?P<password>[^@]+))?@)?' \
+        r'(?P<host>[^:/\?]+)?' \
+        r'(:(?P<port>[^/\?]+))?' \
+        r'(?P<path>/[^\?]+)?' \
+        r'(\?(?P<query>.*))?' \
+        )
+
 class URI(object):
     '''A URI with accessible components.
 
@@ -31,13 +49,7 @@ class URI(object):
     def __init__(self, uri):
         self.uri = uri
 
-        match = re.match( \
-                r'((?P<scheme>[^:]+)://)?' \
-                r'((?P<username>[^:]+)(:(?P<password>[^@]+))?@)?' \
-                r'(?P<host>[^:/]+)?' \
-                r'(:(?P<port>[^/]+))?' \
-                r'(?P<path>/[^\?]+)?' \
-                , self.uri)
+        match = URI_PATTERN.match(self.uri)
 
         self.scheme = match.group("scheme")
         self.username = match.group("username")
@@ -45,5 +57,195 @@ class URI(object):
         self.host = match.group("host")
         self.port = match.group("port")
         self.path = match.group("path")
+        self.query = match.group("query")
+
+    def __str__(self):
+        uri = ""
+
+        if self.scheme is not None:
+            uri += self.scheme + "://"
+
+        if self.username is not None:
+            uri += self.username
+
+            if self.password is not None:
+                uri += ":" + self.password
+
+            uri += "@"
+
+        if self.host is not None:
+            uri += self.host
+
+        if self.port is not None:
+            uri += ":" + str(self.port)
+
+        if self.path is not None:
+            uri += self.path
+
+        if self.query:
+            uri += "?" + self.query
+
+        return uri
+
+    def __repr__(self):
+        return repr(str(self))
+
+class ConnectionSpec(object):
+    '''An immutable, parsed service URL.
+
+    The components of the URL are parsed once (when the spec is created) and
+    the query string is interpreted as tuning options for the connection
+    (i.e. pool sizes, timeouts, &c).  Each backend decides which options it
+    understands.
+
+    Examples
+    --------
+
+    >>> spec = ConnectionSpec('redis://localhost:6379?max_connections=20')
+    >>> spec.port
+    6379
+    >>> spec.option('max_connections', 50, int)
+    20
+
+    '''
+
+    __slots__ = [
+            "url",
+            "scheme",
+            "username",
+            "password",
+            "host",
+            "port",
+            "path",
+            "options",
+            ]
+
+    def __init__(self, url):
+        uri = URI(url)
+
+        port = uri.port
+        if port is not None:
+            port = int(port)
+
+        options = tuple(urlparse.parse_qsl(uri.query or ""))
+
+        for name, value in zip(self.__slots__, (url, uri.scheme, uri.username, uri.password, uri.host, port, uri.path, options)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConnectionSpec is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ConnectionSpec is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, ConnectionSpec) and self.url == other.url
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.url)
+
+    def __str__(self):
+        return self.url
+
+    def __repr__(self):
+        return "ConnectionSpec({0!r})".format(self.url)
+
+    def option(self, name, default = None, type = str):
+        '''Retrieve the tuning option, name, from the query string.
+
+        Parameters
+        ----------
+
+        :name:    The name of the option in the query string.
+        :default: The value returned if the option isn't present.
+        :type:    The callable used to convert the option's value.
+
+        '''
+
+        for key, value in reversed(self.options):
+            if key == name:
+                return type(value)
+
+        return default
+
+    def without(self, *names):
+        '''The URL without the given options in the query string.
+
+        Useful for passing the URL to a client library that rejects options it
+        doesn't recognize.
+
+        '''
+
+        if not any(_[0] in names for _ in self.options):
+            return self.url
+
+        uri = URI(self.url)
+        uri.query = urllib.urlencode([ _ for _ in self.options if _[0] not in names ])
+
+        return str(uri)
+
+CONNECTION_SPECS = {}
+
+def get_connection_spec(parameter):
+    '''Retrieve the parsed ConnectionSpec for the URL parameter given.
+
+    The URL is only parsed the first time it's requested or when its value
+    changes (i.e. the configuration was reloaded).
+
+    Parameters
+    ----------
+
+    :parameter: The key of the URL parameter (i.e. "keystore.url").
+
+    Returns
+    -------
+
+    The ConnectionSpec for the current value of the parameter.
+
+    '''
+
+    url = Parameters()[parameter]
+
+    spec = CONNECTION_SPECS.get(parameter)
+
+    if spec is None or spec.url != url:
+        logger.info("Parsing %s: %s", parameter, url)
+
+        spec = CONNECTION_SPECS[parameter] = ConnectionSpec(url)
+
+    return spec
+
+CONNECTION_SPEC_LISTS = {}
+
+def get_connection_specs(parameter):
+    '''Retrieve the parsed ConnectionSpecs for the URL list parameter given.
+
+    The parameter's value is a list of URLs separated by commas or whitespace
+    (i.e. "redis://first, redis://second").  Like get_connection_spec, the
+    URLs are only parsed when the value changes.
+
+    Parameters
+    ----------
+
+    :parameter: The key of the URL list parameter (i.e. "keystore.url").
+
+    Returns
+    -------
+
+    A tuple of ConnectionSpecs in the order the URLs were given.
+
+    '''
+
+    urls = Parameters()[parameter]
+
+    cached = CONNECTION_SPEC_LISTS.get(parameter)
+
+    if cached is None or cached[0] != urls:
+        logger.info("Parsing %s: %s", parameter, urls)
+
+        cached = CONNECTION_SPEC_LISTS[parameter] = ( urls, tuple([ ConnectionSpec(_) for _ in re.split(r'[\s,]+', urls.strip()) ]) )
 
-    # TODO Add __str__ method for constructing str().
+    return cached[1]
@@ -5,11 +5,20 @@
 # margarine is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
-import redis
+import atexit
+import bisect
+import contextlib
+import datetime
+import hashlib
+import heapq
+import json
 import logging
+import os
+import threading
+import time
 
 from margarine.parameters import Parameters
-from margarine.helpers import URI
+from margarine.helpers import get_connection_specs
 
 logger = logging.getLogger(__name__)
 
@@ -18,22 +27,990 @@ Parameters("keystore", parameters = [
         "options": [ "--url" ],
         "metavar": "TOKENS_URL",
         "default": "redis://localhost",
-        "help": "The token storage system to use; defaults: %(default)s.",
+        "help": \
+                "The token storage system to use.  Either Redis URLs " \
+                "(separated by commas to shard keys across them) or " \
+                "memory:///PATH for an in-process keystore (optionally " \
+                "snapshotted to PATH); defaults: %(default)s.",
         },
     ])
 
+KEYSTORE_CLIENTS = {}
 KEYSTORE_CONNECTIONS = {}
 
+class ConnectionPool(object):
+    """A bounded, thread-safe and fork-safe pool of Redis connections.
+
+    Implements the interface redis.Redis expects of its connection_pool.
+    Connections are created on demand up to max_connections; once that many
+    are checked out, get_connection blocks for up to timeout seconds waiting
+    for one to be released.  Connections that sit idle for longer than
+    idle_timeout seconds are disconnected.
+
+    If the process forks, the child discards the parent's connections (without
+    touching their sockets) and starts with an empty pool.
+
+    Parameters
+    ----------
+
+    :max_connections:   The maximum number of connections to open.
+    :timeout:           The number of seconds to wait for a connection before
+                        raising redis.ConnectionError; None waits forever.
+    :idle_timeout:      The number of seconds a connection may sit unused
+                        before it's disconnected; None never reaps.
+    :connection_class:  The class of the connections to create; defaults to
+                        redis.Connection.
+    :connection_kwargs: The arguments passed to connection_class.
+
+    """
+
+    def __init__(self, max_connections = 50, timeout = 20, idle_timeout = 300, connection_class = None, **connection_kwargs):
+        if connection_class is None:
+            import redis
+
+            connection_class = redis.Connection
+
+        if max_connections < 1:
+            raise ValueError("max_connections must be a positive integer")
+
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.connection_class = connection_class
+        self.connection_kwargs = connection_kwargs
+
+        self._condition = threading.Condition()
+
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+
+        self._idle = [] # [ ( released_at, connection ) ] oldest first
+        self._created = 0
+
+    def _checkpid(self):
+        if self.pid != os.getpid():
+            logger.info("Discarding %s keystore connections inherited from %s", self._created, self.pid)
+
+            self._reset()
+
+    def _reap(self):
+        if self.idle_timeout is None:
+            return
+
+        cutoff = time.time() - self.idle_timeout
+
+        while len(self._idle) and self._idle[0][0] < cutoff:
+            _, connection = self._idle.pop(0)
+
+            logger.debug("Disconnecting idle keystore connection: %s", connection)
+
+            connection.disconnect()
+
+            self._created -= 1
+
+    def make_connection(self):
+        return self.connection_class(**self.connection_kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        with self._condition:
+            self._checkpid()
+            self._reap()
+
+            deadline = None if self.timeout is None else time.time() + self.timeout
+
+            while not len(self._idle) and self._created >= self.max_connections:
+                remaining = None if deadline is None else deadline - time.time()
+
+                if remaining is not None and remaining <= 0:
+                    import redis
+
+                    raise redis.ConnectionError("No keystore connection available after {0}s.".format(self.timeout))
+
+                self._condition.wait(remaining)
+
+            if len(self._idle):
+                return self._idle.pop()[1]
+
+            self._created += 1
+
+        try:
+            return self.make_connection()
+        except:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+
+            raise
+
+    def release(self, connection):
+        with self._condition:
+            self._checkpid()
+
+            if getattr(connection, "pid", self.pid) != self.pid:
+                return
+
+            self._idle.append(( time.time(), connection ))
+            self._condition.notify()
+
+    def statistics(self):
+        """The number of connections open, idle, and allowed."""
+
+        with self._condition:
+            return {
+                    "connections": self._created,
+                    "idle": len(self._idle),
+                    "max_connections": self.max_connections,
+                    }
+
+    def disconnect(self):
+        with self._condition:
+            for _, connection in self._idle:
+                connection.disconnect()
+
+            self._created -= len(self._idle)
+            self._idle = []
+
+def _now():
+    return time.time()
+
+def _seconds(time):
+    if isinstance(time, datetime.timedelta):
+        return time.days * 86400 + time.seconds + time.microseconds / 1e6
+
+    return time
+
+class MemoryClient(object):
+    """An in-process keystore with the Redis commands margarine uses.
+
+    Strings and sorted sets (stored as dicts of member to score) are
+    supported.
+
+    Entries are kept in a dict and expired lazily: every write with a TTL
+    pushes its deadline onto a min-heap and every command first pops the
+    deadlines that have passed.  Heap entries for keys that were since
+    rewritten or deleted are skipped, so no command scans the whole store.
+
+    All commands hold one lock so the client is safe to share between threads,
+    but every process has its own store; use Redis when more than one process
+    (e.g. several WSGI workers) must see the same keys.
+
+    If a path is given, the store is written there (atomically) every interval
+    seconds and at exit and is read back on creation, so issued tokens survive
+    restarts.
+
+    Parameters
+    ----------
+
+    :path:     The file to snapshot the store to; None disables snapshots.
+    :interval: The number of seconds between snapshots.
+
+    """
+
+    def __init__(self, path = None, interval = 60):
+        self.path = path
+        self.interval = interval
+
+        self._lock = threading.RLock()
+
+        self._data = {} # key → ( value, deadline or None )
+        self._deadlines = [] # [ ( deadline, key ) ]
+
+        if self.path is not None:
+            self._load()
+
+            self._snapshotter = threading.Thread(target = self._snapshot_periodically, name = "keystore-snapshot")
+            self._snapshotter.daemon = True
+            self._snapshotter.start()
+
+            atexit.register(self._try_snapshot)
+
+    def __repr__(self):
+        return "MemoryClient({0!r})".format(self.path)
+
+    def _expire(self):
+        now = _now()
+
+        while len(self._deadlines) and self._deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self._deadlines)
+
+            if key in self._data and self._data[key][1] == deadline:
+                del self._data[key]
+
+    def _store(self, key, value, deadline = None):
+        self._data[key] = ( value, deadline )
+
+        if deadline is not None:
+            heapq.heappush(self._deadlines, ( deadline, key ))
+
+    def get(self, name):
+        with self._lock:
+            self._expire()
+
+            return self._data.get(name, ( None, None ))[0]
+
+    def set(self, name, value):
+        with self._lock:
+            self._store(name, value)
+
+            return True
+
+    def setex(self, name, value, time):
+        with self._lock:
+            self._store(name, value, _now() + _seconds(time))
+
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            self._expire()
+
+            return len([ self._data.pop(_) for _ in names if _ in self._data ])
+
+    def exists(self, name):
+        with self._lock:
+            self._expire()
+
+            return name in self._data
+
+    def expire(self, name, time):
+        with self._lock:
+            self._expire()
+
+            if name not in self._data:
+                return False
+
+            self._store(name, self._data[name][0], _now() + _seconds(time))
+
+            return True
+
+    def ttl(self, name):
+        with self._lock:
+            self._expire()
+
+            deadline = self._data.get(name, ( None, None ))[1]
+
+            if deadline is None:
+                return None
+
+            return int(round(deadline - _now()))
+
+    def zadd(self, name, member, score):
+        with self._lock:
+            self._expire()
+
+            members = self._data.get(name, ( {}, None ))[0]
+
+            added = int(member not in members)
+            members[member] = float(score)
+
+            if name not in self._data:
+                self._store(name, members)
+
+            return added
+
+    def _members(self, name, min, max):
+        members = self._data.get(name, ( {}, None ))[0]
+
+        return [ _ for _ in members.items() if float(min) <= _[1] <= float(max) ]
+
+    def zrangebyscore(self, name, min, max):
+        with self._lock:
+            self._expire()
+
+            return [ _[0] for _ in sorted(self._members(name, min, max), key = lambda _: ( _[1], _[0] )) ]
+
+    def zremrangebyscore(self, name, min, max):
+        with self._lock:
+            self._expire()
+
+            removed = self._members(name, min, max)
+
+            for member, _ in removed:
+                del self._data[name][0][member]
+
+            return len(removed)
+
+    def ping(self):
+        return True
+
+    def run_script(self, script, keys, args):
+        """Run script's python implementation atomically with keys and args."""
+
+        with self._lock:
+            return script.function(self, keys, args)
+
+    def pipeline(self, transaction = True):
+        return MemoryPipeline(self)
+
+    def snapshot(self):
+        """Write the unexpired entries to path."""
+
+        with self._lock:
+            self._expire()
+
+            entries = dict(self._data)
+
+        temporary = self.path + ".tmp"
+
+        with open(temporary, "w") as fh:
+            json.dump(entries, fh)
+
+        os.rename(temporary, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as fh:
+                entries = json.load(fh)
+        except ValueError:
+            logger.exception("Ignoring corrupt keystore snapshot: %s", self.path)
+
+            return
+
+        with self._lock:
+            for key, ( value, deadline ) in entries.items():
+                self._store(key, value, deadline)
+
+            self._expire()
+
+        logger.info("Loaded %s keys from %s", len(self._data), self.path)
+
+    def _try_snapshot(self):
+        try:
+            self.snapshot()
+        except (IOError, OSError):
+            logger.exception("Failed to snapshot keystore to %s", self.path)
+
+    def _snapshot_periodically(self):
+        while True:
+            time.sleep(self.interval)
+
+            self._try_snapshot()
+
+class MemoryPipeline(object):
+    """Commands queued for a MemoryClient and applied atomically."""
+
+    def __init__(self, client):
+        self.client = client
+
+        self._commands = []
+
+    def __getattr__(self, command):
+        if command.startswith("_"):
+            raise AttributeError(command)
+
+        def _queue(*args):
+            self._commands.append(( command, args ))
+
+            return self
+
+        return _queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+
+        with self.client._lock:
+            return [ getattr(self.client, command)(*args) for command, args in commands ]
+
+def _hash_key(key):
+    """The part of key that determines its shard.
+
+    As in Redis Cluster, if key contains a non-empty hash tag (a substring
+    between the first { and the following }) only the tag is hashed, so keys
+    that share a tag are always stored on the same shard.
+
+    """
+
+    start = key.find("{")
+
+    if start > -1:
+        end = key.find("}", start + 1)
+
+        if end > start + 1:
+            return key[start + 1:end]
+
+    return key
+
+def _hash(value):
+    return int(hashlib.md5(value.encode("utf-8") if not isinstance(value, bytes) else value).hexdigest()[:8], 16)
+
+class ShardedClient(object):
+    """Routes the Redis commands margarine uses across several keystores.
+
+    Keys are assigned to shards by a consistent-hash ring: each shard is
+    hashed onto the ring at weight × replicas points (virtual nodes) and a key
+    belongs to the first point at or after its hash.  Adding or removing a
+    shard therefore only moves the keys between its points and their
+    predecessors (roughly 1/N of the keys) rather than rehashing everything.
+
+    Shards are identified on the ring by their name (host, port, and database)
+    so changing a shard's password or tuning options doesn't move keys.
+
+    Parameters
+    ----------
+
+    :shards:   A list of ( name, client, weight ) tuples.
+    :replicas: The number of virtual nodes per unit of weight.
+
+    """
+
+    def __init__(self, shards, replicas = 160):
+        self.shards = [ ( name, client ) for name, client, _ in shards ]
+
+        ring = []
+
+        for index, ( name, _, weight ) in enumerate(shards):
+            for replica in range(weight * replicas):
+                ring.append(( _hash("{0}-{1}".format(name, replica)), index ))
+
+        ring.sort()
+
+        self._points = [ _[0] for _ in ring ]
+        self._indices = [ _[1] for _ in ring ]
+
+    def __repr__(self):
+        return "ShardedClient({0!r})".format([ _[0] for _ in self.shards ])
+
+    def shard(self, key):
+        """The index of the shard that stores key."""
+
+        position = bisect.bisect_left(self._points, _hash(_hash_key(key)))
+
+        return self._indices[position % len(self._indices)]
+
+    def route(self, key):
+        """The client of the shard that stores key."""
+
+        return self.shards[self.shard(key)][1]
+
+    def get(self, name):
+        return self.route(name).get(name)
+
+    def set(self, name, value):
+        return self.route(name).set(name, value)
+
+    def setex(self, name, value, time):
+        return self.route(name).setex(name, value, time)
+
+    def delete(self, *names):
+        shards = {}
+
+        for name in names:
+            shards.setdefault(self.shard(name), []).append(name)
+
+        return sum([ self.shards[index][1].delete(*names) for index, names in shards.items() ])
+
+    def exists(self, name):
+        return self.route(name).exists(name)
+
+    def expire(self, name, time):
+        return self.route(name).expire(name, time)
+
+    def ttl(self, name):
+        return self.route(name).ttl(name)
+
+    def zadd(self, name, member, score):
+        return self.route(name).zadd(name, member, score)
+
+    def zrangebyscore(self, name, min, max):
+        return self.route(name).zrangebyscore(name, min, max)
+
+    def zremrangebyscore(self, name, min, max):
+        return self.route(name).zremrangebyscore(name, min, max)
+
+    def pipeline(self, transaction = True):
+        return ShardedPipeline(self, transaction)
+
+class ShardedPipeline(object):
+    """Commands queued for a ShardedClient.
+
+    Each command is queued on a pipeline for the shard of its first key (keys
+    of multi-key commands must share a hash tag) so execute costs one round
+    trip per shard involved.  Transactions are per shard.
+
+    """
+
+    def __init__(self, client, transaction = True):
+        self.client = client
+        self.transaction = transaction
+
+        self._pipelines = {} # shard index → pipeline
+        self._order = []
+
+    def __getattr__(self, command):
+        if command.startswith("_"):
+            raise AttributeError(command)
+
+        def _queue(*args):
+            index = self.client.shard(args[0])
+
+            if index not in self._pipelines:
+                self._pipelines[index] = self.client.shards[index][1].pipeline(transaction = self.transaction)
+
+            getattr(self._pipelines[index], command)(*args)
+            self._order.append(index)
+
+            return self
+
+        return _queue
+
+    def execute(self):
+        pipelines, self._pipelines = self._pipelines, {}
+        order, self._order = self._order, []
+
+        results = dict([ ( index, iter(pipeline.execute()) ) for index, pipeline in pipelines.items() ])
+
+        return [ next(results[index]) for index in order ]
+
+def _key(keyspace, key):
+    return "{0}:{{{1}}}".format(keyspace, key)
+
+class Script(object):
+    """A compound keystore operation that runs in one round trip.
+
+    On Redis the Lua source runs server-side by its SHA (computed once here);
+    if the server doesn't have the script cached (NOSCRIPT, e.g. after a
+    restart, failover or SCRIPT FLUSH) it's loaded and run again.  Keystores
+    that can't run Lua (i.e. MemoryClient) run the equivalent python function
+    under their lock instead.
+
+    Parameters
+    ----------
+
+    :name:     The name the script is registered under in SCRIPTS.
+    :source:   The Lua source of the script.
+    :function: The python equivalent; called as function(client, keys, args).
+
+    """
+
+    __slots__ = [ "name", "source", "sha", "function" ]
+
+    def __init__(self, name, source, function):
+        self.name = name
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        self.function = function
+
+    def __repr__(self):
+        return "Script({0!r}, sha = {1!r})".format(self.name, self.sha)
+
+    def evaluate(self, client, keys, args):
+        """Run the script on the Redis client with keys and args."""
+
+        import redis
+
+        try:
+            return client.evalsha(self.sha, len(keys), *(list(keys) + list(args)))
+        except redis.exceptions.NoScriptError:
+            logger.info("Registering keystore script %s (%s)", self.name, self.sha)
+
+            client.script_load(self.source)
+
+            return client.evalsha(self.sha, len(keys), *(list(keys) + list(args)))
+
+SCRIPTS = {}
+
+def register_script(name, source, function):
+    """Register a Script (see Script for the parameters) under name."""
+
+    SCRIPTS[name] = Script(name, source, function)
+
+    return SCRIPTS[name]
+
+def run_script(name, keys, args = ()):
+    """Run the registered script, name, on the keystore with keys and args.
+
+    All keys must share a hash tag (i.e. be the same key in different
+    keyspaces) when the keystore is sharded; the script runs on the shard of
+    the first key.
+
+    """
+
+    script = SCRIPTS[name]
+
+    client = get_keystore()
+
+    if hasattr(client, "route"):
+        client = client.route(keys[0])
+
+    if hasattr(client, "run_script"):
+        return client.run_script(script, keys, args)
+
+    return script.evaluate(client, keys, args)
+
+def _delete_if_equal(client, keys, args):
+    if client.get(keys[0]) != args[0]:
+        return 0
+
+    return client.delete(keys[0])
+
+register_script("delete_if_equal", """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+""", _delete_if_equal)
+
+def _promote(client, keys, args):
+    if client.get(keys[0]) != args[0]:
+        return 0
+
+    client.setex(keys[1], args[0], int(args[1]))
+
+    return 1
+
+register_script("promote", """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("SETEX", KEYS[2], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+""", _promote)
+
+def delete_if_equal(keyspace, key, value):
+    """Delete key from keyspace if (and only if) it's set to value.
+
+    The comparison and deletion are atomic and take one round trip so a
+    one-time token (i.e. a verification) can't be used twice.
+
+    Returns
+    -------
+
+    True if key was set to value and has been deleted; otherwise, False.
+
+    """
+
+    return bool(run_script("delete_if_equal", [ _key(keyspace, key) ], [ value ]))
+
+def promote(source, destination, key, value, time):
+    """Copy key from source to destination keyspace if it's set to value.
+
+    The copy expires after time (seconds or a timedelta).  The comparison and
+    write are atomic and take one round trip.
+
+    Returns
+    -------
+
+    True if key was set to value in source and has been promoted; otherwise,
+    False.
+
+    """
+
+    return bool(run_script("promote", [ _key(source, key), _key(destination, key) ], [ value, int(_seconds(time)) ]))
+
+class Keyspace(object):
+    """A named set of keys on a shared keystore client.
+
+    Keyspaces are views: every keyspace on an endpoint shares that endpoint's
+    client (and thus its connection pool) and keeps its keys separate by
+    prefixing them with the keyspace's name.  The original key is kept as a
+    hash tag (e.g. ``tokens:{KEY}``) so the same key in every keyspace is
+    stored on the same shard when the keystore is sharded.
+
+    Only the commands margarine uses are exposed; the client is available as
+    the client attribute for anything else.
+
+    """
+
+    __slots__ = [ "name", "client" ]
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+
+    def __repr__(self):
+        return "Keyspace({0!r}, {1!r})".format(self.name, self.client)
+
+    def key(self, key):
+        """The key in the underlying keystore for key in this keyspace."""
+
+        return _key(self.name, key)
+
+    def _execute(self, command, *args):
+        return getattr(self.client, command)(*args)
+
+    def get(self, key):
+        return self._execute("get", self.key(key))
+
+    def set(self, key, value):
+        return self._execute("set", self.key(key), value)
+
+    def setex(self, key, value, time):
+        return self._execute("setex", self.key(key), value, time)
+
+    def delete(self, *keys):
+        return self._execute("delete", *[ self.key(_) for _ in keys ])
+
+    def exists(self, key):
+        return self._execute("exists", self.key(key))
+
+    def expire(self, key, time):
+        return self._execute("expire", self.key(key), time)
+
+    def ttl(self, key):
+        return self._execute("ttl", self.key(key))
+
+    def zadd(self, key, member, score):
+        return self._execute("zadd", self.key(key), member, score)
+
+    def zrangebyscore(self, key, min, max):
+        return self._execute("zrangebyscore", self.key(key), min, max)
+
+    def zremrangebyscore(self, key, min, max):
+        return self._execute("zremrangebyscore", self.key(key), min, max)
+
+class Result(object):
+    """The eventual result of a command queued in a Batch.
+
+    The value attribute is set when the batch is executed; reading it before
+    then raises AttributeError.
+
+    """
+
+    __slots__ = [ "value" ]
+
+    def __repr__(self):
+        return "Result({0!r})".format(getattr(self, "value", None))
+
+class PipelinedKeyspace(Keyspace):
+    """A Keyspace view whose commands are queued in a Batch.
+
+    Every command returns a Result rather than the command's value.
+
+    """
+
+    __slots__ = [ "results" ]
+
+    def __init__(self, name, client, results):
+        super(PipelinedKeyspace, self).__init__(name, client)
+
+        self.results = results
+
+    def _execute(self, command, *args):
+        getattr(self.client, command)(*args)
+
+        result = Result()
+        self.results.append(result)
+
+        return result
+
+class Batch(object):
+    """Keystore commands queued across keyspaces and sent together.
+
+    Commands for keyspaces on the same endpoint share one pipeline and thus
+    one round trip.  Use batch() rather than creating these directly.
+
+    Parameters
+    ----------
+
+    :transaction: Wrap each endpoint's commands in MULTI/EXEC so they're
+                  applied atomically.
+
+    """
+
+    def __init__(self, transaction = True):
+        self.transaction = transaction
+
+        self._pipelines = {} # id(client) → ( pipeline, [ Result ] )
+
+    def keyspace(self, keyspace):
+        """The view of keyspace (by name) that queues its commands here."""
+
+        client = get_keyspace(keyspace).client
+
+        if id(client) not in self._pipelines:
+            self._pipelines[id(client)] = ( client.pipeline(transaction = self.transaction), [] )
+
+        pipeline, results = self._pipelines[id(client)]
+
+        return PipelinedKeyspace(keyspace, pipeline, results)
+
+    def execute(self):
+        """Send the queued commands and set the value of their Results."""
+
+        pipelines, self._pipelines = self._pipelines, {}
+
+        for pipeline, results in pipelines.values():
+            for result, value in zip(results, pipeline.execute()):
+                result.value = value
+
+@contextlib.contextmanager
+def batch(transaction = True):
+    """Queue keystore commands and send them in one round trip per endpoint.
+
+    The commands are sent when the block exits without an exception; the
+    values are available from the returned Results after the block.
+
+    Parameters
+    ----------
+
+    :transaction: Apply each endpoint's commands atomically (MULTI/EXEC).
+
+    Examples
+    --------
+
+    >>> with batch() as _:
+    ...     username = _.keyspace("verifications").get(verification)
+    ...     _.keyspace("verifications").delete(verification)
+    >>> username.value
+
+    """
+
+    _ = Batch(transaction)
+
+    yield _
+
+    _.execute()
+
+def _database(spec):
+    if spec.path is None:
+        return 0
+
+    return int(spec.path.strip("/") or 0)
+
+def _shard_name(spec):
+    if spec.scheme == "memory":
+        return "memory://{0}".format(spec.path or "")
+
+    return "redis://{0}:{1}/{2}".format(spec.host, spec.port or 6379, _database(spec))
+
+def get_client(spec):
+    """The shared Redis client for the endpoint described by spec.
+
+    One client (and connection pool) is created per endpoint (host, port,
+    password, and database) and shared by every keyspace on that endpoint.
+
+    """
+
+    global KEYSTORE_CLIENTS
+
+    if spec.scheme == "memory":
+        endpoint = ( spec.scheme, spec.path )
+
+        if endpoint not in KEYSTORE_CLIENTS:
+            KEYSTORE_CLIENTS[endpoint] = MemoryClient(spec.path, spec.option("snapshot_interval", 60, float))
+
+        return KEYSTORE_CLIENTS[endpoint]
+
+    endpoint = ( spec.host, spec.port or 6379, spec.password, _database(spec) )
+
+    if endpoint not in KEYSTORE_CLIENTS:
+        import redis
+
+        pool = ConnectionPool(
+                max_connections = spec.option("max_connections", 50, int),
+                timeout = spec.option("pool_timeout", 20, float),
+                idle_timeout = spec.option("idle_timeout", 300, float),
+                host = endpoint[0],
+                port = endpoint[1],
+                password = endpoint[2],
+                db = endpoint[3],
+                socket_timeout = spec.option("socket_timeout", None, float),
+                )
+
+        KEYSTORE_CLIENTS[endpoint] = redis.Redis(connection_pool = pool)
+
+    return KEYSTORE_CLIENTS[endpoint]
+
+def get_keystore():
+    """The client for keystore.url.
+
+    If keystore.url lists more than one URL, the client is a ShardedClient
+    over the clients for each URL.  The following option is recognized in the
+    query string of each URL when sharding:
+
+    :weight: The relative share of the keys stored on this shard; defaults
+             to 1.
+
+    """
+
+    global KEYSTORE_CLIENTS
+
+    specs = get_connection_specs("keystore.url")
+
+    if len(specs) == 1:
+        return get_client(specs[0])
+
+    if specs not in KEYSTORE_CLIENTS:
+        KEYSTORE_CLIENTS[specs] = ShardedClient([ ( _shard_name(_), get_client(_), _.option("weight", 1, int) ) for _ in specs ])
+
+    return KEYSTORE_CLIENTS[specs]
+
+def get_keystore_status():
+    """The health of each shard of the keystore.
+
+    Every shard is pinged; this is meant for operators (see the blend status
+    endpoint) rather than for the request path.
+
+    Returns
+    -------
+
+    A list with a dict for each shard (in keystore.url order) with the
+    following keys:
+
+    :shard:   The shard's name (URL without credentials or options).
+    :healthy: Whether the shard answered the ping.
+    :error:   The error raised by the ping (only if not healthy).
+    :pool:    The connection pool's statistics (only for Redis shards).
+
+    """
+
+    client = get_keystore()
+
+    shards = getattr(client, "shards", None)
+
+    if shards is None:
+        shards = [ ( _shard_name(get_connection_specs("keystore.url")[0]), client ) ]
+
+    status = []
+
+    for name, client in shards:
+        _ = { "shard": name }
+
+        try:
+            _["healthy"] = bool(client.ping())
+        except Exception as error:
+            _["healthy"] = False
+            _["error"] = str(error)
+
+        pool = getattr(client, "connection_pool", None)
+
+        if pool is not None and hasattr(pool, "statistics"):
+            _["pool"] = pool.statistics()
+
+        status.append(_)
+
+    return status
+
 def get_keyspace(keyspace):
     """Using the keystore.url parameter we get a hash for storing data.
 
-    If a connection has already been established we'll re-use that connection;
-    otherwise, we'll create the connection and return the requested hash.
+    Keyspaces ("tokens", "verifications", &c) are cheap views on the shared
+    client for keystore.url (see Keyspace, get_keystore, and get_client).  The Redis database
+    may be given as the path of the URL (e.g. redis://localhost/2); it
+    defaults to 0.
+
+    The following options are recognized in the query string of the
+    keystore.url:
+
+    :max_connections: The maximum number of connections to the endpoint;
+                      defaults to 50.
+    :pool_timeout:    The number of seconds to wait for a free connection;
+                      defaults to 20.
+    :idle_timeout:    The number of seconds before an unused connection is
+                      closed; defaults to 300.
+    :socket_timeout:  The number of seconds to wait on a command.
 
-    .. note::
-        Currently we only work with a Redis keystore using the redis-py binding
-        layer.  If we decide to use other keystores (or even native python
-        dicts) we'll ahve to re-evaluate this architecture.
+    A keystore.url of memory:// (or memory:///PATH to snapshot the keys to
+    PATH) keeps the keys in this process instead (see MemoryClient) and
+    recognizes the following option:
+
+    :snapshot_interval: The number of seconds between snapshots; defaults to
+                        60.
 
     Returns
     -------
@@ -44,29 +1021,25 @@ def get_keyspace(keyspace):
 
     global KEYSTORE_CONNECTIONS
 
-    url = Parameters()["keystore.url"]
+    if keyspace not in KEYSTORE_CONNECTIONS:
+        KEYSTORE_CONNECTIONS[keyspace] = Keyspace(keyspace, get_keystore())
 
-    uri = URI(url)
+    return KEYSTORE_CONNECTIONS[keyspace]
 
-    if uri.path is not None:
-        logger.warn("Redis database is specified in the keystore.url!")
+def _reset_keyspaces(key, previous, current):
+    """Drop the keystore clients and keyspaces when keystore.url changes.
 
-    if keyspace not in KEYSTORE_CONNECTIONS:
-        # Redis doesn't believe in named databases so we need to implement them:
+    The clients are rebuilt lazily by get_keyspace.  Clients still in use by
+    in-flight requests keep working until they're released.
 
-        databases = {
-                "tokens": 0,
-                "verifications": 1,
-                }
+    """
 
-        logger.debug("port: %s", uri.port)
-        logger.debug("type(port): %s", type(uri.port))
+    global KEYSTORE_CLIENTS
+    global KEYSTORE_CONNECTIONS
 
-        port = 6379
-        if uri.port is not None:
-            port = int(uri.port)
-            
-        KEYSTORE_CONNECTIONS[keyspace] = redis.Redis(host = uri.host, port = port, db = databases[keyspace])
+    logger.info("Resetting keystore connections for %s", current)
 
-    return KEYSTORE_CONNECTIONS[keyspace]
-    
+    KEYSTORE_CLIENTS = {}
+    KEYSTORE_CONNECTIONS = {}
+
+Parameters().subscribe("keystore.url", _reset_keyspaces)
@@ -0,0 +1,266 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Logging mechanisms for the request paths.
+
+The handlers configured by logging.ini format and write every record on the
+thread that emitted it.  This module provides the pieces that keep that cost
+off of the request threads:
+
+:AsynchronousHandler: Hands records to a writer thread that runs the real
+                      handlers.
+:abbreviate:          Defers rendering of large payloads (documents, HTTP
+                      responses, &c) until a handler actually formats the
+                      record and truncates the result.
+:SamplingFilter:      Passes only one of every N debug records from each call
+                      site.
+
+All of these are enabled with configure (invoked by
+margarine.parameters.configure_logging).
+
+"""
+
+import atexit
+import itertools
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+ABBREVIATION_LENGTH = 1024
+
+class Abbreviated(object):
+    """A log argument that is rendered lazily and truncated.
+
+    Logging only formats its arguments if a handler emits the record so
+    wrapping an expensive argument in this object means it's only converted to
+    a string when the level is enabled.
+
+    """
+
+    __slots__ = [ "value", "length" ]
+
+    def __init__(self, value, length = None):
+        self.value = value
+        self.length = length
+
+    def __str__(self):
+        return self._truncate(str(self.value))
+
+    def __repr__(self):
+        return self._truncate(repr(self.value))
+
+    def _truncate(self, text):
+        length = self.length or ABBREVIATION_LENGTH
+
+        if len(text) <= length:
+            return text
+
+        return "{0}... ({1} characters total)".format(text[:length], len(text))
+
+def abbreviate(value, length = None):
+    """Wrap value so that it's rendered lazily and truncated to length.
+
+    Parameters
+    ----------
+
+    :value:  The object to render if the record is emitted.
+    :length: The maximum number of characters to render; defaults to
+             ABBREVIATION_LENGTH.
+
+    Examples
+    --------
+
+    >>> logger.debug("article: %s", abbreviate(article))
+
+    """
+
+    return Abbreviated(value, length)
+
+class SamplingFilter(logging.Filter):
+    """Pass one of every ``rate`` debug records from each call site.
+
+    Records above the DEBUG level are always passed.  Call sites are identified
+    by the file and line number that created the record.
+
+    """
+
+    def __init__(self, rate):
+        super(SamplingFilter, self).__init__()
+
+        self.rate = rate
+        self.counters = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate <= 1:
+            return True
+
+        counter = self.counters.get((record.pathname, record.lineno))
+
+        if counter is None:
+            counter = self.counters.setdefault((record.pathname, record.lineno), itertools.count())
+
+        return next(counter) % self.rate == 0
+
+class AsynchronousHandler(logging.Handler):
+    """Emit records through other handlers on a background thread.
+
+    The calling thread only renders the record's message (which is cheap if
+    large arguments are abbreviated) and enqueues it.  If the queue is full the
+    record is dropped and counted rather than blocking the caller.
+
+    """
+
+    def __init__(self, handlers, capacity = 10000):
+        super(AsynchronousHandler, self).__init__()
+
+        self.handlers = list(handlers)
+        self.queue = queue.Queue(capacity)
+        self.dropped = 0
+
+        self._writer = threading.Thread(target = self._write, name = "logging-writer")
+        self._writer.daemon = True
+        self._writer.start()
+
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        """Render everything in record that can change after emission.
+
+        Arguments may be mutated by the caller after the record is queued and
+        tracebacks hold references to frames so both are rendered here.
+
+        """
+
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+
+            try:
+                if record is None:
+                    break
+
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Block until all queued records have been written."""
+
+        if self._writer.is_alive():
+            self.queue.join()
+
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+        if self._writer.is_alive():
+            self.queue.put(None)
+            self._writer.join(5)
+
+        if self.dropped:
+            for handler in self.handlers:
+                handler.handle(logging.makeLogRecord({
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "Dropped %s log records.",
+                    "args": (self.dropped,),
+                    }))
+
+            self.dropped = 0
+
+        super(AsynchronousHandler, self).close()
+
+def configure(asynchronous = False, sample = 1, length = ABBREVIATION_LENGTH):
+    """Apply the request path logging mechanisms to the configured loggers.
+
+    Should be invoked after the handlers have been configured (i.e. by
+    logging.config.fileConfig).  Every logger with handlers has its handlers
+    sampled and, optionally, moved behind an AsynchronousHandler.
+
+    Safe to repeat: AsynchronousHandlers and SamplingFilters applied by a
+    previous invocation are removed (and the AsynchronousHandlers' writers
+    stopped) before the options are applied again.
+
+    Parameters
+    ----------
+
+    :asynchronous: Write records from a background thread.
+    :sample:       Pass one of every ``sample`` debug records per call site.
+    :length:       The default length abbreviated arguments are truncated to.
+
+    """
+
+    global ABBREVIATION_LENGTH
+
+    ABBREVIATION_LENGTH = length
+
+    loggers = [ logging.getLogger() ] + [ _ for _ in logging.Logger.manager.loggerDict.values() if isinstance(_, logging.Logger) ]
+
+    sampled = set()
+
+    for logger in loggers:
+        if not len(logger.handlers):
+            continue
+
+        handlers = []
+
+        for handler in list(logger.handlers):
+            if isinstance(handler, AsynchronousHandler):
+                logger.removeHandler(handler)
+                handler.close()
+
+                handlers.extend(handler.handlers)
+
+                for inner in handler.handlers:
+                    logger.addHandler(inner)
+            else:
+                handlers.append(handler)
+
+        for handler in handlers:
+            if handler in sampled:
+                continue # Shared with a logger that's already been configured.
+
+            for previous in [ _ for _ in handler.filters if isinstance(_, SamplingFilter) ]:
+                handler.removeFilter(previous)
+
+        if asynchronous:
+            for handler in list(handlers):
+                logger.removeHandler(handler)
+
+            handlers = [ AsynchronousHandler(handlers) ]
+
+            logger.addHandler(handlers[0])
+
+        if sample > 1:
+            for handler in handlers:
+                if handler not in sampled:
+                    sampled.add(handler)
+                    handler.addFilter(SamplingFilter(sample))
@@ -0,0 +1,219 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Encoding of the messages blend and spread exchange over the queue.
+
+Every message is an envelope carrying the message's type, the version of the
+type's schema the producer wrote, and the payload::
+
+    { "type": "articles.create", "version": 1, "payload": { "_id": …, "url": … } }
+
+The envelope is encoded with the messages.codec codec and the codec's MIME
+type is sent as the message's content_type; consumers decode with the codec
+named by the content_type so any consumer understands every registered codec
+regardless of the codec its producers were configured with:
+
+:json: application/json (the default).
+:bson: application/bson (pymongo's bson module) with a hex UUID _id (i.e.
+       an article id) packed in 16 bytes.
+
+Messages on an in-process (memory://) queue never leave the process so
+they're published with the object codec instead (application/x-python-object):
+the envelope itself is the body and consumers are handed a copy of it.
+
+Producers and consumers can be upgraded independently:
+
+* Consumers are upgraded first when a codec is introduced; producers are then
+  switched with messages.codec.
+* When a type's schema changes its version is incremented (see
+  register_message) and an upgrade from the previous version is registered
+  (see register_upgrade); consumers upgrade older payloads as they're decoded
+  and pass payloads of newer versions (which may only add fields) through.
+* Bare JSON messages (from producers that predate envelopes) are decoded as
+  version 1 payloads.
+
+"""
+
+import binascii
+import copy
+import json
+import logging
+import re
+
+from margarine.parameters import Parameters
+
+logger = logging.getLogger(__name__)
+
+Parameters("messages", parameters = [
+    { # --messages-codec=CODEC; CODEC ← json
+        "options": [ "--codec" ],
+        "default": "json",
+        "choices": [ "json", "bson" ],
+        "help": \
+                "The codec messages are published with (consumers decode " \
+                "every codec); default: %(default)s.",
+        },
+    ])
+
+CODECS = {}
+CONTENT_TYPES = {}
+
+def register_codec(name, content_type, encode, decode):
+    """Register a message codec.
+
+    Parameters
+    ----------
+
+    :name:         The name selected by messages.codec.
+    :content_type: The MIME type sent as the message's content_type.
+    :encode:       A function of an envelope (a dict) returning bytes.
+    :decode:       A function of bytes returning the envelope.
+
+    """
+
+    CODECS[name] = ( content_type, encode, decode )
+    CONTENT_TYPES[content_type] = name
+
+HEX_UUID = re.compile(r"^[0-9a-f]{32}$")
+
+HEX_UUID_SUBTYPE = 0x80 # User defined (bson.binary.USER_DEFINED_SUBTYPE).
+
+def _bson_encode(envelope):
+    import bson
+
+    payload = envelope["payload"]
+
+    if isinstance(payload.get("_id"), basestring) and HEX_UUID.match(payload["_id"]):
+        envelope = dict(envelope, payload = dict(payload, _id = bson.Binary(binascii.unhexlify(payload["_id"]), HEX_UUID_SUBTYPE)))
+
+    return bson.BSON.encode(envelope)
+
+def _bson_decode(data):
+    import bson
+
+    envelope = bson.BSON(data).decode()
+
+    payload = envelope.get("payload")
+
+    if isinstance(payload, dict) and isinstance(payload.get("_id"), bson.Binary) and payload["_id"].subtype == HEX_UUID_SUBTYPE:
+        payload["_id"] = binascii.hexlify(payload["_id"])
+
+    return envelope
+
+register_codec("json", "application/json", lambda envelope: json.dumps(envelope, separators = ( ",", ":" )), json.loads)
+register_codec("bson", "application/bson", _bson_encode, _bson_decode)
+register_codec("object", "application/x-python-object", lambda envelope: envelope, copy.deepcopy)
+
+MESSAGES = {}
+UPGRADES = {}
+
+def register_message(message_type, version = 1):
+    """Declare a message type and the current version of its schema.
+
+    Parameters
+    ----------
+
+    :message_type: The message's type (the routing key of its queues'
+                   bindings).
+    :version:      The version producers write.
+
+    """
+
+    MESSAGES[message_type] = version
+
+def register_upgrade(message_type, version, upgrade):
+    """Register the upgrade of a message_type payload from version.
+
+    Parameters
+    ----------
+
+    :message_type: The message's type.
+    :version:      The version upgrade accepts.
+    :upgrade:      A function of a version payload returning the version + 1
+                   payload.
+
+    """
+
+    UPGRADES[( message_type, version )] = upgrade
+
+register_message("users.create")
+register_message("users.update")
+register_message("users.email")
+register_message("users.password")
+register_message("articles.create")
+register_message("articles.update")
+
+def encode(message_type, payload, codec = None):
+    """Encode payload in a message_type envelope.
+
+    Parameters
+    ----------
+
+    :message_type: The message's type (see register_message).
+    :payload:      The message's payload (a dict).
+    :codec:        The codec name; defaults to messages.codec.
+
+    Returns
+    -------
+
+    ( body, content_type )
+
+    """
+
+    if codec is None:
+        codec = Parameters()["messages.codec"]
+
+    content_type, _encode, _ = CODECS[codec]
+
+    envelope = {
+            "type": message_type,
+            "version": MESSAGES.get(message_type, 1),
+            "payload": payload,
+            }
+
+    return _encode(envelope), content_type
+
+def _is_envelope(message):
+    return isinstance(message, dict) and set(message.keys()) == set([ "type", "version", "payload" ])
+
+def decode(body, header = None):
+    """Decode a message's payload (upgrading it to the current version).
+
+    Parameters
+    ----------
+
+    :body:   The message's body.
+    :header: The message's properties (its content_type selects the codec;
+             JSON if it has none).
+
+    Returns
+    -------
+
+    The payload.
+
+    """
+
+    content_type = getattr(header, "content_type", None) or "application/json"
+
+    if content_type not in CONTENT_TYPES:
+        raise ValueError("Unsupported message content_type: {0}".format(content_type))
+
+    message = CODECS[CONTENT_TYPES[content_type]][2](body)
+
+    if not _is_envelope(message):
+        return message # Published before envelopes; a version 1 payload.
+
+    payload, version = message["payload"], message["version"]
+
+    while ( message["type"], version ) in UPGRADES:
+        payload = UPGRADES[( message["type"], version )](payload)
+        version += 1
+
+    if version > MESSAGES.get(message["type"], version):
+        logger.debug("Passing through %s version %s payload", message["type"], version)
+
+    return payload
@@ -0,0 +1,208 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Schema and data migrations for margarine (bin/margarine-migrate).
+
+Migrations are registered steps that are run in registration order.  Every
+step must be safe to run more than once.  The following steps are provided:
+
+:indexes:    Applies the indexes declared with
+             margarine.aggregates.register_index.
+:containers: Moves article bodies stored in an earlier container layout to
+             the current one (see objectstore.buckets) with migrate.workers
+             threads.
+:notations:  Moves notations embedded in articles to the notations
+             collection with migrate.workers threads.
+
+"""
+
+import logging
+import sys
+import uuid
+
+from multiprocessing.pool import ThreadPool
+
+from margarine.parameters import Parameters
+from margarine.parameters import configure_logging
+
+configure_logging()
+
+from margarine.aggregates import ensure_indexes
+from margarine.aggregates import get_collection
+from margarine.notations import split_notations
+from margarine.objectstores import get_article_location
+from margarine.objectstores import get_container
+
+logger = logging.getLogger(__name__)
+
+Parameters("migrate", parameters = [
+    { # --migrate-steps=STEPS; STEPS ← all
+        "options": [ "--steps" ],
+        "default": "all",
+        "help": \
+                "The comma separated migration steps to run or all (the " \
+                "default) to run every step in order.",
+        },
+    { # --migrate-workers=N; N ← 8
+        "options": [ "--workers" ],
+        "type": int,
+        "default": 8,
+        "help": \
+                "The number of threads moving objects in data migrations; " \
+                "default: %(default)s.",
+        },
+    ])
+
+MIGRATIONS = []
+
+def migration(name):
+    """Register the decorated function as the migration step, name."""
+
+    def _register(function):
+        MIGRATIONS.append(( name, function ))
+
+        return function
+
+    return _register
+
+@migration("indexes")
+def indexes():
+    """Apply the declared datastore indexes."""
+
+    ensure_indexes()
+
+def move_body(article):
+    """Move an article's body to its current location.
+
+    The body is copied, the article is pointed at the copy (only if it still
+    references the original), and then the original is removed.  If the
+    article changed in the meantime the original is left in place.  If the
+    body is already at its current location (i.e. an article written before
+    text_layout with zero objectstore.buckets) only the layout is recorded.
+
+    Parameters
+    ----------
+
+    :article: The article's _id, text_container_name, and text_object_name.
+
+    Returns
+    -------
+
+    True if the body was moved; otherwise, False.
+
+    """
+
+    container_name, object_name, layout = get_article_location(article["_id"])
+
+    original = {
+            "_id": article["_id"],
+            "text_container_name": article["text_container_name"],
+            "text_object_name": article["text_object_name"],
+            }
+
+    if ( container_name, object_name ) == ( article["text_container_name"], article["text_object_name"] ):
+        get_collection("articles").update(original, { "$set": { "text_layout": layout } })
+
+        return False
+
+    source = get_container(article["text_container_name"])
+
+    get_container(container_name).store_object(object_name, source.fetch_object(article["text_object_name"]), content_type = "text/html")
+
+    result = get_collection("articles").update(original, { "$set": {
+            "text_container_name": container_name,
+            "text_object_name": object_name,
+            "text_layout": layout,
+            } })
+
+    if not result or not result.get("updatedExisting"):
+        logger.warning("Article %s changed while moving its body; leaving %s/%s", article["_id"], article["text_container_name"], article["text_object_name"])
+
+        return False
+
+    source.delete_object(article["text_object_name"])
+
+    return True
+
+def _try_move_body(article):
+    try:
+        return move_body(article)
+    except Exception:
+        logger.exception("Failed to move the body of article %s", article["_id"])
+
+        return False
+
+@migration("containers")
+def containers():
+    """Move article bodies into the current container layout."""
+
+    layout = get_article_location(uuid.UUID(int = 0).hex)[2]
+
+    articles = list(get_collection("articles").find({
+        "text_container_name": { "$exists": True },
+        "text_layout": { "$ne": layout },
+        }, { "_id": 1, "text_container_name": 1, "text_object_name": 1 }))
+
+    logger.info("Moving %s article bodies to the %s layout", len(articles), layout)
+
+    pool = ThreadPool(int(Parameters()["migrate.workers"]))
+
+    try:
+        moved = sum(pool.imap_unordered(_try_move_body, articles))
+    finally:
+        pool.close()
+        pool.join()
+
+    logger.info("Moved %s of %s article bodies", moved, len(articles))
+
+def _try_split_notations(article):
+    try:
+        return split_notations(article)
+    except Exception:
+        logger.exception("Failed to move the notations of article %s", article["_id"])
+
+        return 0
+
+@migration("notations")
+def notations():
+    """Move embedded notations to the notations collection."""
+
+    articles = get_collection("articles").find({ "notations": { "$exists": True } }, { "_id": 1, "notations": 1 })
+
+    pool = ThreadPool(int(Parameters()["migrate.workers"]))
+
+    try:
+        moved = sum(pool.imap_unordered(_try_split_notations, articles, 16))
+    finally:
+        pool.close()
+        pool.join()
+
+    logger.info("Moved %s notations", moved)
+
+def main():
+    """Run the migration steps selected by migrate.steps."""
+
+    Parameters().parse()
+
+    steps = [ _.strip() for _ in Parameters()["migrate.steps"].split(",") if _.strip() ]
+
+    if "all" in steps:
+        steps = [ _[0] for _ in MIGRATIONS ]
+
+    unknown = set(steps) - set([ _[0] for _ in MIGRATIONS ])
+
+    if len(unknown):
+        logger.error("Unknown migration steps: %s", ", ".join(sorted(unknown)))
+        sys.exit(1)
+
+    for name, function in MIGRATIONS:
+        if name in steps:
+            logger.info("Running migration: %s", name)
+
+            function()
+
+            logger.info("Finished migration: %s", name)
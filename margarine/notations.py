@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Article notations (margin notes).
+
+Notations are stored in their own collection rather than embedded in the
+article so adding a note never grows (or relocates) the article document and
+reading an article doesn't read every note.  Each notation is keyed by its
+article and location::
+
+    { "article_id": …, "location": …, "note": … }
+
+Notations are read a page at a time in location order: a page is a range
+read on the ( article_id, location ) index (declared in margarine.aggregates)
+starting after the last location of the previous page.
+
+"""
+
+import logging
+
+from margarine.parameters import Parameters
+from margarine.aggregates import ASCENDING
+from margarine.aggregates import get_collection
+
+logger = logging.getLogger(__name__)
+
+Parameters("notations", parameters = [
+    { # --notations-page=N; N ← 20
+        "options": [ "--page" ],
+        "type": int,
+        "default": 20,
+        "help": \
+                "The number of notations in a page (and included with an " \
+                "article); default: %(default)s.",
+        },
+    ])
+
+def add_notation(article_id, location, note):
+    """Attach note to the article at location (replacing any note there)."""
+
+    get_collection("notations").update({ "article_id": article_id, "location": location }, { "$set": { "note": note } }, upsert = True)
+
+def remove_notation(article_id, location):
+    get_collection("notations").remove({ "article_id": article_id, "location": location })
+
+def count_notations(article_id):
+    """The number of notations on the article."""
+
+    return get_collection("notations").find({ "article_id": article_id }).count()
+
+def get_notations(article_id, after = None, limit = None):
+    """A page of the article's notations.
+
+    Parameters
+    ----------
+
+    :article_id: The article's id.
+    :after:      The location of the last notation of the previous page (or
+                 None for the first page).
+    :limit:      The number of notations in the page; defaults to
+                 notations.page.
+
+    Returns
+    -------
+
+    ( notations, next ) where notations is a list of { location, note } in
+    location order and next is the after for the next page (or None if this is
+    the last page).
+
+    """
+
+    if limit is None:
+        limit = int(Parameters()["notations.page"])
+
+    spec = { "article_id": article_id }
+
+    if after is not None:
+        spec["location"] = { "$gt": after }
+
+    notations = list(get_collection("notations").find(spec, { "_id": 0, "location": 1, "note": 1 }).sort([ ( "location", ASCENDING ) ]).limit(limit + 1))
+
+    if len(notations) > limit:
+        return notations[:limit], notations[limit - 1]["location"]
+
+    return notations, None
+
+def split_notations(article):
+    """Move an article's embedded notations to the notations collection.
+
+    Safe to repeat: the article's notations are replaced and then the
+    embedded list is removed.  Embedded notes that share a location (only one
+    notation is kept per location) are merged into one note (their distinct
+    texts separated by blank lines) and the merge is logged.
+
+    Parameters
+    ----------
+
+    :article: The article's _id and notations.
+
+    Returns
+    -------
+
+    The number of notations moved.
+
+    """
+
+    notations = get_collection("notations")
+
+    notations.remove({ "article_id": article["_id"] })
+
+    embedded = {}
+
+    for notation in article.get("notations") or []:
+        embedded.setdefault(notation["location"], []).append(notation.get("note"))
+
+    merged = 0
+
+    for location, notes in embedded.items():
+        distinct = []
+
+        for note in notes:
+            if note is not None and note not in distinct:
+                distinct.append(note)
+
+        merged += len(notes) - 1
+
+        embedded[location] = "\n\n".join(distinct) if len(distinct) else None
+
+    if merged:
+        logger.warning("Merged %s notations of article %s that shared a location", merged, article["_id"])
+
+    if len(embedded):
+        notations.insert([ { "article_id": article["_id"], "location": location, "note": note } for location, note in sorted(embedded.items()) ])
+
+    get_collection("articles").update({ "_id": article["_id"] }, { "$unset": { "notations": "" } })
+
+    return len(embedded)
@@ -0,0 +1,411 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Object storage (article bodies) for margarine.
+
+The client authenticates once per process and re-authenticates shortly
+before its token expires rather than on every request.  Container handles are
+kept in an LRU so a container is only created (an idempotent PUT) the first
+time it's used and each thread keeps its own persistent HTTP connection to the
+storage endpoint.  Fetching or storing an object is a single request.
+
+An objectstore.url of packfile:///DIRECTORY selects a local store instead
+(see margarine.packfiles) for deployments without Cloud Files.
+
+"""
+
+import collections
+import copy
+import datetime
+import io
+import logging
+import os
+import threading
+import uuid
+
+from margarine.helpers import get_connection_spec
+from margarine.parameters import Parameters
+from margarine.parameters import CONFIGURATION_DIRECTORY
+
+logger = logging.getLogger(__name__)
+
+Parameters("pyrax", parameters = [
+    { # --pyrax-configuration=FILE; FILE ← CONFIGURATION_DIRECTORY/pyrax.ini
+        "options": [ "--configuration" ],
+        "default": os.path.join(CONFIGURATION_DIRECTORY, "pyrax.ini"),
+        "help": \
+                "The configuration file containing the pyrax credentials " \
+                "used by %(prog)s.  Default: %(default)s.",
+        },
+    { # --pyrax-type=TYPE; TYPE ← rackspace
+        "options": [ "--type" ],
+        "default": "rackspace",
+        "help": \
+                "The identity type for pyrax.  This needs to be set outside " \
+                "of the pyrax configuration due to the pyrax " \
+                "implementation.  This defaults to %(default)s but can be " \
+                "over-ridden if required.",
+        },
+    ])
+
+Parameters("objectstore", parameters = [
+    { # --objectstore-url=URL; URL ← cloudfiles://
+        "options": [ "--url" ],
+        "default": "cloudfiles://",
+        "help": \
+                "The object store to keep article bodies in: cloudfiles:// " \
+                "(configured by the pyrax parameters) or " \
+                "packfile:///DIRECTORY for local segment files; default: " \
+                "%(default)s.",
+        },
+    { # --objectstore-containers=N; N ← 512
+        "options": [ "--containers" ],
+        "type": int,
+        "default": 512,
+        "help": \
+                "The number of container handles to keep; default: " \
+                "%(default)s.",
+        },
+    { # --objectstore-buckets=N; N ← 256
+        "options": [ "--buckets" ],
+        "type": int,
+        "default": 256,
+        "help": \
+                "The number of containers article bodies are hashed into " \
+                "(0 creates a container per article as earlier releases " \
+                "did); default: %(default)s.  Existing bodies are moved by " \
+                "the containers step of margarine-migrate.",
+        },
+    { # --objectstore-refresh=SECONDS; SECONDS ← 300
+        "options": [ "--refresh" ],
+        "type": int,
+        "default": 300,
+        "help": \
+                "Re-authenticate this many seconds before the object store " \
+                "token expires; default: %(default)s.",
+        },
+    ])
+
+OBJECTSTORE_CLIENT = None
+OBJECTSTORE_CONTAINERS = None
+
+class LRUCache(object):
+    """A thread-safe mapping that keeps the capacity most recently used items.
+
+    Parameters
+    ----------
+
+    :capacity: The maximum number of items to keep.
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default = None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+
+            self._items[key] = value
+
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+
+            while len(self._items) > self.capacity:
+                self._items.popitem(last = False)
+
+class Container(object):
+    """A handle on a container in the object store.
+
+    Parameters
+    ----------
+
+    :name:   The container's name.
+    :client: The CloudFilesClient (or PackfileStore) the container belongs
+             to.
+
+    """
+
+    __slots__ = [ "name", "client" ]
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+
+    def __repr__(self):
+        return "Container({0!r})".format(self.name)
+
+    def fetch_object(self, name):
+        """The contents of the object, name, in this container."""
+
+        return self.client.fetch_object(self.name, name)
+
+    def open_object(self, name):
+        """A file-like object (with a length) of the object, name."""
+
+        return self.client.open_object(self.name, name)
+
+    def store_object(self, name, data, content_type = None):
+        """Store data as the object, name, in this container."""
+
+        return self.client.store_object(self.name, name, data, content_type = content_type)
+
+    def delete_object(self, name):
+        """Remove the object, name, from this container."""
+
+        return self.client.delete_object(self.name, name)
+
+class ObjectReader(io.BytesIO):
+    """A fetched object as a file-like object with a length."""
+
+    def __len__(self):
+        return len(self.getvalue())
+
+class CloudFilesClient(object):
+    """A Cloud Files (swift) client that authenticates once.
+
+    pyrax keeps its identity and cloudfiles client in module globals and
+    closes its HTTP connection before every call it wraps.  This client
+    authenticates through pyrax but then issues object requests with a
+    per-thread copy of the underlying swift connection that keeps its HTTP
+    connection open.  Each copy is replaced when the token changes or after a
+    fork.  Since those requests bypass pyrax's re-authentication, a request
+    rejected with a 401 (i.e. a token revoked before it expired) forces a new
+    token and is retried once.
+
+    Parameters
+    ----------
+
+    :credential_file: The pyrax credential file.
+    :identity_type:   The pyrax identity type (i.e. rackspace).
+    :refresh:         Re-authenticate when the token expires within this
+                      many seconds.
+
+    """
+
+    def __init__(self, credential_file, identity_type, refresh = 300):
+        self.credential_file = credential_file
+        self.identity_type = identity_type
+        self.refresh = datetime.timedelta(seconds = refresh)
+
+        self.cloudfiles = None
+        self.expires = None
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _authenticate(self):
+        import pyrax
+
+        logger.info("Authenticating to the object store")
+
+        pyrax.settings.set('identity_type', self.identity_type)
+        pyrax.set_credential_file(self.credential_file)
+
+        self.cloudfiles = pyrax.cloudfiles
+        self.expires = pyrax.identity.expires or None
+        self.generation += 1
+
+    def _expiring(self):
+        return self.cloudfiles is None or self.expires is not None and datetime.datetime.now() + self.refresh >= self.expires
+
+    def _get_cloudfiles(self):
+        if self._expiring():
+            with self._lock:
+                if self._expiring():
+                    self._authenticate()
+
+        return self.cloudfiles
+
+    def _get_connection(self):
+        cloudfiles = self._get_cloudfiles()
+
+        key = ( self.generation, os.getpid() )
+
+        if getattr(self._local, "key", None) != key:
+            connection = copy.copy(cloudfiles.connection)
+            connection.http_conn = None
+
+            self._local.connection = connection
+            self._local.key = key
+
+        return self._local.connection
+
+    def _request(self, operation, *args, **kwargs):
+        """Call operation (a swift connection method) on this thread's copy.
+
+        If the token is rejected (401) the client re-authenticates (unless
+        another thread already has) and the request is retried once.
+
+        """
+
+        connection = self._get_connection()
+
+        generation = self._local.key[0]
+
+        try:
+            return getattr(connection, operation)(*args, **kwargs)
+        except Exception as error:
+            if getattr(error, "http_status", None) != 401:
+                raise
+
+            logger.warning("The object store rejected the token; re-authenticating")
+
+        with self._lock:
+            if self.generation == generation:
+                self._authenticate()
+
+        return getattr(self._get_connection(), operation)(*args, **kwargs)
+
+    def create_container(self, name):
+        """Create the container, name, (if it doesn't exist)."""
+
+        self._get_cloudfiles().create_container(name)
+
+        return Container(name, self)
+
+    def fetch_object(self, container, name):
+        _, data = self._request("get_object", container, name)
+
+        return data
+
+    def open_object(self, container, name):
+        return ObjectReader(self.fetch_object(container, name))
+
+    def store_object(self, container, name, data, content_type = None):
+        return self._request("put_object", container, name, data, content_type = content_type)
+
+    def delete_object(self, container, name):
+        return self._request("delete_object", container, name)
+
+def get_objectstore():
+    """The object store client for this process.
+
+    A CloudFilesClient unless objectstore.url is packfile:///DIRECTORY which
+    selects a PackfileStore.  The packfile options are set in the query
+    string: segment_size (bytes), compaction_interval (seconds), and
+    compaction_ratio.
+
+    """
+
+    global OBJECTSTORE_CLIENT
+
+    if OBJECTSTORE_CLIENT is None:
+        spec = get_connection_spec("objectstore.url")
+
+        if spec.scheme == "packfile":
+            from margarine.packfiles import PackfileStore
+
+            OBJECTSTORE_CLIENT = PackfileStore(
+                    spec.path,
+                    segment_size = spec.option("segment_size", 256 * 1024 * 1024, int),
+                    compaction_interval = spec.option("compaction_interval", 600, float),
+                    compaction_ratio = spec.option("compaction_ratio", 0.5, float),
+                    )
+        elif spec.scheme == "cloudfiles":
+            OBJECTSTORE_CLIENT = CloudFilesClient(Parameters()["pyrax.configuration"], Parameters()["pyrax.type"], int(Parameters()["objectstore.refresh"]))
+        else:
+            raise ValueError("Unknown object store: {0}".format(spec.url))
+
+    return OBJECTSTORE_CLIENT
+
+def get_container(container):
+    """Retrieve a handle on the named container for storing data.
+
+    The container is created the first time it's requested; afterwards the
+    handle comes from an LRU of objectstore.containers handles.
+
+    Parameters
+    ----------
+
+    :container: The name of the container to return for interaction.
+
+    Returns
+    -------
+
+    A Container with fetch_object, open_object, and store_object methods.
+
+    """
+
+    global OBJECTSTORE_CONTAINERS
+
+    if OBJECTSTORE_CONTAINERS is None:
+        OBJECTSTORE_CONTAINERS = LRUCache(int(Parameters()["objectstore.containers"]))
+
+    handle = OBJECTSTORE_CONTAINERS.get(container)
+
+    if handle is None:
+        handle = get_objectstore().create_container(container)
+
+        OBJECTSTORE_CONTAINERS.put(container, handle)
+
+    return handle
+
+def get_article_location(article_id, buckets = None):
+    """The location of an article's body in the object store.
+
+    Bodies are hashed into one of objectstore.buckets containers (named
+    margarine-BUCKETS-N so layouts with different bucket counts never share a
+    container) under the article's id.  With zero buckets every article gets
+    its own container (the layout of earlier releases).
+
+    Parameters
+    ----------
+
+    :article_id: The article's id (a UUID hex string).
+    :buckets:    The number of buckets; defaults to objectstore.buckets.
+
+    Returns
+    -------
+
+    ( container name, object name, layout ) where layout (i.e. hashed-256 or
+    uuid) is recorded on the article as text_layout.
+
+    """
+
+    if buckets is None:
+        buckets = int(Parameters()["objectstore.buckets"])
+
+    article_id = uuid.UUID(article_id)
+
+    if not buckets:
+        container_part, object_part = str(article_id).split("-", 1)
+
+        return "margarine-" + container_part, object_part, "uuid"
+
+    width = len("{0:x}".format(buckets - 1))
+
+    return "margarine-{0}-{1:0{2}x}".format(buckets, article_id.int % buckets, width), article_id.hex, "hashed-{0}".format(buckets)
+
+def _reset_objectstore(key, previous, current):
+    """Drop the client and container handles when the configuration changes."""
+
+    global OBJECTSTORE_CLIENT
+    global OBJECTSTORE_CONTAINERS
+
+    logger.info("Resetting object store client for %s", key)
+
+    OBJECTSTORE_CLIENT = None
+    OBJECTSTORE_CONTAINERS = None
+
+Parameters().subscribe("pyrax.configuration", _reset_objectstore)
+Parameters().subscribe("pyrax.type", _reset_objectstore)
+Parameters().subscribe("objectstore.url", _reset_objectstore)
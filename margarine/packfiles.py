@@ -0,0 +1,537 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""A local object store that packs objects into large segment files.
+
+Selected with an objectstore.url of packfile:///DIRECTORY.  The directory
+holds the following files:
+
+:segment-NNNNNNNN: Append-only segment files of records (a header, the
+                   container and object names, and the data).
+:index:            An open-addressed hash table of fixed size slots mapping
+                   md5(container, object) to (segment, offset, length).  It's
+                   memory mapped (shared) by every process using the store so
+                   lookups never read the segments or build a dict.
+:sequence:         The number of the segment being appended to.  Segment
+                   numbers are never reused (another process may still have a
+                   compacted segment mapped under its number).
+:lock:             Serializes writers across processes (flock).
+
+Segments are memory mapped for reads and open_object returns a file
+positioned at the object's data so a WSGI server can send it with sendfile.
+Overwritten and deleted objects leave dead records behind; a background thread
+in each writing process periodically copies the live records out of mostly
+dead segments and removes them.
+
+"""
+
+import errno
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INDEX_HEADER = struct.Struct("<4sIQQ") # magic, version, slots, used
+INDEX_SLOT = struct.Struct("<16sIQQ") # digest, segment, offset, length
+RECORD_HEADER = struct.Struct("<HHQ") # container length, name length, length
+
+INDEX_MAGIC = b"MGIX"
+INDEX_VERSION = 1
+
+EMPTY = 0
+TOMBSTONE = 0xFFFFFFFF
+
+SEGMENT_PATTERN = re.compile(r"^segment-(?P<number>\d{8})$")
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+
+    return value.encode("utf-8")
+
+def _digest(container, name):
+    return hashlib.md5(_encode(container) + b"\0" + _encode(name)).digest()
+
+class PackfileIndex(object):
+    """The memory mapped hash table from object to record location.
+
+    Slots are probed linearly from the digest.  Deleted slots become
+    tombstones so probes continue past them.  When the used slots (including
+    tombstones) exceed the load factor, the table is rebuilt with twice the
+    slots in a new file that replaces the old one; other processes remap it
+    when they notice the inode changed (see refresh).
+
+    Parameters
+    ----------
+
+    :path:  The index file.
+    :slots: The initial number of slots if the file doesn't exist.
+
+    """
+
+    LOAD_FACTOR = 0.7
+
+    def __init__(self, path, slots = 4096):
+        self.path = path
+
+        if not os.path.exists(self.path):
+            self._create(self.path, slots)
+
+        self._map()
+
+    @staticmethod
+    def _create(path, slots):
+        with open(path, "wb") as fh:
+            fh.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, slots, 0))
+            fh.truncate(INDEX_HEADER.size + slots * INDEX_SLOT.size)
+
+    def _map(self):
+        with open(self.path, "r+b") as fh:
+            self.inode = os.fstat(fh.fileno()).st_ino
+            self.map = mmap.mmap(fh.fileno(), 0)
+
+        magic, version, self.slots, _ = INDEX_HEADER.unpack_from(self.map, 0)
+
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("{0} is not a packfile index".format(self.path))
+
+    def refresh(self):
+        """Remap the index if another process replaced it."""
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return
+
+        if inode != self.inode:
+            self._map()
+
+    @property
+    def used(self):
+        return INDEX_HEADER.unpack_from(self.map, 0)[3]
+
+    def _set_used(self, used):
+        INDEX_HEADER.pack_into(self.map, 0, INDEX_MAGIC, INDEX_VERSION, self.slots, used)
+
+    def _slot(self, index):
+        return INDEX_HEADER.size + index * INDEX_SLOT.size
+
+    def _find(self, digest):
+        """The ( slot, entry ) for digest or ( first free slot, None )."""
+
+        start = int(hashlib.md5(digest).hexdigest()[:15], 16) % self.slots
+
+        free = None
+
+        for probe in range(self.slots):
+            slot = self._slot(( start + probe ) % self.slots)
+
+            entry = INDEX_SLOT.unpack_from(self.map, slot)
+
+            if entry[1] == EMPTY:
+                return ( slot if free is None else free ), None
+
+            if entry[1] == TOMBSTONE:
+                if free is None:
+                    free = slot
+
+                continue
+
+            if entry[0] == digest:
+                return slot, entry
+
+        return free, None
+
+    def get(self, container, name):
+        """The ( segment, offset, length ) of the object or None."""
+
+        _, entry = self._find(_digest(container, name))
+
+        return entry and entry[1:]
+
+    def put(self, digest, segment, offset, length):
+        """Point digest at the record; return the previous location or None."""
+
+        if ( self.used + 1 ) > self.slots * self.LOAD_FACTOR:
+            self._resize(self.slots * 2)
+
+        slot, entry = self._find(digest)
+
+        if entry is None and INDEX_SLOT.unpack_from(self.map, slot)[1] == EMPTY:
+            self._set_used(self.used + 1)
+
+        INDEX_SLOT.pack_into(self.map, slot, digest, segment, offset, length)
+
+        return entry and entry[1:]
+
+    def delete(self, digest):
+        """Remove digest; return the previous location or None."""
+
+        slot, entry = self._find(digest)
+
+        if entry is not None:
+            INDEX_SLOT.pack_into(self.map, slot, b"\0" * 16, TOMBSTONE, 0, 0)
+
+        return entry and entry[1:]
+
+    def entries(self):
+        """Every live ( digest, segment, offset, length )."""
+
+        for index in range(self.slots):
+            entry = INDEX_SLOT.unpack_from(self.map, self._slot(index))
+
+            if entry[1] not in ( EMPTY, TOMBSTONE ):
+                yield entry
+
+    def _resize(self, slots):
+        logger.info("Resizing packfile index %s to %s slots", self.path, slots)
+
+        temporary = self.path + ".tmp"
+
+        self._create(temporary, slots)
+
+        resized = PackfileIndex(temporary)
+
+        for entry in self.entries():
+            resized.put(*entry)
+
+        resized.map.flush()
+
+        os.rename(temporary, self.path)
+
+        self._map()
+
+class SegmentReader(object):
+    """A read-only file limited to one object's data in a segment.
+
+    Has a fileno (positioned at the data) so WSGI servers that support
+    wsgi.file_wrapper can send the object with sendfile; the length is the
+    response's Content-Length.
+
+    """
+
+    def __init__(self, path, offset, length):
+        self.length = length
+
+        self._file = open(path, "rb")
+        self._file.seek(offset)
+
+        self._remaining = length
+
+    def __len__(self):
+        return self.length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size = -1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+
+        data = self._file.read(size)
+
+        self._remaining -= len(data)
+
+        return data
+
+    def close(self):
+        self._file.close()
+
+class PackfileStore(object):
+    """An object store backed by segment files in a local directory.
+
+    Parameters
+    ----------
+
+    :directory:           The directory holding the segments and index.
+    :segment_size:        Start a new segment once the active one reaches this
+                          many bytes.
+    :compaction_interval: The number of seconds between compactions.
+    :compaction_ratio:    Compact segments whose live bytes are less than this
+                          fraction of their size.
+
+    """
+
+    def __init__(self, directory, segment_size = 256 * 1024 * 1024, compaction_interval = 600, compaction_ratio = 0.5):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compaction_interval = compaction_interval
+        self.compaction_ratio = compaction_ratio
+
+        try:
+            os.makedirs(self.directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+        self.index = PackfileIndex(os.path.join(self.directory, "index"))
+
+        self._lock = threading.RLock()
+        self._maps = {} # segment → ( ( inode, ctime ), mmap )
+
+        self._compactor = None
+
+    def __repr__(self):
+        return "PackfileStore({0!r})".format(self.directory)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "segment-{0:08d}".format(segment))
+
+    def _segments(self):
+        return sorted([ int(_.group("number")) for _ in [ SEGMENT_PATTERN.match(_) for _ in os.listdir(self.directory) ] if _ is not None ])
+
+    def _writing(self):
+        return _WriteLock(self)
+
+    def _active_segment(self):
+        """The segment to append to (called with the write lock held).
+
+        Its number is kept in the sequence file and only ever increases so a
+        compacted segment's number isn't handed out again.
+
+        """
+
+        path = os.path.join(self.directory, "sequence")
+
+        try:
+            with open(path) as fh:
+                sequence = int(fh.read())
+        except (IOError, ValueError):
+            segments = self._segments()
+
+            sequence = None
+            segment = segments[-1] if len(segments) else 1
+        else:
+            segment = sequence
+
+        if os.path.exists(self._segment_path(segment)) and os.path.getsize(self._segment_path(segment)) >= self.segment_size:
+            segment += 1
+
+        if segment != sequence:
+            with open(path + ".tmp", "w") as fh:
+                fh.write(str(segment))
+
+            os.rename(path + ".tmp", path)
+
+        return segment
+
+    def _append(self, segment, container, name, data):
+        container, name, data = _encode(container), _encode(name), _encode(data)
+
+        with open(self._segment_path(segment), "ab") as fh:
+            fh.seek(0, os.SEEK_END)
+
+            offset = fh.tell()
+
+            fh.write(RECORD_HEADER.pack(len(container), len(name), len(data)))
+            fh.write(container)
+            fh.write(name)
+            fh.write(data)
+
+        return offset
+
+    def _map_segment(self, segment, end):
+        """The mmap of segment covering at least end bytes.
+
+        A cached mmap is only used while the segment file has the same inode
+        and ctime (i.e. it's not a segment another process compacted away).
+
+        """
+
+        status = os.stat(self._segment_path(segment))
+
+        identity = ( status.st_ino, status.st_ctime )
+
+        cached = self._maps.get(segment)
+
+        if cached is None or cached[0] != identity or len(cached[1]) < end:
+            with open(self._segment_path(segment), "rb") as fh:
+                cached = self._maps[segment] = ( identity, mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ) )
+
+        return cached[1]
+
+    def _locate(self, container, name):
+        """The ( segment, data offset, length ) of the object.
+
+        The index is refreshed first (a stat) because another process may have
+        resized (replaced) it; the old mapping would still return the
+        locations of overwritten objects.
+
+        Raises KeyError if the object doesn't exist.
+
+        """
+
+        self.index.refresh()
+
+        for attempt in range(2):
+            location = self.index.get(container, name)
+
+            if location is not None:
+                segment, offset, length = location
+
+                try:
+                    mapped = self._map_segment(segment, offset + RECORD_HEADER.size)
+                except (IOError, OSError):
+                    location = None # Compacted away by another process.
+                else:
+                    container_length, name_length, _ = RECORD_HEADER.unpack_from(mapped, offset)
+
+                    return segment, offset + RECORD_HEADER.size + container_length + name_length, length
+
+            self.index.refresh()
+
+        raise KeyError(( container, name ))
+
+    def create_container(self, name):
+        """A handle on the container, name; containers are implicit here."""
+
+        from margarine.objectstores import Container
+
+        return Container(name, self)
+
+    def store_object(self, container, name, data, content_type = None):
+        """Append data as the object, name, in container."""
+
+        with self._writing():
+            segment = self._active_segment()
+
+            offset = self._append(segment, container, name, data)
+
+            self.index.put(_digest(container, name), segment, offset, len(_encode(data)))
+
+        self._start_compactor()
+
+    def fetch_object(self, container, name):
+        """The data of the object, name, in container (as a string)."""
+
+        segment, offset, length = self._locate(container, name)
+
+        return self._map_segment(segment, offset + length)[offset:offset + length]
+
+    def open_object(self, container, name):
+        """A SegmentReader for the object, name, in container."""
+
+        segment, offset, length = self._locate(container, name)
+
+        return SegmentReader(self._segment_path(segment), offset, length)
+
+    def delete_object(self, container, name):
+        with self._writing():
+            self.index.delete(_digest(container, name))
+
+    def compact(self):
+        """Rewrite the live records of mostly dead segments and remove them.
+
+        Readers that still hold a segment's mmap (or an open SegmentReader)
+        keep reading it after it's unlinked.
+
+        """
+
+        with self._writing():
+            active = self._active_segment()
+
+            live = {}
+
+            for digest, segment, offset, length in self.index.entries():
+                live.setdefault(segment, []).append(( digest, offset ))
+
+            for segment in self._segments():
+                if segment == active:
+                    continue
+
+                path = self._segment_path(segment)
+                size = os.path.getsize(path)
+
+                records = live.get(segment, [])
+
+                mapped = self._map_segment(segment, size) if size else None
+
+                live_size = 0
+
+                for digest, offset in records:
+                    container_length, name_length, length = RECORD_HEADER.unpack_from(mapped, offset)
+                    live_size += RECORD_HEADER.size + container_length + name_length + length
+
+                if size and float(live_size) / size >= self.compaction_ratio:
+                    continue
+
+                logger.info("Compacting %s (%s of %s bytes live)", path, live_size, size)
+
+                for digest, offset in records:
+                    container_length, name_length, length = RECORD_HEADER.unpack_from(mapped, offset)
+
+                    start = offset + RECORD_HEADER.size
+
+                    container = mapped[start:start + container_length]
+                    name = mapped[start + container_length:start + container_length + name_length]
+                    data = mapped[start + container_length + name_length:start + container_length + name_length + length]
+
+                    new_offset = self._append(active, container, name, data)
+
+                    self.index.put(digest, active, new_offset, length)
+
+                os.unlink(path)
+
+                self._maps.pop(segment, None)
+
+    def _compact_periodically(self):
+        while True:
+            time.sleep(self.compaction_interval)
+
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Failed to compact %s", self.directory)
+
+    def _start_compactor(self):
+        if not self.compaction_interval or self._compactor == os.getpid():
+            return
+
+        self._compactor = os.getpid()
+
+        thread = threading.Thread(target = self._compact_periodically, name = "packfile-compactor")
+        thread.daemon = True
+        thread.start()
+
+class _WriteLock(object):
+    """Holds the store's thread lock and the directory's flock."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+
+        try:
+            self._file = open(os.path.join(self.store.directory, "lock"), "a")
+
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+                self.store.index.refresh()
+            except Exception:
+                self._file.close() # Releases the flock if it was taken.
+
+                raise
+        except Exception:
+            self.store._lock.release()
+
+            raise
+
+    def __exit__(self, *args):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+        self._file.close()
+
+        self.store._lock.release()
@@ -11,6 +11,8 @@ import argparse
 import copy
 import logging
 import logging.config
+import signal
+import threading
 
 try:
     import ConfigParser as configparser
@@ -18,12 +20,15 @@ except ImportError:
     import configparser
 
 from margarine import information
+from margarine import loggers
 
 logger = logging.getLogger(__name__)
 
 CONFIGURATION_DIRECTORY = os.path.join(os.path.sep, "etc", "margarine")
 CONFIGURATION_FILE = os.path.join(CONFIGURATION_DIRECTORY, "margarine.ini")
 
+RESOLUTION_LOCK = threading.RLock()
+
 def extract_defaults(parameters, prefix = "", keep = lambda _: _):
     """Extract the default values for the passed parameters.
 
@@ -44,6 +49,33 @@ def extract_defaults(parameters, prefix = "", keep = lambda _: _):
 
     return dict([ (prefix + item["options"][0][2:], (item["default"], item.get("only"))) for item in filter(keep, parameters) if "default" in item ])
 
+def boolean(value):
+    """Interpret a boolean parameter's value.
+
+    Values from the command line are already bools but those from the
+    environment and configuration files are strings (i.e. "true", "no", "1").
+    Also usable as an argparse type.
+
+    Examples
+    --------
+
+    >>> boolean(Parameters()["tokens.signed"])
+
+    """
+
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).strip().lower()
+
+    if value in ( "true", "yes", "on", "1" ):
+        return True
+
+    if value in ( "false", "no", "off", "0", "", "none" ):
+        return False
+
+    raise ValueError("Not a boolean: {0}".format(value))
+
 # TODO Refactor for testability.
 
 class Parameters(object):
@@ -177,15 +209,62 @@ class Parameters(object):
         configuration parser that we can retrieve keys with.  Otherwise, we
         ignore the configuration file completely.
 
+        Once the file(s) have been re-read, the resolved snapshot of all
+        parameters is rebuilt to reflect their contents.
+
         """
 
-        if file_path is not None:
-            logger.info("Parsing %s", file_path)
-            self._create_configuration_parser(file_path)
-        else:
+        file_paths = [ file_path ]
+
+        if file_path is None:
             logger.info("Parsing all files")
-            for file_path in self._configuration_files.keys():
-                self.reinitialize(file_path)
+            file_paths = list(self._configuration_files.keys())
+
+        for file_path in file_paths:
+            logger.info("Parsing %s", file_path)
+            self._configuration_files[file_path] = self._create_configuration_parser(file_path)
+
+        self._resolve()
+
+    def reload(self):
+        """Re-read all configuration files and swap in the result atomically.
+
+        Unlike reinitialize, the configuration files are parsed into new
+        parsers that are not visible to any lookups until the new snapshot is
+        complete.  The snapshot is then swapped in with a single assignment and
+        any subscribers of changed keys are notified.
+
+        This is safe to invoke from a thread other than the one serving
+        requests (i.e. the configuration watcher).
+
+        """
+
+        logger.info("Reloading all files")
+
+        configuration_files = dict([ (file_path, self._create_configuration_parser(file_path)) for file_path in self._configuration_files ])
+
+        self._resolve(configuration_files)
+
+    def subscribe(self, key, callback):
+        """Invoke callback whenever the resolved value of key changes.
+
+        Subsystems holding resources derived from a parameter (i.e. connections
+        built from a URL) use this to learn when they need to be rebuilt.  The
+        callback is invoked after the new snapshot is in place as
+        ``callback(key, previous, current)``.
+
+        Arguments
+        ---------
+
+        :``key``:      The parameter key to watch (i.e. "keystore.url").
+        :``callback``: The callable to invoke when the value changes.
+
+        """
+
+        if not hasattr(self, "_subscribers"):
+            self._subscribers = {}
+
+        self._subscribers.setdefault(key, []).append(callback)
 
     def parse(self, components = { "cli", "file", "environment" }, only_known = False, file_path = None):
         """Parse the specified components' arguments.
@@ -228,11 +307,142 @@ class Parameters(object):
 
         if "file" in components:
             self.reinitialize(file_path)
-
-        # Environment doesn't need to be pre-parsed.
+        else:
+            # Environment doesn't need to be pre-parsed but it is captured in
+            # the resolved snapshot.
+            self._resolve()
 
         return self
 
+    def _resolve(self, configuration_files = None):
+        """Build the resolved snapshot of every known parameter.
+
+        Walks the defaults, environment, configuration files, and command line
+        arguments once for every known key and records the winning value.  The
+        snapshot (a plain dict) is never modified after it's built; rebuilding
+        replaces it wholesale so a lookup always sees a consistent set of
+        values.
+
+        This is invoked whenever the inputs change (i.e. ``parse``,
+        ``reinitialize``, or the registration of new parameters) and is what
+        allows ``__getitem__`` and ``__contains__`` to be simple dict lookups.
+
+        Arguments
+        ---------
+
+        :``configuration_files``: Freshly parsed configuration files to resolve
+                                  against and install with the snapshot.  If
+                                  this is ``None``, the current configuration
+                                  files are used.
+
+        """
+
+        with RESOLUTION_LOCK:
+            if configuration_files is None:
+                configuration_files = self._configuration_files
+
+            keys = []
+            seen = set()
+
+            for item in self.parameters:
+                key = item["options"][0][2:]
+
+                if item["group"] != "default":
+                    key = item["group"] + "." + key
+
+                keys.append(key)
+
+            keys += list(self.defaults)
+
+            keys = [ key for key in keys if not (key in seen or seen.add(key)) ]
+
+            program = sys.argv[0].rsplit('/', 1)[-1].upper()
+
+            snapshot = dict([ (key, self._resolve_key(key, program, configuration_files)) for key in keys ])
+
+            previous = getattr(self, "_snapshot", {})
+
+            self._configuration_files = configuration_files
+            self._keys = tuple(keys)
+            self._snapshot = snapshot
+
+        logger.debug("resolved %s parameters", len(snapshot))
+
+        for key, callbacks in getattr(self, "_subscribers", {}).items():
+            if key not in previous or previous[key] == snapshot.get(key):
+                continue
+
+            logger.info("%s changed; notifying %s subscriber(s)", key, len(callbacks))
+
+            for callback in callbacks:
+                try:
+                    callback(key, previous[key], snapshot.get(key))
+                except Exception as e:
+                    logger.exception(e)
+
+    def _resolve_key(self, key, program, configuration_files):
+        """Determine the value of a single key from all of our sources.
+
+        Sources are checked in the following order with the later sources
+        taking precedence (if they differ from the default):
+
+        1. default
+        2. environment
+        3. configuration file(s)
+        4. command line arguments
+
+        Arguments
+        ---------
+
+        :``key``:                 The dotted key (i.e. "group.option") to
+                                  resolve.
+        :``program``:             The program name prefix for environment
+                                  variables.
+        :``configuration_files``: The configuration parsers to search.
+
+        Returns
+        -------
+
+        The resolved value for ``key``.
+
+        """
+
+        default = None 
+        if key in self.defaults:
+            default = self.defaults[key][0] # TODO Consider only?
+
+        split = key.split('.', 1)
+
+        fmt = "{0}_{1}_{2}" if len(split) > 1 else "{0}_{1}"
+
+        environ_key = fmt.format(program, *[ _.upper() for _ in split ]).replace("-", "_")
+
+        value = os.environ.get(environ_key, default)
+
+        section, option = split if len(split) > 1 else [ "default" ] + split
+
+        for configuration_file in configuration_files.values():
+            if configuration_file is None:
+                continue
+
+            try:
+                configuration_value = configuration_file.get(section, option)
+                if configuration_value != default:
+                    value = configuration_value
+                    break
+            except (configparser.NoOptionError, configparser.NoSectionError):
+                pass
+
+        argument_key = "_".join(split).replace("-", "_")
+
+        if hasattr(self.arguments, argument_key):
+            argument_value = getattr(self.arguments, argument_key)
+
+            if argument_value != default:
+                value = argument_value
+
+        return value
+
     def _create_configuration_parser(self, file_path):
         """Create a fully initialized configuration parser with the parameters.
 
@@ -255,13 +465,15 @@ class Parameters(object):
 
         """
         
-        self._configuration_files[file_path] = configparser.SafeConfigParser()
+        configuration_parser = configparser.SafeConfigParser()
 
         logger.debug("file_path: %s", file_path)
 
         if os.access(file_path, os.R_OK):
             logger.debug("file is readable")
-            self._configuration_files[file_path].read(file_path)
+            configuration_parser.read(file_path)
+
+        return configuration_parser
 
     def _add_argument_parameters(self, name, parameters):
         """Add arguments to the argument parser.
@@ -330,77 +542,14 @@ class Parameters(object):
         return len(self.parameters)
 
     def __getitem__(self, key):
-        if key not in self:
-            raise KeyError(key)
-
-        if not getattr(self, "parsed", False):
+        if not getattr(self, "parsed", False) and not getattr(self, "_warned", False):
             logger.warn("Parameters not parsed.")
+            self._warned = True
 
-        logger.info("Searching for key: %s", key)
-
-        value = None
-
-        default = None 
-        if key in self.defaults:
-            default = self.defaults[key][0] # TODO Consider only?
-
-        logger.debug("default: %s", default)
-
-        logger.info("Checking Environment")
-
-        split = key.split('.', 1)
-
-        fmt = "{0}_{1}_{2}" if len(split) > 1 else "{0}_{1}"
-
-        environ_key = fmt.format(sys.argv[0].rsplit('/', 1)[-1].upper(), *[ _.upper() for _ in split ]).replace("-", "_")
-
-        logger.debug("environ_key: %s", environ_key)
-
-        value = os.environ.get(environ_key, default)
-
-        logger.debug("value: %s", value)
-
-        logger.info("Checking Configuration File")
-
-        logger.debug("self._configuration_files: %s", self._configuration_files)
-
-        for configuration_file in self._configuration_files.values():
-            if configuration_file is None:
-                continue
-
-            try:
-                logger.debug("type(configuration_file): %s", type(configuration_file))
-                logger.debug("configuration_file: %s", configuration_file)
-
-                configuration_value = configuration_file.get(*key.split(".", 1))
-                if configuration_value != default:
-                    value = configuration_value
-                    break
-            except (configparser.NoOptionError, configparser.NoSectionError):
-                pass
-
-        logger.debug("value: %s", value)
-
-        logger.info("Checking CLI Arguments")
-
-        argument_key = "_".join(key.split(".", 1)).replace("-", "_")
-
-        logger.debug("self.arguments.%s: %s", argument_key, getattr(self.arguments, argument_key, None))
-
-        if hasattr(self.arguments, argument_key):
-            argument_value = getattr(self.arguments, argument_key)
-
-            logger.debug("argument_value: %s", argument_value)
-
-            if argument_value != default:
-                value = argument_value
-
-        logger.debug("value: %s", value)
-
-        return value 
+        return self._snapshot[key]
 
     def __contains__(self, key):
-        return key in self.iterkeys()
+        return key in self._snapshot
 
     def __iter__(self):
         return self.iterkeys()
@@ -425,25 +574,7 @@ class Parameters(object):
             yield (key, self[key])
 
     def iterkeys(self):
-        seen = []
-
-        for item in self.parameters:
-            value = item["options"][0][2:]
-
-            if item["group"] != "default":
-                value = item["group"] + "." + value
-
-            seen += [value]
-
-            yield value
-
-        for item in self.defaults:
-            if item in seen:
-                continue
-
-            logger.info("Inspecting Key %s", item)
-
-            yield item
+        return iter(self._keys)
 
     def itervalues(self):
         for key in self.iterkeys():
@@ -477,12 +608,41 @@ Parameters("logging", parameters = [
                 "The configuration file containing the logging " \
                 "mechanism used by %(prog)s.  Default: %(default)s.",
         },
+    { # --logging-asynchronous[=BOOLEAN]; BOOLEAN ← False
+        "options": [ "--asynchronous" ],
+        "type": boolean,
+        "nargs": "?",
+        "const": True,
+        "default": False,
+        "help": \
+                "Write log records from a background thread rather than the " \
+                "thread that emits them.",
+        },
+    { # --logging-sample=N; N ← 1
+        "options": [ "--sample" ],
+        "type": int,
+        "default": 1,
+        "help": \
+                "Only emit one of every %(metavar)s debug records from each " \
+                "logging call site.  Default: %(default)s.",
+        },
+    { # --logging-abbreviate=N; N ← 1024
+        "options": [ "--abbreviate" ],
+        "type": int,
+        "default": 1024,
+        "help": \
+                "The number of characters large values (documents, " \
+                "responses, &c) are truncated to when logged.  Default: " \
+                "%(default)s.",
+        },
     ])
 
 def configure_logging():
     """Configure the system loggers using the Parameters' file provided.
 
-    Uses Parameters[logging.configuration] to setup all logging mechanisms.
+    Uses Parameters[logging.configuration] to setup all logging mechanisms and
+    then applies the asynchronous, sampling, and abbreviation options (see
+    margarine.loggers).
 
     """
 
@@ -491,3 +651,81 @@ def configure_logging():
     if os.access(logging_configuration_path, os.R_OK):
         logging.config.fileConfig(Parameters()["logging.configuration"])
 
+    loggers.configure(
+            asynchronous = boolean(Parameters()["logging.asynchronous"]),
+            sample = int(Parameters()["logging.sample"]),
+            length = int(Parameters()["logging.abbreviate"]),
+            )
+
+
+Parameters("reload", parameters = [
+    { # --reload-interval=T; T ← 0
+        "options": [ "--interval" ],
+        "default": 0,
+        "type": int,
+        "help": \
+                "The number of seconds between checks of the configuration " \
+                "files for modifications.  If any have changed, the " \
+                "configuration is reloaded.  A value of zero (the default) " \
+                "disables polling but the configuration can still be " \
+                "reloaded by sending SIGHUP to %(prog)s.",
+        },
+    ])
+
+CONFIGURATION_WATCHER = None
+
+def watch_configuration():
+    """Reload the configuration files on SIGHUP or when they're modified.
+
+    Starts a daemon thread that rebuilds the parameters (via
+    Parameters.reload) whenever a SIGHUP is received or, if
+    Parameters[reload.interval] is non-zero, the modification time of any
+    configuration file changes.  The reload happens entirely on the watcher's
+    thread and requests continue to be served from the previous snapshot until
+    the new one is swapped in.
+
+    .. note::
+        Signal handlers can only be installed from the main thread.  If this
+        is invoked from another thread (i.e. inside a WSGI container) only the
+        polling mechanism is available.
+
+    """
+
+    global CONFIGURATION_WATCHER
+
+    if CONFIGURATION_WATCHER is not None:
+        return
+
+    interval = int(Parameters()["reload.interval"]) or None
+
+    requested = threading.Event()
+
+    def _modifications():
+        return dict([ (file_path, os.path.getmtime(file_path)) for file_path in Parameters()._configuration_files if os.access(file_path, os.R_OK) ])
+
+    def _watch():
+        modifications = _modifications()
+
+        while True:
+            requested.wait(interval)
+
+            current = _modifications()
+
+            if requested.is_set() or current != modifications:
+                requested.clear()
+
+                try:
+                    Parameters().reload()
+                except Exception as e:
+                    logger.exception(e)
+
+            modifications = current
+
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: requested.set())
+    except ValueError:
+        logger.warn("Not in the main thread; SIGHUP will not reload the configuration.")
+
+    CONFIGURATION_WATCHER = threading.Thread(target = _watch, name = "configuration-watcher")
+    CONFIGURATION_WATCHER.daemon = True
+    CONFIGURATION_WATCHER.start()
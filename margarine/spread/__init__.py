@@ -3,20 +3,64 @@
 # margarine is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
-import pika
 import logging
+import sys
+import time
 
 from margarine.parameters import Parameters
 from margarine.parameters import configure_logging
+from margarine.parameters import watch_configuration
 
 configure_logging()
 
 from margarine.communication import get_channel
+from margarine.compression import get_codec
+from margarine.helpers import get_connection_spec
 from margarine.spread import users
 from margarine.spread import articles
 
 logger = logging.getLogger(__name__)
 
+def consume():
+    """Consume the spread queues on a new channel until it's closed.
+
+    Declares the spread topology (see users.register and articles.register)
+    and runs the consumers.
+
+    """
+
+    channel = get_channel()
+
+    prefetch_count = get_connection_spec("queue.url").option("prefetch_count", 0, int)
+
+    if prefetch_count:
+        channel.basic_qos(prefetch_count = prefetch_count)
+
+    users.register(channel)
+    articles.register(channel)
+
+    channel.start_consuming()
+
+    channel.close()
+
+def run():
+    """Consume the spread queues forever.
+
+    Runs consume again when its channel is closed (or queue.wait seconds after
+    it fails) so a failure doesn't stop the consumers.
+    With an embedded memory:// queue this is run by blend in a thread (see
+    margarine.embeddedqueues).
+
+    """
+
+    while True:
+        try:
+            consume()
+        except Exception as e:
+            logger.exception(e)
+
+            time.sleep(int(Parameters()["queue.wait"]))
+
 def main():
     """Set us up the bomb.
 
@@ -26,18 +70,18 @@ def main():
 
     Parameters().parse()
 
-    # TODO Manage threads for load balancing.
+    if get_connection_spec("queue.url").scheme == "memory":
+        logger.error("A memory:// queue.url is consumed in blend's process; spread isn't needed")
+        sys.exit(1)
 
-    while True:
-        try:
-            channel = get_channel()
+    try:
+        get_codec()
+    except ValueError as error:
+        logger.error(error)
+        sys.exit(1)
 
-            users.register(channel)
-            articles.register(channel)
+    watch_configuration()
 
-            channel.start_consuming()
-        except (pika.exceptions.ChannelClosed) as e:
-            logger.exception(e)
-        else:
-            channel.close()
+    # TODO Manage threads for load balancing.
 
+    run()
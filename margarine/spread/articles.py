@@ -6,20 +6,40 @@
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 import logging
-import json
 import datetime
-import pika
 import urllib2
 import bs4
-import sys
-import uuid
+
+from bson.binary import Binary
 
 from margarine.aggregates import get_collection
-from margarine.aggregates import get_container
+from margarine.objectstores import get_article_location
+from margarine.objectstores import get_container
 from margarine.communication import get_channel
+from margarine.communication import get_message_properties
+from margarine.compression import compress
+from margarine.compression import get_codec
+from margarine.loggers import abbreviate
+from margarine.messages import decode
+from margarine.messages import encode
+from margarine.parameters import Parameters
 
 logger = logging.getLogger(__name__)
 
+Parameters("inline", parameters = [
+    { # --inline-threshold=KB; KB ← 16
+        "options": [ "--threshold" ],
+        "type": int,
+        "default": 16,
+        "help": \
+                "Article bodies smaller than this many KiB are stored in the " \
+                "article document rather than the object store (0 stores " \
+                "every body in the object store); default: %(default)s.  " \
+                "See margarine.tools.bodies for the distribution of body " \
+                "sizes.",
+        },
+    ])
+
 def create_article_consumer(channel, method, header, body):
     """Create an article—completing the bottom half of article creation.
 
@@ -48,9 +68,9 @@ def create_article_consumer(channel, method, header, body):
 
     """
 
-    article = json.loads(body)
+    article = decode(body, header)
 
-    logger.debug("article: %s", article)
+    logger.debug("article: %s", abbreviate(article))
 
     _id = article.pop("_id")
 
@@ -58,27 +78,23 @@ def create_article_consumer(channel, method, header, body):
 
     _ = articles.find_one({ "_id": _id })
 
-    logger.debug("Found: %s", _)
+    logger.debug("Found: %s", abbreviate(_))
 
     if _ is None or "created_at" not in _:
         article["created_at"] = datetime.datetime.now()
 
     article = dict([ (k, v) for k, v in article.iteritems() if _ is None or k not in _ or v != _[k] ])
 
-    logger.debug("article: %s", article)
+    logger.debug("article: %s", abbreviate(article))
     logger.debug("_id: %s", _id)
 
     get_collection("articles").update({ "_id": _id }, { "$set": article }, upsert = True)
 
-    message_properties = pika.BasicProperties()
-    message_properties.content_type = "application/json"
-    message_properties.durable = False
-
-    message = json.dumps({ "_id": _id })
+    message, content_type = encode("articles.update", { "_id": _id })
 
     _ = get_channel()
     _.exchange_declare(exchange = "margarine.articles.create", type = "fanout", auto_delete = False)
-    _.basic_publish(body = message, exchange = "margarine.articles.create", properties = message_properties, routing_key = "articles.create")
+    _.basic_publish(body = message, exchange = "margarine.articles.create", properties = get_message_properties(content_type), routing_key = "articles.create")
     _.close()
 
     channel.basic_ack(delivery_tag = method.delivery_tag)
@@ -105,9 +121,9 @@ def update_references_consumer(channel, method, header, body):
 
     """
 
-    article = json.loads(body)
+    article = decode(body, header)
 
-    logger.debug("article: %s", article)
+    logger.debug("article: %s", abbreviate(article))
 
     article = get_collection("articles").find_one({ "_id": article["_id"] })
 
@@ -132,10 +148,14 @@ def sanitize_html_consumer(channel, method, header, body):
     feel of the structure to someone reading the content of the body of the
     document.
 
-    .. note::
-        Analysis will be necessary that shows the statistics on sanitized HTML
-        size for a determination as to whether we can store it inline in Mongo
-        or out of band in an object store like Rackspace Cloud Files.
+    Bodies smaller than inline.threshold KiB are stored in the article's text
+    field so they're served with the document; larger bodies are uploaded to
+    the object store (see get_article_location) and referenced by
+    text_container_name, text_object_name, and text_layout.  Bodies are
+    compressed with compression.codec (recorded in the encoding field) before
+    either; the size field records the body's size in bytes and stored_size
+    its compressed size.  A body previously stored elsewhere in the object
+    store is deleted once the article references its replacement.
 
     The decisions and algorithms used for streamlining the HTML are not
     proprietary in any way and can be used and modified under the terms of this
@@ -144,7 +164,7 @@ def sanitize_html_consumer(channel, method, header, body):
 
     """
 
-    _id = json.loads(body)["_id"]
+    _id = decode(body, header)["_id"]
 
     logger.debug("article._id: %s", _id)
 
@@ -158,7 +178,7 @@ def sanitize_html_consumer(channel, method, header, body):
     response = urllib2.urlopen(request)
 
     logger.debug("response: %s", response)
-    logger.debug("response.info(): %s", response.info())
+    logger.debug("response.info(): %s", abbreviate(response.info()))
     logger.debug("response.info().__class__: %s", response.info().__class__)
 
     etag = response.info().getheader("etag")
@@ -172,6 +192,8 @@ def sanitize_html_consumer(channel, method, header, body):
     if article.get("etag") != etag:
         logger.info("Parsing full HTML of %s", article["url"])
 
+        previous = ( article.get("text_container_name"), article.get("text_object_name") )
+
         article["etag"] = etag
 
         response = urllib2.urlopen(article["url"])
@@ -184,21 +206,57 @@ def sanitize_html_consumer(channel, method, header, body):
 
         article["parsed_at"] = datetime.datetime.now()
 
-        logger.debug("HTML Size: %s B", sys.getsizeof(html))
-        article["size"] = sys.getsizeof(html)
+        data = html.encode("utf-8")
+
+        logger.debug("HTML Size: %s B", len(data))
+        article["size"] = len(data)
+
+        codec = get_codec()
+
+        data = compress(codec, data)
+
+        logger.debug("Stored Size: %s B (%s)", len(data), codec)
+        article["stored_size"] = len(data)
+
+        if codec is not None:
+            article["encoding"] = codec
+        else:
+            article.pop("encoding", None)
+
+        unset = [] if codec is not None else [ "encoding" ]
+
+        if len(data) < int(Parameters()["inline.threshold"]) * 1024:
+            article["text"] = html if codec is None else Binary(data)
+
+            article.pop("text_container_name", None)
+            article.pop("text_object_name", None)
+            article.pop("text_layout", None)
+
+            unset.extend([ "text_container_name", "text_object_name", "text_layout" ])
+        else:
+            article["text_container_name"], article["text_object_name"], article["text_layout"] = get_article_location(_id)
+
+            article.pop("text", None)
+
+            logger.info("Uploading text to the object store")
+
+            get_container(article["text_container_name"]).store_object(article["text_object_name"], data, content_type = "text/html")
 
-        container_part, object_part = str(uuid.UUID(_id)).split("-", 1)
+            logger.info("Uploaded text to the object store")
 
-        article["text_container_name"] = "margarine-" + container_part
-        article["text_object_name"] = object_part
+            unset.append("text")
 
-        logger.info("Uploading text to cloudfiles")
+        update = { "$set": article, "$unset": dict([ ( _, "" ) for _ in unset ]) }
 
-        get_container(article["text_container_name"]).store_object(article["text_object_name"], html, content_type = "text/html")
+        articles.update({ "_id": _id }, update, upsert = True)
 
-        logger.info("Uploaded text to cloudfiles")
+        if None not in previous and previous != ( article.get("text_container_name"), article.get("text_object_name") ):
+            logger.info("Deleting the previous text of %s from %s/%s", _id, previous[0], previous[1])
 
-        articles.update({ "_id": _id }, { "$set": article }, upsert = True)
+            try:
+                get_container(previous[0]).delete_object(previous[1])
+            except Exception as error:
+                logger.warning("Failed to delete %s/%s: %s", previous[0], previous[1], error)
 
     logger.info("finished processing article: %s", article["url"])
 
@@ -7,7 +7,6 @@
 
 import hashlib
 import logging
-import json
 import uuid
 import datetime
 import pymongo
@@ -16,6 +15,7 @@ from margarine.blend import information
 from margarine.aggregates import get_collection
 from margarine.keystores import get_keyspace
 from margarine.communication import send_user_email
+from margarine.messages import decode
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +30,7 @@ def create_user_consumer(channel, method, header, body):
 
     """
     
-    user = json.loads(body)
+    user = decode(body, header)
 
     try:
         get_collection("users").insert(user) # TODO Fix race condition of multiple sign-ups.
@@ -52,7 +52,7 @@ def update_user_consumer(channel, method, header, body):
 
     """
 
-    user = dict([ (k,v) for k,v in json.loads(body).iteritems() if v is not None ])
+    user = dict([ (k,v) for k,v in decode(body, header).iteritems() if v is not None ])
 
     # TODO Stop the silent dropping of username changes:
     user.pop("username")
@@ -72,7 +72,7 @@ def password_email_consumer(channel, method, header, body):
 
     """
 
-    user = json.loads(body)
+    user = decode(body, header)
 
     user = get_collection("users").find_one({ "username": user["username"] })
 
@@ -96,7 +96,7 @@ def password_change_consumer(channel, method, header, body):
    
     """
 
-    user = json.loads(body)
+    user = decode(body, header)
 
     h = hashlib.md5("{0}:{1}:{2}".format(user["username"], information.AUTHENTICATION_REALM, user["password"])).hexdigest()
 
@@ -0,0 +1,488 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""A SQLite datastore speaking the subset of pymongo margarine uses.
+
+Selected with a datastore.url of sqlite:///PATH.  Each collection is a table
+of ( id, document ) where document is the JSON (MongoDB extended JSON) of the
+document.  Queries are translated to SQL over json_extract and the following
+subset of the collection API is provided:
+
+:find_one:     Equality, $exists, $ne, $in, $lt, $lte, $gt, and $gte queries
+               with inclusive or exclusive projections.
+:find:         As find_one with sort, skip, limit, and count on the cursor.
+:insert:       One or many documents (an ObjectId _id is added if missing).
+:update:       $set and $unset (or a replacement document), upsert, and multi.
+:remove:       Matching documents.
+:ensure_index: Adds a generated column for each indexed field and indexes
+               the columns; queries and sorts on the field use the column.
+
+Connections are opened in WAL mode (readers don't block the writer) and
+cached per thread (and per process).  Every query of the same shape is the
+same SQL text so sqlite3's statement cache keeps it prepared.
+
+.. note::
+    Values in arrays (i.e. article tags) can't be indexed by a generated
+    column; queries on the fields declared as multikey (see SQLiteDatabase)
+    are answered with json_each.
+
+"""
+
+import calendar
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+OPERATORS = {
+        "$ne": "IS NOT",
+        "$lt": "<",
+        "$lte": "<=",
+        "$gt": ">",
+        "$gte": ">=",
+        }
+
+def _encode(document):
+    from bson import json_util
+
+    return json.dumps(document, default = json_util.default, separators = ( ",", ":" ))
+
+def _object_hook(value):
+    from bson import json_util
+
+    value = json_util.object_hook(value)
+
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        value = value.replace(tzinfo = None) # pymongo returns naive UTC.
+
+    return value
+
+def _decode(text):
+    return json.loads(text, object_hook = _object_hook)
+
+def _duplicate_key(error):
+    """The pymongo.errors.DuplicateKeyError for the sqlite3.IntegrityError."""
+
+    from pymongo.errors import DuplicateKeyError
+
+    return DuplicateKeyError(str(error), 11000)
+
+def _key(value):
+    """The id column of the document with the _id, value."""
+
+    if value is not None and not isinstance(value, ( int, long, float, basestring )):
+        return str(value) # ObjectId, UUID, &c.
+
+    return value
+
+def _value(value):
+    """The SQL parameter that compares like value does in MongoDB.
+
+    Values that are stored as extended JSON objects (ObjectId, UUID, &c) are
+    compared as that JSON (json_extract's value for them).
+
+    """
+
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            value = value - value.utcoffset()
+
+        return calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+
+    if isinstance(value, bool):
+        return int(value)
+
+    if isinstance(value, ( dict, list )):
+        return _encode(value)
+
+    if value is not None and not isinstance(value, ( int, long, float, basestring )):
+        return _encode(value) # ObjectId, UUID, &c.
+
+    return value
+
+def _path(field):
+    if not FIELD_PATTERN.match(field):
+        raise ValueError("Unsupported field: {0}".format(field))
+
+    return "$." + ".".join([ '"{0}"'.format(_) for _ in field.split(".") ])
+
+def _extract(field):
+    """The SQL expression for field (dates compare by their milliseconds)."""
+
+    path = _path(field)
+
+    return "COALESCE(json_extract(document, '{0}.\"$date\"'), json_extract(document, '{0}'))".format(path)
+
+def _column(field):
+    return "f_" + field.replace(".", "__")
+
+def _project(document, fields):
+    if fields is None:
+        return document
+
+    if isinstance(fields, ( list, tuple )):
+        fields = dict([ ( _, 1 ) for _ in fields ])
+
+    if any([ _ for field, _ in fields.items() if field != "_id" ]) or all(fields.values()):
+        included = [ _ for _, value in fields.items() if value ]
+
+        if fields.get("_id", 1):
+            included.append("_id")
+
+        return dict([ ( _, document[_] ) for _ in included if _ in document ])
+
+    return dict([ _ for _ in document.items() if _[0] not in fields ])
+
+def _apply(document, update):
+    """Apply update ($set and $unset or a replacement) to document."""
+
+    if not any([ _.startswith("$") for _ in update ]):
+        replacement = dict(update)
+
+        if "_id" in document:
+            replacement["_id"] = document["_id"]
+
+        return replacement
+
+    unsupported = set(update) - set([ "$set", "$unset" ])
+
+    if len(unsupported):
+        raise ValueError("Unsupported update operators: {0}".format(", ".join(sorted(unsupported))))
+
+    document = dict(document)
+
+    for field, value in update.get("$set", {}).items():
+        if field != "_id":
+            document[field] = value
+
+    for field in update.get("$unset", {}):
+        document.pop(field, None)
+
+    return document
+
+class SQLiteDatabase(object):
+    """A SQLite file standing in for a MongoDB database.
+
+    Parameters
+    ----------
+
+    :path:     The SQLite database file.
+    :timeout:  The number of seconds to wait for a locked database.
+    :multikey: A dict of collection names to the fields whose values are
+               arrays (see margarine.aggregates.register_index).
+
+    """
+
+    def __init__(self, path, timeout = 5.0, multikey = None):
+        self.path = path
+        self.timeout = timeout
+        self.multikey = multikey or {}
+
+        self._local = threading.local()
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "SQLiteDatabase({0!r})".format(self.path)
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = SQLiteCollection(self, name)
+
+            return self._collections[name]
+
+    def connection(self):
+        """The calling thread's connection (opened on first use)."""
+
+        if getattr(self._local, "pid", None) != os.getpid():
+            logger.info("Opening %s", self.path)
+
+            connection = sqlite3.connect(self.path, timeout = self.timeout, isolation_level = None, cached_statements = 256)
+
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return self._local.connection
+
+class SQLiteCursor(object):
+    """The lazily executed results of SQLiteCollection.find."""
+
+    def __init__(self, collection, spec, fields):
+        self.collection = collection
+        self.spec = spec
+        self.fields = fields
+
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction = 1):
+        if isinstance(key_or_list, basestring):
+            key_or_list = [ ( key_or_list, direction ) ]
+
+        self._sort = list(key_or_list)
+
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+
+        return self
+
+    def count(self):
+        where, parameters = self.collection._where(self.spec)
+
+        return self.collection._execute("SELECT COUNT(*) FROM {0}{1}".format(self.collection._table, where), parameters).fetchone()[0]
+
+    def __iter__(self):
+        where, parameters = self.collection._where(self.spec)
+
+        sql = "SELECT document FROM {0}{1}".format(self.collection._table, where)
+
+        if len(self._sort):
+            sql += " ORDER BY " + ", ".join([ "{0} {1}".format(self.collection._expression(field), "DESC" if direction < 0 else "ASC") for field, direction in self._sort ])
+
+        if self._limit or self._skip:
+            sql += " LIMIT ? OFFSET ?"
+            parameters = parameters + [ self._limit or -1, self._skip ]
+
+        for row in self.collection._execute(sql, parameters):
+            yield _project(_decode(row[0]), self.fields)
+
+class SQLiteCollection(object):
+    """A table of JSON documents standing in for a MongoDB collection.
+
+    Parameters
+    ----------
+
+    :database: The SQLiteDatabase holding the table.
+    :name:     The collection (and table) name.
+
+    """
+
+    def __init__(self, database, name):
+        if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+            raise ValueError("Unsupported collection name: {0}".format(name))
+
+        self.database = database
+        self.name = name
+
+        self._table = '"{0}"'.format(name)
+        self._columns = None
+
+    def __repr__(self):
+        return "SQLiteCollection({0!r}, {1!r})".format(self.database, self.name)
+
+    def _execute(self, sql, parameters = ()):
+        if self._columns is None:
+            self._create()
+
+        logger.debug("sql: %s; parameters: %s", sql, parameters)
+
+        return self.database.connection().execute(sql, parameters)
+
+    def _create(self):
+        connection = self.database.connection()
+
+        connection.execute("CREATE TABLE IF NOT EXISTS {0} ( id TEXT PRIMARY KEY, document TEXT NOT NULL )".format(self._table))
+
+        self._columns = frozenset([ _[1] for _ in connection.execute("PRAGMA table_xinfo({0})".format(self._table)) ])
+
+    def _expression(self, field):
+        """The generated column for field if there is one; otherwise, SQL."""
+
+        if field == "_id":
+            return "id"
+
+        if _column(field) in self._columns:
+            return _column(field)
+
+        return _extract(field)
+
+    def _where(self, spec):
+        """The WHERE clause and its parameters for the query, spec."""
+
+        if self._columns is None:
+            self._create()
+
+        clauses, parameters = [], []
+
+        for field, condition in sorted(( spec or {} ).items()):
+            expression = self._expression(field)
+
+            value_of = _key if field == "_id" else _value
+
+            if not isinstance(condition, dict) or not any([ _.startswith("$") for _ in condition ]):
+                if field in self.database.multikey.get(self.name, ()):
+                    clauses.append("EXISTS (SELECT 1 FROM json_each(document, '{0}') WHERE value = ?)".format(_path(field)))
+                else:
+                    clauses.append("{0} = ?".format(expression))
+
+                parameters.append(value_of(condition))
+
+                continue
+
+            for operator, value in sorted(condition.items()):
+                if operator == "$exists":
+                    clauses.append("json_type(document, '{0}') IS {1}NULL".format(_path(field), "NOT " if value else ""))
+                elif operator == "$in":
+                    clauses.append("{0} IN ({1})".format(expression, ", ".join([ "?" ] * len(value))))
+                    parameters.extend([ value_of(_) for _ in value ])
+                elif operator in OPERATORS:
+                    clauses.append("{0} {1} ?".format(expression, OPERATORS[operator]))
+                    parameters.append(value_of(value))
+                else:
+                    raise ValueError("Unsupported query operator: {0}".format(operator))
+
+        return ( " WHERE " + " AND ".join(clauses) if len(clauses) else "" ), parameters
+
+    def find(self, spec = None, fields = None):
+        return SQLiteCursor(self, spec, fields)
+
+    def find_one(self, spec = None, fields = None):
+        if spec is not None and not isinstance(spec, dict):
+            spec = { "_id": spec }
+
+        for document in self.find(spec, fields).limit(1):
+            return document
+
+        return None
+
+    def count(self):
+        return self.find().count()
+
+    def insert(self, doc_or_docs, **kwargs):
+        """Insert the document(s).
+
+        Raises pymongo.errors.DuplicateKeyError (as pymongo does) if a document
+        violates a unique index.
+
+        """
+
+        from bson.objectid import ObjectId
+
+        documents = doc_or_docs if isinstance(doc_or_docs, list) else [ doc_or_docs ]
+
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+
+        self._execute("BEGIN IMMEDIATE")
+
+        try:
+            for document in documents:
+                self._execute("INSERT INTO {0} ( id, document ) VALUES ( ?, ? )".format(self._table), [ _key(document["_id"]), _encode(document) ])
+        except sqlite3.IntegrityError as error:
+            self._execute("ROLLBACK")
+            raise _duplicate_key(error)
+        except:
+            self._execute("ROLLBACK")
+            raise
+
+        self._execute("COMMIT")
+
+        return [ _["_id"] for _ in documents ] if isinstance(doc_or_docs, list) else doc_or_docs["_id"]
+
+    def update(self, spec, document, upsert = False, multi = False, **kwargs):
+        """Update the first (or every if multi) document matching spec.
+
+        Raises pymongo.errors.DuplicateKeyError (as pymongo does) if a document
+        violates a unique index.
+
+        """
+
+        where, parameters = self._where(spec)
+
+        self._execute("BEGIN IMMEDIATE")
+
+        try:
+            rows = self._execute("SELECT id, document FROM {0}{1}{2}".format(self._table, where, "" if multi else " LIMIT 1"), parameters).fetchall()
+
+            for id, current in rows:
+                self._execute("UPDATE {0} SET document = ? WHERE id = ?".format(self._table), [ _encode(_apply(_decode(current), document)), id ])
+
+            if not len(rows) and upsert:
+                from bson.objectid import ObjectId
+
+                created = dict([ _ for _ in ( spec or {} ).items() if not isinstance(_[1], dict) ])
+                created = _apply(created, document)
+                created.setdefault("_id", ( spec or {} ).get("_id", ObjectId()))
+
+                self._execute("INSERT INTO {0} ( id, document ) VALUES ( ?, ? )".format(self._table), [ _key(created["_id"]), _encode(created) ])
+        except sqlite3.IntegrityError as error:
+            self._execute("ROLLBACK")
+            raise _duplicate_key(error)
+        except:
+            self._execute("ROLLBACK")
+            raise
+
+        self._execute("COMMIT")
+
+        return { "n": len(rows) or int(upsert), "updatedExisting": bool(len(rows)) }
+
+    def remove(self, spec = None, **kwargs):
+        where, parameters = self._where(spec)
+
+        self._execute("DELETE FROM {0}{1}".format(self._table, where), parameters)
+
+    def drop(self):
+        self.database.connection().execute("DROP TABLE IF EXISTS {0}".format(self._table))
+
+        self._columns = None
+
+    def ensure_index(self, key_or_list, unique = False, **kwargs):
+        """Index the fields (adding a generated column for each field).
+
+        Indexes on array fields (see SQLiteDatabase) are skipped.  Options other
+        than unique (i.e. background and drop_dups) are ignored.
+
+        """
+
+        if isinstance(key_or_list, basestring):
+            key_or_list = [ ( key_or_list, 1 ) ]
+
+        if self._columns is None:
+            self._create()
+
+        if any([ _[0] in self.database.multikey.get(self.name, ()) for _ in key_or_list ]):
+            logger.info("Not indexing array fields of %s: %s", self.name, key_or_list)
+
+            return None
+
+        connection = self.database.connection()
+
+        for field, _ in key_or_list:
+            if field != "_id" and _column(field) not in self._columns:
+                connection.execute("ALTER TABLE {0} ADD COLUMN {1} GENERATED ALWAYS AS ({2}) VIRTUAL".format(self._table, _column(field), _extract(field)))
+
+        self._create()
+
+        name = "_".join([ self.name ] + [ "{0}_{1}".format(_column(field), direction) for field, direction in key_or_list ]).replace("-", "")
+
+        connection.execute("CREATE {0}INDEX IF NOT EXISTS {1} ON {2} ( {3} )".format(
+            "UNIQUE " if unique else "",
+            name,
+            self._table,
+            ", ".join([ "{0} {1}".format(self._expression(field), "DESC" if direction < 0 else "ASC") for field, direction in key_or_list ]),
+            ))
+
+        return name
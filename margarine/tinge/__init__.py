@@ -39,6 +39,7 @@ from flask import render_template
 
 from margarine.parameters import Parameters
 from margarine.parameters import configure_logging
+from margarine.parameters import watch_configuration
 
 configure_logging()
 
@@ -181,5 +182,9 @@ def _extract_flask_parameters(parameters):
     return flask_parameters
 
 def main():
-    TINGE.run(**_extract_flask_parameters(Parameters().parse()))
+    parameters = Parameters().parse()
+
+    watch_configuration()
+
+    TINGE.run(**_extract_flask_parameters(parameters))
 
@@ -0,0 +1,341 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Signed, stateless authentication tokens.
+
+When tokens.signed is set, login issues tokens of the following form rather
+than random UUIDs stored in the keystore::
+
+    base64(username:expiry:id).base64(HMAC-SHA256(payload))
+
+The HMAC key is derived from the tokens.secret secret (which must be the same
+for every blend process and is never sent to clients) so every blend process
+can verify a token with CPU alone.  Tokens are revoked by id: the id is written to
+the "revocations" keyspace and a sorted set of revocations (by expiry) that
+each process periodically loads into a Bloom filter.  The keystore is only
+consulted when the filter reports that a token might be revoked.
+
+"""
+
+import base64
+import datetime
+import hashlib
+import hmac
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+from margarine.parameters import Parameters
+from margarine.parameters import boolean
+from margarine.keystores import batch
+from margarine.keystores import get_keyspace
+
+logger = logging.getLogger(__name__)
+
+Parameters("tokens", parameters = [
+    { # --tokens-signed[=BOOLEAN]; BOOLEAN ← False
+        "options": [ "--signed" ],
+        "type": boolean,
+        "nargs": "?",
+        "const": True,
+        "default": False,
+        "help": \
+                "Issue HMAC signed tokens (keyed from tokens.secret) that " \
+                "are verified without consulting the keystore.",
+        },
+    { # --tokens-secret=SECRET; SECRET ← None
+        "options": [ "--secret" ],
+        "default": None,
+        "help": \
+                "The secret signed tokens' HMAC key is derived from.  " \
+                "Required for tokens.signed and must be the same for every " \
+                "blend process.",
+        },
+    { # --tokens-refresh=SECONDS; SECONDS ← 30
+        "options": [ "--refresh" ],
+        "type": int,
+        "default": 30,
+        "help": \
+                "The number of seconds between refreshes of the revocation " \
+                "filter; default: %(default)s.",
+        },
+    { # --tokens-capacity=N; N ← 100000
+        "options": [ "--capacity" ],
+        "type": int,
+        "default": 100000,
+        "help": \
+                "The number of revocations the revocation filter is sized " \
+                "for (at a 0.1% false positive rate); default: %(default)s.",
+        },
+    ])
+
+TOKEN_LIFETIME = datetime.timedelta(hours = 6)
+
+REVOCATIONS = "revocations" # The keyspace of revoked token ids.
+REVOCATION_INDEX = "index" # The sorted set (by expiry) of revoked token ids.
+
+REVOCATION_FILTER = None
+
+def _encode(value):
+    return base64.urlsafe_b64encode(value).rstrip(b"=").decode("ascii")
+
+def _decode(value):
+    value = value.encode("ascii")
+
+    return base64.urlsafe_b64decode(value + b"=" * (-len(value) % 4))
+
+try:
+    _compare = hmac.compare_digest
+except AttributeError:
+    def _compare(first, second):
+        if len(first) != len(second):
+            return False
+
+        result = 0
+
+        for x, y in zip(bytearray(first), bytearray(second)):
+            result |= x ^ y
+
+        return result == 0
+
+SIGNING_KEYS = {}
+
+def _signing_key():
+    secret = Parameters()["tokens.secret"]
+
+    if not secret:
+        raise ValueError("tokens.secret must be set to use signed tokens")
+
+    if secret not in SIGNING_KEYS:
+        SIGNING_KEYS.clear()
+        SIGNING_KEYS[secret] = hmac.new(secret.encode("utf-8"), b"margarine.tokens", hashlib.sha256).digest()
+
+    return SIGNING_KEYS[secret]
+
+def _sign(payload):
+    return hmac.new(_signing_key(), payload.encode("ascii"), hashlib.sha256).digest()
+
+class BloomFilter(object):
+    """A fixed size set that may report false positives but never negatives.
+
+    Parameters
+    ----------
+
+    :capacity:   The number of items the filter is sized for.
+    :error_rate: The false positive rate at capacity.
+
+    """
+
+    def __init__(self, capacity, error_rate = 0.001):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.sha1(item.encode("utf-8")).hexdigest()
+
+        first, second = int(digest[:16], 16), int(digest[16:32], 16)
+
+        return [ ( first + _ * second ) % self.size for _ in range(self.hashes) ]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << ( position % 8 )
+
+    def __contains__(self, item):
+        return all([ self.bits[_ // 8] & ( 1 << ( _ % 8 ) ) for _ in self._positions(item) ])
+
+class RevocationFilter(object):
+    """A per-process Bloom filter of revoked token ids.
+
+    The filter is rebuilt from the keystore's revocation index every interval
+    seconds by a background thread (restarted after a fork) and swapped in
+    whole so readers never see a partial filter.  Until the first load
+    succeeds every id is reported as possibly revoked.
+
+    """
+
+    def __init__(self, interval, capacity):
+        self.interval = interval
+        self.capacity = capacity
+
+        self.bloom = None
+        self.pid = None
+
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Rebuild the filter from the revocation index."""
+
+        now = time.time()
+
+        revocations = get_keyspace(REVOCATIONS)
+
+        revocations.zremrangebyscore(REVOCATION_INDEX, "-inf", now)
+
+        ids = revocations.zrangebyscore(REVOCATION_INDEX, now, "+inf")
+
+        bloom = BloomFilter(max(self.capacity, len(ids)))
+
+        for _ in ids:
+            bloom.add(_.decode("utf-8") if isinstance(_, bytes) else _)
+
+        logger.debug("Loaded %s revocations", len(ids))
+
+        self.bloom = bloom
+
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the revocation filter")
+
+    def _start(self):
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            self.bloom = None
+
+            thread = threading.Thread(target = self._refresh_periodically, name = "revocation-filter")
+            thread.daemon = True
+            thread.start()
+
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Failed to load the revocation filter")
+
+    def add(self, id):
+        bloom = self.bloom
+
+        if bloom is not None:
+            bloom.add(id)
+
+    def __contains__(self, id):
+        if self.pid != os.getpid():
+            self._start()
+
+        bloom = self.bloom
+
+        return bloom is None or id in bloom
+
+def get_revocation_filter():
+    global REVOCATION_FILTER
+
+    if REVOCATION_FILTER is None:
+        REVOCATION_FILTER = RevocationFilter(int(Parameters()["tokens.refresh"]), int(Parameters()["tokens.capacity"]))
+
+    return REVOCATION_FILTER
+
+def signing_enabled():
+    """Whether login issues signed tokens (see tokens.signed).
+
+    Raises ValueError if tokens.signed is set without tokens.secret.
+
+    """
+
+    if not boolean(Parameters()["tokens.signed"]):
+        return False
+
+    _signing_key()
+
+    return True
+
+def is_signed(token):
+    """Whether token is a signed token (rather than a keystore token)."""
+
+    return token is not None and "." in token
+
+def issue(username, lifetime = TOKEN_LIFETIME):
+    """Create a signed token for username that expires after lifetime."""
+
+    expiry = int(time.time() + lifetime.days * 86400 + lifetime.seconds)
+
+    payload = _encode(u"{0}:{1}:{2}".format(username, expiry, uuid.uuid4().hex).encode("utf-8"))
+
+    return payload + "." + _encode(_sign(payload))
+
+def _parse(token):
+    """The ( username, expiry, id ) of token if its signature is valid."""
+
+    try:
+        payload, signature = token.split(".")
+
+        if not _compare(_decode(signature), _sign(payload)):
+            return None
+
+        username, expiry, id = _decode(payload).decode("utf-8").rsplit(":", 2)
+
+        return username, int(expiry), id
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+def verify(token):
+    """The username token was issued to or None if it's invalid.
+
+    Invalid tokens are those that are malformed, have a bad signature, have
+    expired, or have been revoked.
+
+    """
+
+    parsed = _parse(token)
+
+    if parsed is None:
+        logger.info("Invalid token signature")
+
+        return None
+
+    username, expiry, id = parsed
+
+    if expiry <= time.time():
+        return None
+
+    if id in get_revocation_filter() and get_keyspace(REVOCATIONS).exists(id):
+        logger.info("Revoked token used: %s", id)
+
+        return None
+
+    return username
+
+def revoke(token):
+    """Revoke the signed token until it expires.
+
+    Returns
+    -------
+
+    True if the token was valid and has been revoked; otherwise, False.
+
+    """
+
+    parsed = _parse(token)
+
+    if parsed is None:
+        return False
+
+    _, expiry, id = parsed
+
+    remaining = int(expiry - time.time())
+
+    if remaining <= 0:
+        return False
+
+    with batch() as _:
+        _.keyspace(REVOCATIONS).setex(id, 1, remaining)
+        _.keyspace(REVOCATIONS).zadd(REVOCATION_INDEX, id, expiry)
+
+    get_revocation_filter().add(id)
+
+    return True
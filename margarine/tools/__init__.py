@@ -0,0 +1,25 @@
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Operational tools for margarine.
+
+Every module in this package is a stand-alone command that can be run with
+``python -m margarine.tools.<module>`` and accepts the same parameters
+(command line, configuration file, and environment) as the daemons.
+
+:startup:   Reports the import time of each module for blend, spread, and
+            tinge.
+:queries:   Reports the latency and query plan of the article queries against
+            a synthetic corpus.
+:bodies:    Reports the histogram of article body sizes (for choosing
+            inline.threshold).
+:documents: Reports the stored size of synthetic documents with the plain and
+            compact codecs (see datastore.codec).
+:submits:   Reports the submissions per second with each publisher confirm
+            mode (see queue.confirms).
+:serialization: Reports the encode and decode time and size of each message
+            type with each message codec (see messages.codec).
+
+"""
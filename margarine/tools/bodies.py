@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Body size histogram for choosing inline.threshold.
+
+Reads the size of every parsed article in the datastore (datastore.url) and
+reports, for each power of two size bucket:
+
+:below:   The bucket's upper bound (exclusive).
+:count:   The number of bodies in the bucket.
+:inline:  The percentage of bodies that would be stored inline with a
+          threshold of the bucket's upper bound.
+:bytes:   The total size of those inlined bodies (i.e. the growth of the
+          articles collection).
+
+::
+
+    python -m margarine.tools.bodies --datastore-url=mongodb://localhost/margarine
+
+.. note::
+    Articles parsed by earlier releases recorded the in-memory size of the
+    body rather than its encoded size; those sizes are overestimates.
+
+"""
+
+import logging
+import sys
+
+from margarine.parameters import Parameters
+from margarine.aggregates import get_collection
+
+logger = logging.getLogger(__name__)
+
+def histogram(sizes, smallest = 1024):
+    """Bucket sizes by powers of two.
+
+    Parameters
+    ----------
+
+    :sizes:    An iterable of body sizes in bytes.
+    :smallest: The upper bound of the first bucket.
+
+    Returns
+    -------
+
+    A list of ( upper bound, count, cumulative count, cumulative bytes ) with
+    a row for every bucket up to the largest size.
+
+    """
+
+    counts = {}
+    totals = {}
+
+    for size in sizes:
+        bound = smallest
+
+        while size >= bound:
+            bound *= 2
+
+        counts[bound] = counts.get(bound, 0) + 1
+        totals[bound] = totals.get(bound, 0) + size
+
+    rows = []
+
+    count = sum(counts.values())
+
+    bound, cumulative_count, cumulative_bytes = smallest, 0, 0
+
+    while cumulative_count < count:
+        cumulative_count += counts.get(bound, 0)
+        cumulative_bytes += totals.get(bound, 0)
+
+        rows.append(( bound, counts.get(bound, 0), cumulative_count, cumulative_bytes ))
+
+        bound *= 2
+
+    return rows
+
+def _human(size):
+    for unit in [ "B", "KiB", "MiB", "GiB" ]:
+        if size < 1024 or unit == "GiB":
+            return "{0:.0f}{1}".format(size, unit)
+
+        size /= 1024.0
+
+def main():
+    """Read the body sizes and print the histogram."""
+
+    Parameters().parse()
+
+    cursor = get_collection("articles").find({ "size": { "$exists": True } }, { "size": 1, "_id": 0 })
+
+    rows = histogram([ _["size"] for _ in cursor ])
+
+    total = rows[-1][2] if len(rows) else 0
+
+    sys.stdout.write("{0:>8}  {1:>10}  {2:>7}  {3:>8}\n".format("below", "count", "inline", "bytes"))
+
+    for bound, count, cumulative_count, cumulative_bytes in rows:
+        sys.stdout.write("{0:>8}  {1:>10}  {2:>6.1f}%  {3:>8}\n".format(_human(bound), count, 100.0 * cumulative_count / total, _human(cumulative_bytes)))
+
+    sys.stdout.write("\n{0} bodies\n".format(total))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Working set report for the plain and compact document codecs.
+
+Generates a synthetic corpus of articles and users (100,000 articles by
+default) and reports the total BSON size of the documents and of their _id
+index keys when stored plain and with the compact codec (see
+datastore.codec)::
+
+    python -m margarine.tools.documents
+
+With --documents-url the corpus is also loaded into a scratch MongoDB
+database (as COLLECTION_plain and COLLECTION_compact) with the declared
+indexes and the server's data and index sizes are reported.
+
+.. warning::
+    The scratch collections are dropped before the corpus is loaded; never
+    point this at a production database.
+
+"""
+
+import datetime
+import logging
+import random
+import sys
+import uuid
+
+from margarine.parameters import Parameters
+from margarine.aggregates import COMPACT_CODECS
+from margarine.aggregates import INDEXES
+from margarine.helpers import ConnectionSpec
+from margarine.objectstores import get_article_location
+
+logger = logging.getLogger(__name__)
+
+Parameters("documents", parameters = [
+    { # --documents-count=N; N ← 100000
+        "options": [ "--count" ],
+        "type": int,
+        "default": 100000,
+        "help": \
+                "The number of synthetic articles (and a tenth as many " \
+                "users); default: %(default)s.",
+        },
+    { # --documents-url=URL; URL ← None
+        "options": [ "--url" ],
+        "default": None,
+        "help": \
+                "A scratch MongoDB database to also load the corpus into " \
+                "and report the server's sizes from.",
+        },
+    ])
+
+TAGS = [ "tag-{0}".format(_) for _ in range(1000) ]
+
+EPOCH = datetime.datetime(2013, 1, 1)
+
+def _article(index):
+    url = "http://example.com/articles/{0}.html".format(index)
+
+    _id = uuid.uuid5(uuid.NAMESPACE_URL, url).hex
+
+    created_at = EPOCH + datetime.timedelta(seconds = index * 30)
+
+    container_name, object_name, layout = get_article_location(_id, 256)
+
+    return {
+            "_id": _id,
+            "url": url,
+            "tags": random.sample(TAGS, 3),
+            "votes": int(random.paretovariate(1.5)),
+            "created_at": created_at,
+            "parsed_at": created_at + datetime.timedelta(hours = random.randint(0, 720)),
+            "etag": uuid.uuid4().hex,
+            "size": random.randint(1000, 100000),
+            "encoding": "zlib",
+            "text_container_name": container_name,
+            "text_object_name": object_name,
+            "text_layout": layout,
+            }
+
+def _user(index):
+    return {
+            "username": "user-{0}".format(index),
+            "email": "user-{0}@example.com".format(index),
+            "name": "User {0}".format(index),
+            "hash": uuid.uuid4().hex,
+            }
+
+def corpus(count):
+    """The synthetic ( collection, documents ) pairs."""
+
+    return [
+            ( "articles", [ _article(_) for _ in range(count) ] ),
+            ( "users", [ _user(_) for _ in range(max(1, count // 10)) ] ),
+            ]
+
+def _bson_size(document):
+    import bson
+
+    return len(bson.BSON.encode(document))
+
+def measure(collection, documents):
+    """The ( document bytes, _id key bytes ) of documents plain and compact.
+
+    Returns
+    -------
+
+    A dict of codec name ( plain or compact ) to ( document bytes, _id bytes ).
+
+    """
+
+    from bson.objectid import ObjectId
+
+    codec = COMPACT_CODECS[collection]
+
+    sizes = { "plain": [ 0, 0 ], "compact": [ 0, 0 ] }
+
+    for document in documents:
+        document = dict(document)
+        document.setdefault("_id", ObjectId())
+
+        for name, stored in [ ( "plain", document ), ( "compact", codec.encode(document) ) ]:
+            sizes[name][0] += _bson_size(stored)
+            sizes[name][1] += _bson_size({ "_id": stored["_id"] })
+
+    return dict([ ( _[0], tuple(_[1]) ) for _ in sizes.items() ])
+
+def _load(database, collection, documents):
+    """Load documents plain and compact; return the collStats of each."""
+
+    from margarine.aggregates import CompactCollection
+
+    statistics = {}
+
+    for name in [ "plain", "compact" ]:
+        handle = database["{0}_{1}".format(collection, name)]
+        handle.drop()
+
+        if name == "compact":
+            handle = CompactCollection(handle, COMPACT_CODECS[collection])
+
+        for keys, options in INDEXES.get(collection, []):
+            handle.ensure_index(keys, **dict([ _ for _ in options.items() if _[0] not in ( "background", "drop_dups" ) ]))
+
+        handle.insert([ dict(_) for _ in documents ])
+
+        statistics[name] = database.command("collstats", "{0}_{1}".format(collection, name))
+
+    return statistics
+
+def _reduction(plain, compact):
+    return 100.0 * ( plain - compact ) / plain if plain else 0.0
+
+def main():
+    """Generate the corpus, measure it, and print the report."""
+
+    Parameters().parse()
+
+    count = int(Parameters()["documents.count"])
+
+    collections = corpus(count)
+
+    sys.stdout.write("{0:<10}  {1:<9}  {2:>14}  {3:>14}\n".format("collection", "", "documents", "_id keys"))
+
+    for collection, documents in collections:
+        sizes = measure(collection, documents)
+
+        for name in [ "plain", "compact" ]:
+            sys.stdout.write("{0:<10}  {1:<9}  {2:>13}B  {3:>13}B\n".format(collection, name, sizes[name][0], sizes[name][1]))
+
+        sys.stdout.write("{0:<10}  {1:<9}  {2:>13.1f}%  {3:>13.1f}%\n".format(collection, "reduction", _reduction(sizes["plain"][0], sizes["compact"][0]), _reduction(sizes["plain"][1], sizes["compact"][1])))
+
+    if Parameters()["documents.url"]:
+        import pymongo
+
+        spec = ConnectionSpec(Parameters()["documents.url"])
+
+        database = pymongo.MongoClient(spec.url)[spec.path.strip("/")]
+
+        sys.stdout.write("\n{0:<10}  {1:<9}  {2:>14}  {3:>14}\n".format("collection", "", "size", "indexes"))
+
+        for collection, documents in collections:
+            statistics = _load(database, collection, documents)
+
+            for name in [ "plain", "compact" ]:
+                sys.stdout.write("{0:<10}  {1:<9}  {2:>13}B  {3:>13}B\n".format(collection, name, statistics[name]["size"], statistics[name]["totalIndexSize"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Query plan report for the article queries margarine issues.
+
+Loads a synthetic corpus of articles (1,000,000 by default) into a scratch
+MongoDB database, applies the declared article indexes (see
+margarine.aggregates.register_index), runs each representative query several
+times and reports:
+
+:median:  The median latency of the query.
+:p95:     The 95th percentile latency of the query.
+:index:   The index used by the query plan (or COLLSCAN).
+:covered: Whether the query was answered from the index alone.
+
+The corpus is only loaded if the scratch collection doesn't already hold the
+requested number of articles so repeated runs are quick::
+
+    python -m margarine.tools.queries --queries-url=mongodb://localhost/margarine_benchmark
+
+.. warning::
+    The articles collection of the scratch database is dropped before the
+    corpus is loaded; never point this at a production database.
+
+"""
+
+import datetime
+import logging
+import random
+import sys
+import time
+import uuid
+
+from margarine.parameters import Parameters
+from margarine.aggregates import INDEXES
+from margarine.helpers import ConnectionSpec
+
+logger = logging.getLogger(__name__)
+
+Parameters("queries", parameters = [
+    { # --queries-url=URL; URL ← mongodb://localhost/margarine_benchmark
+        "options": [ "--url" ],
+        "default": "mongodb://localhost/margarine_benchmark",
+        "help": \
+                "The scratch MongoDB database to load the corpus into; " \
+                "default: %(default)s.",
+        },
+    { # --queries-count=N; N ← 1000000
+        "options": [ "--count" ],
+        "type": int,
+        "default": 1000000,
+        "help": "The number of synthetic articles; default: %(default)s.",
+        },
+    { # --queries-repeat=N; N ← 20
+        "options": [ "--repeat" ],
+        "type": int,
+        "default": 20,
+        "help": "The number of times to run each query; default: %(default)s.",
+        },
+    ])
+
+TAGS = [ "tag-{0}".format(_) for _ in range(1000) ]
+
+EPOCH = datetime.datetime(2013, 1, 1)
+
+def _article(index):
+    url = "http://example.com/articles/{0}.html".format(index)
+
+    created_at = EPOCH + datetime.timedelta(seconds = index * 30)
+
+    return {
+            "_id": uuid.uuid5(uuid.NAMESPACE_URL, url).hex,
+            "url": url,
+            "tags": random.sample(TAGS, 3),
+            "votes": int(random.paretovariate(1.5)),
+            "created_at": created_at,
+            "parsed_at": None if random.random() < 0.1 else created_at + datetime.timedelta(hours = random.randint(0, 720)),
+            "etag": uuid.uuid4().hex,
+            "size": random.randint(1000, 100000),
+            }
+
+def load(collection, count, batch = 1000):
+    """Replace the articles in collection with count synthetic articles."""
+
+    collection.drop()
+
+    for start in range(0, count, batch):
+        collection.insert([ _article(_) for _ in range(start, min(start + batch, count)) ], w = 0)
+
+        if start % 100000 == 0:
+            logger.info("Loaded %s articles", start)
+
+    collection.database.command("getLastError")
+
+def queries(count):
+    """The representative article queries as ( name, callable(collection) ).
+
+    Each callable returns a cursor for the query.
+
+    """
+
+    stale = EPOCH + datetime.timedelta(seconds = count * 15)
+
+    return [
+            ( "by url", lambda _: _.find({ "url": "http://example.com/articles/{0}.html".format(random.randrange(count)) }).limit(1) ),
+            ( "by tag, newest", lambda _: _.find({ "tags": random.choice(TAGS) }).sort("created_at", -1).limit(20) ),
+            ( "most votes", lambda _: _.find().sort([ ( "votes", -1 ), ( "created_at", -1 ) ]).limit(20) ),
+            ( "newest", lambda _: _.find().sort("created_at", -1).limit(20) ),
+            ( "stale ids", lambda _: _.find({ "parsed_at": { "$lt": stale } }, { "_id": 1, "parsed_at": 1 }).hint([ ( "parsed_at", 1 ), ( "_id", 1 ) ]).limit(100) ),
+            ]
+
+def _plan(explanation):
+    """The ( index, covered ) of an explain() result (any server version)."""
+
+    if "cursor" in explanation: # MongoDB < 3.0
+        index = explanation["cursor"].replace("BtreeCursor ", "") if explanation["cursor"].startswith("BtreeCursor") else "COLLSCAN"
+
+        return index, bool(explanation.get("indexOnly"))
+
+    stages = []
+    stage = explanation["queryPlanner"]["winningPlan"]
+
+    while stage is not None:
+        stages.append(stage)
+        stage = stage.get("inputStage")
+
+    index = [ _["indexName"] for _ in stages if "indexName" in _ ]
+
+    return index[0] if len(index) else "COLLSCAN", not any([ _["stage"] in ( "FETCH", "COLLSCAN" ) for _ in stages ])
+
+def _percentile(values, percentile):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+def main():
+    """Load the corpus (if necessary), run the queries, and print the report."""
+
+    import pymongo
+
+    Parameters().parse()
+
+    count = int(Parameters()["queries.count"])
+    repeat = int(Parameters()["queries.repeat"])
+
+    spec = ConnectionSpec(Parameters()["queries.url"])
+
+    collection = pymongo.MongoClient(spec.url)[spec.path.strip("/")]["articles"]
+
+    if collection.count() != count:
+        logger.info("Loading %s articles into %s", count, Parameters()["queries.url"])
+
+        load(collection, count)
+
+    for keys, options in INDEXES.get("articles", []):
+        collection.ensure_index(keys, **dict([ _ for _ in options.items() if _[0] != "background" ]))
+
+    sys.stdout.write("{0:<16}  {1:>10}  {2:>10}  {3:<7}  {4}\n".format("query", "median", "p95", "covered", "index"))
+
+    for name, query in queries(count):
+        latencies = []
+
+        for _ in range(repeat):
+            start = time.time()
+            list(query(collection))
+            latencies.append(time.time() - start)
+
+        index, covered = _plan(query(collection).explain())
+
+        sys.stdout.write("{0:<16}  {1:>8.2f}ms  {2:>8.2f}ms  {3:<7}  {4}\n".format(name, _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.95) * 1000, "yes" if covered else "no", index))
+
+if __name__ == "__main__":
+    main()
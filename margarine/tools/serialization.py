@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Encode and decode cost and size of queue messages with each codec.
+
+The message types are the binding keys of the queues declared by
+margarine.spread.users.register and margarine.spread.articles.register.  A
+representative payload of each type is encoded (in its envelope) and decoded
+with each registered codec (see margarine.messages) and the median time per
+encode and decode and the encoded size are reported::
+
+    python -m margarine.tools.serialization
+
+"""
+
+import logging
+import sys
+import time
+import uuid
+
+from margarine.parameters import Parameters
+from margarine.embeddedqueues import EmbeddedConnection
+from margarine.embeddedqueues import MemoryBroker
+from margarine.messages import CODECS
+from margarine.messages import decode
+from margarine.messages import encode
+from margarine.spread import articles
+from margarine.spread import users
+
+logger = logging.getLogger(__name__)
+
+Parameters("serialization", parameters = [
+    { # --serialization-repeat=N; N ← 10000
+        "options": [ "--repeat" ],
+        "type": int,
+        "default": 10000,
+        "help": \
+                "The number of encodes (and decodes) timed per sample; " \
+                "default: %(default)s.",
+        },
+    ])
+
+EXAMPLES = {
+        "users.create": { "username": "alunduil", "email": "alunduil@example.com", "name": "Alex Brandt" },
+        "users.update": { "username": "alunduil", "email": "alunduil@example.com", "name": "Alex Brandt", "original_username": "alunduil" },
+        "users.email": { "username": "alunduil" },
+        "users.password": { "username": "alunduil", "password": "correct horse battery staple" },
+        "articles.create": { "_id": uuid.uuid4().hex, "url": "http://blog.alunduil.com/posts/an-explanation-of-lvm-snapshots.html" },
+        "articles.update": { "_id": uuid.uuid4().hex },
+        }
+
+def message_types():
+    """The binding keys of the queues spread declares."""
+
+    broker = MemoryBroker()
+
+    channel = EmbeddedConnection(broker).channel()
+
+    users.register(channel)
+    articles.register(channel)
+
+    return sorted(set([ routing_key for bindings in broker.bindings.values() for queue, routing_key in bindings ]))
+
+class _Header(object):
+    def __init__(self, content_type):
+        self.content_type = content_type
+
+def _median(function, repeat):
+    """The median seconds per call of function over five samples."""
+
+    samples = []
+
+    for _ in range(5):
+        start = time.time()
+
+        for _ in range(repeat):
+            function()
+
+        samples.append(( time.time() - start ) / repeat)
+
+    return sorted(samples)[len(samples) // 2]
+
+def measure(message_type, payload, codec, repeat):
+    """The ( encode seconds, decode seconds, bytes ) of payload with codec."""
+
+    body, content_type = encode(message_type, payload, codec)
+
+    header = _Header(content_type)
+
+    return (
+            _median(lambda: encode(message_type, payload, codec), repeat),
+            _median(lambda: decode(body, header), repeat),
+            len(body),
+            )
+
+def main():
+    """Measure each message type with each codec and print the report."""
+
+    Parameters().parse()
+
+    repeat = int(Parameters()["serialization.repeat"])
+
+    sys.stdout.write("{0:<16}  {1:<6}  {2:>10}  {3:>10}  {4:>6}\n".format("message", "codec", "encode", "decode", "size"))
+
+    for message_type in message_types():
+        payload = EXAMPLES.get(message_type, {})
+
+        for codec in sorted(CODECS.keys()):
+            encoding, decoding, size = measure(message_type, payload, codec, repeat)
+
+            sys.stdout.write("{0:<16}  {1:<6}  {2:>8.2f}µs  {3:>8.2f}µs  {4:>5}B\n".format(message_type, codec, encoding * 1e6, decoding * 1e6, size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Import time report for the margarine entry points.
+
+Each entry point (the module behind bin/blend, bin/spread, and bin/tinge) is
+imported in a fresh interpreter with ``__import__`` instrumented.  The report
+lists the total time to import the entry point and the modules that took the
+longest to import:
+
+:inclusive: Time spent importing the module including its imports.
+:exclusive: Time spent importing the module minus its imports.
+
+If a budget is given, the command exits with a non-zero status when any entry
+point takes longer than the budget to import, which makes it suitable for a CI
+check::
+
+    python -m margarine.tools.startup --startup-budget=1.5
+
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+from margarine.parameters import Parameters
+
+logger = logging.getLogger(__name__)
+
+Parameters("startup", parameters = [
+    { # --startup-budget=SECONDS; SECONDS ← 0
+        "options": [ "--budget" ],
+        "type": float,
+        "default": 0.0,
+        "help": \
+                "The maximum number of seconds an entry point may take to " \
+                "import.  If any entry point exceeds this, %(prog)s exits " \
+                "with a non-zero status.  A value of zero (the default) " \
+                "disables the check.",
+        },
+    { # --startup-top=N; N ← 15
+        "options": [ "--top" ],
+        "type": int,
+        "default": 15,
+        "help": \
+                "The number of modules to report for each entry point; " \
+                "default: %(default)s.",
+        },
+    ])
+
+ENTRY_POINTS = [
+        "margarine.blend",
+        "margarine.spread",
+        "margarine.tinge",
+        ]
+
+# Runs in the child interpreter; must not import anything from margarine
+# before the entry point itself is imported.
+PROFILER = r'''
+import json
+import sys
+import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+_import = builtins.__import__
+
+timings = {}
+children = [ 0.0 ]
+
+def _timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return _import(name, *args, **kwargs)
+
+    children.append(0.0)
+    start = time.time()
+
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        nested = children.pop()
+        children[-1] += elapsed
+
+        # Implicit relative imports are recorded by their absolute names.
+        caller = args[0] if len(args) and args[0] else {}
+        package = caller.get("__package__") or caller.get("__name__", "").rpartition(".")[0]
+
+        if package and sys.modules.get(package + "." + name) is not None or not name:
+            name = ".".join([ _ for _ in (package, name) if _ ])
+
+        inclusive, exclusive = timings.get(name, (0.0, 0.0))
+        timings[name] = (inclusive + elapsed, exclusive + elapsed - nested)
+
+builtins.__import__ = _timed_import
+
+start = time.time()
+_timed_import(sys.argv[1])
+total = time.time() - start
+
+builtins.__import__ = _import
+
+with open(sys.argv[2], "w") as fh:
+    json.dump({ "total": total, "modules": timings }, fh)
+'''
+
+def profile(entry_point):
+    """Import entry_point in a new interpreter and time every import.
+
+    Parameters
+    ----------
+
+    :entry_point: The dotted name of the module to import.
+
+    Returns
+    -------
+
+    A tuple of the total import time and a dict mapping each newly imported
+    module to its (inclusive, exclusive) import times in seconds.
+
+    """
+
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([ os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) ] + [ _ for _ in [ environment.get("PYTHONPATH") ] if _ ])
+
+    with tempfile.NamedTemporaryFile(suffix = ".json") as fh:
+        subprocess.check_call([ sys.executable, "-c", PROFILER, entry_point, fh.name ], env = environment)
+
+        with open(fh.name) as results:
+            results = json.load(results)
+
+    return results["total"], dict([ (module, tuple(times)) for module, times in results["modules"].items() ])
+
+def main():
+    """Profile every entry point and print the report.
+
+    Exits with status 1 if any entry point exceeds Parameters[startup.budget].
+
+    """
+
+    Parameters().parse()
+
+    budget = float(Parameters()["startup.budget"])
+    top = int(Parameters()["startup.top"])
+
+    exceeded = []
+
+    for entry_point in ENTRY_POINTS:
+        total, modules = profile(entry_point)
+
+        sys.stdout.write("{0}: {1:.3f}s\n".format(entry_point, total))
+        sys.stdout.write("  {0:>10}  {1:>10}  {2}\n".format("inclusive", "exclusive", "module"))
+
+        for module, (inclusive, exclusive) in sorted(modules.items(), key = lambda _: _[1][1], reverse = True)[:top]:
+            sys.stdout.write("  {0:>9.3f}s  {1:>9.3f}s  {2}\n".format(inclusive, exclusive, module))
+
+        sys.stdout.write("\n")
+
+        if budget and total > budget:
+            exceeded.append(entry_point)
+
+    if len(exceeded):
+        logger.error("Import budget of %ss exceeded by %s", budget, ", ".join(exceeded))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -59,6 +59,7 @@ PARAMS["requires"] = [
 
 PARAMS["scripts"] = [
         "bin/blend",
+        "bin/margarine-migrate",
         "bin/spread",
         "bin/tinge",
         ]
@@ -68,6 +69,7 @@ PARAMS["packages"] = [
         "margarine.blend",
         "margarine.spread",
         "margarine.tinge",
+        "margarine.tools",
         ]
 
 PARAMS["package_data"] = {
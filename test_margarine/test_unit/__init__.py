@@ -96,6 +96,9 @@ class BaseMargarineTest(unittest.TestCase):
         if 'channel' in to_mock:
             self.mock_channel = self._get_attached_mock(self._get_patch_mock('get_channel'))
 
+        if 'publish' in to_mock:
+            self.mock_publish = self._get_patch_mock('publish')
+
         # TODO Update to datastores
         if 'collection' in to_mock:
             self.mock_collection = self._get_attached_mock(self._get_patch_mock('get_collection'))
@@ -2,3 +2,102 @@
 #
 # margarine is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import datetime
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+import uuid
+
+from margarine.aggregates import ASCENDING
+from margarine.aggregates import COMPACT_CODECS
+from margarine.aggregates import CompactCollection
+from margarine.aggregates import ensure_indexes
+from margarine.aggregates import get_collection
+from margarine.aggregates import _multikey_fields
+from margarine.sqlitestore import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+class GetCollectionTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("margarine.aggregates.get_database")
+        self.addCleanup(patcher.stop)
+        self.mock_database = patcher.start()
+
+        patcher = mock.patch("margarine.aggregates.DATASTORE_COLLECTIONS", {})
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_collection_cached(self):
+        self.assertIs(get_collection("users"), get_collection("users"))
+
+        self.assertEqual(1, self.mock_database.call_count)
+
+class EnsureIndexesTest(unittest.TestCase):
+    def test_declared_indexes_applied(self):
+        database = mock.MagicMock()
+
+        with mock.patch.dict("margarine.aggregates.INDEXES", { "users": [ ( [ ( "username", ASCENDING ) ], { "unique": True } ) ] }, clear = True):
+            ensure_indexes(database)
+
+        database["users"].ensure_index.assert_called_once_with([ ( "username", ASCENDING ) ], unique = True)
+
+class MultikeyFieldsTest(unittest.TestCase):
+    def test_declared(self):
+        self.assertEqual([ "tags" ], _multikey_fields()["articles"])
+
+    def test_compact(self):
+        self.assertEqual([ "t" ], _multikey_fields(compact = True)["articles"])
+
+class CompactCollectionTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.stored = SQLiteDatabase(os.path.join(directory, "margarine.sqlite"), multikey = _multikey_fields(compact = True))["articles"]
+        self.articles = CompactCollection(self.stored, COMPACT_CODECS["articles"])
+
+        self.article = {
+                "_id": "44d85795248d5899b8caac2bd8233755",
+                "url": "http://blog.alunduil.com/posts/an-explanation-of-lvm-snapshots.html",
+                "tags": [ "lvm" ],
+                "created_at": datetime.datetime(2013, 8, 4, 14, 16, 20),
+                "text_container_name": "margarine-256-55",
+                "text_object_name": "44d85795248d5899b8caac2bd8233755",
+                "text_layout": "hashed-256",
+                }
+
+    def test_stored_compactly(self):
+        self.articles.insert(dict(self.article))
+
+        stored = self.stored.find_one()
+
+        self.assertEqual(set([ "_id", "u", "t", "c", "l" ]), set(stored.keys()))
+        self.assertEqual(uuid.UUID(self.article["_id"]), stored["_id"])
+
+    def test_logical_round_trip(self):
+        self.articles.insert(dict(self.article))
+
+        self.assertEqual(self.article, self.articles.find_one({ "_id": self.article["_id"] }))
+        self.assertEqual([ self.article["_id"] ], [ _["_id"] for _ in self.articles.find({ "tags": "lvm" }).sort("created_at", -1) ])
+
+    def test_underived_names_kept(self):
+        self.article["text_object_name"] = "other"
+
+        self.articles.insert(dict(self.article))
+
+        self.assertEqual("other", self.stored.find_one()["text_object_name"])
+        self.assertEqual("other", self.articles.find_one()["text_object_name"])
+
+    def test_update(self):
+        self.articles.update({ "_id": self.article["_id"] }, { "$set": { "url": self.article["url"], "text_layout": "uuid", "text_container_name": "margarine-44d85795", "text_object_name": "248d-5899-b8ca-ac2bd8233755" } }, upsert = True)
+
+        self.assertEqual(set([ "_id", "u", "l" ]), set(self.stored.find_one().keys()))
+
+        article = self.articles.find_one({ "text_container_name": "margarine-44d85795" }, { "text_container_name": 1 })
+
+        self.assertEqual("margarine-44d85795", article["text_container_name"])
@@ -6,12 +6,16 @@
 import logging
 
 from test_margarine.test_unit import BaseMargarineTest
+from test_margarine.test_unit import MARGARINE_MOCKS
 
 from margarine.blend import BLEND
 
 logger = logging.getLogger(__name__)
 
 class BaseBlendTest(BaseMargarineTest):
+    # Blend publishes with publish rather than on a channel.
+    mocks = MARGARINE_MOCKS - set(['channel']) | set(['publish'])
+
     def setUp(self):
         super(BaseBlendTest, self).setUp()
 
@@ -33,6 +33,16 @@ class BaseBlendArticleTest(BaseBlendTest):
 
         self.base_url = '/{i.API_VERSION}/articles/'.format(i = information)
 
+        self.notations = []
+
+        for target, value in [
+                ( 'margarine.blend.article.count_notations', mock.MagicMock(side_effect = lambda _: len(self.notations)) ),
+                ( 'margarine.blend.article.get_notations', mock.MagicMock(side_effect = lambda *args, **kwargs: ( list(self.notations), None )) ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
 class BlendArticleCreateTest(BaseBlendArticleTest):
     def test_article_create(self):
         '''Blend::Article Create'''
@@ -42,22 +52,32 @@ class BlendArticleCreateTest(BaseBlendArticleTest):
                 'url': url,
                 })
 
-            self.mock_channel.basic_publish.assert_called_once_with(
-                    body = '{"url": "' + url + '", "_id": "' + uuid.hex + '"}',
-                    exchange = 'margarine.articles.topic',
-                    properties = mock.ANY,
-                    routing_key = 'articles.create'
-                    )
+            self.mock_publish.assert_called_once_with('margarine.articles.topic', 'articles.create', { 'url': url, '_id': uuid.hex })
 
-            self.mock_channel.reset_mock()
+            self.mock_publish.reset_mock()
 
             self.assertIn('202', response.status)
 
             self.assertIn(self.base_url + str(uuid), response.headers.get('Location'))
 
+    def test_article_create_unconfirmed(self):
+        '''Blend::Article Create—Unconfirmed'''
+
+        from margarine.communication import UnconfirmedError
+
+        self.mock_publish.side_effect = UnconfirmedError()
+
+        for uuid, url in self.articles.iteritems():
+            response = self.application.post(self.base_url, data = {
+                'url': url,
+                })
+
+            self.assertIn('503', response.status)
+            self.assertIsNotNone(response.headers.get('Retry-After'))
+
 class BlendArticleReadTest(BaseBlendArticleTest):
     # TODO Make this simpler.
-    mock_mask = BaseBlendArticleTest.mock_mask | set(['channel'])
+    mock_mask = BaseBlendArticleTest.mock_mask | set(['publish'])
 
     def test_article_read_unsubmitted(self):
         '''Blend::Article Read—Unsubmitted
@@ -124,15 +144,15 @@ class BlendArticleReadTest(BaseBlendArticleTest):
                     'text_object_name': '248d-5899-b8ca-ac2bd8233755',
                     }
 
-            mock_object = self._get_attached_mock(self.mock_container.get_object)
-            mock_object.fetch.return_value = 'Redacted for testing purposes'
+            self.mock_container.fetch_object.return_value = 'Redacted for testing purposes'
 
             response = self.application.get(self.base_url + str(uuid))
 
             self.mock_collection.find_one.assert_called_once_with({ '_id': uuid.hex })
             self.mock_collection.reset_mock()
 
-            mock_object.fetch.assert_called_once_with()
+            self.mock_container.fetch_object.assert_called_once_with('248d-5899-b8ca-ac2bd8233755')
+            self.mock_container.reset_mock()
 
             self.assertIn('200', response.status)
 
@@ -140,11 +160,172 @@ class BlendArticleReadTest(BaseBlendArticleTest):
             # TODO Verify configured domain.
             self.assertEqual('http://margarine.raxsavvy.com', response.headers.get('Access-Control-Allow-Origin'))
 
+    def test_article_read_submitted_complete_html(self):
+        '''Blend::Article Read—Submitted,Complete,HTML'''
+
+        from margarine.objectstores import ObjectReader
+
+        for uuid, url in self.articles.iteritems():
+            self.mock_collection.find_one.return_value = {
+                    '_id': uuid.hex,
+                    'url': url,
+                    'etag': 'bf6285d832a356e1bf509a63edc8870f',
+                    'text_container_name': '44d85795',
+                    'text_object_name': '248d-5899-b8ca-ac2bd8233755',
+                    }
+
+            self.mock_container.open_object.return_value = ObjectReader('Redacted for testing purposes')
+
+            response = self.application.get(self.base_url + str(uuid), headers = { 'Accept': 'text/html' })
+
+            self.mock_container.open_object.assert_called_once_with('248d-5899-b8ca-ac2bd8233755')
+            self.mock_container.reset_mock()
+
+            self.assertIn('200', response.status)
+
+            self.assertEqual('Redacted for testing purposes', response.data)
+            self.assertEqual('29', response.headers.get('Content-Length'))
+            self.assertTrue(response.headers.get('Content-Type').startswith('text/html'))
+
+    def test_article_read_submitted_complete_inline(self):
+        '''Blend::Article Read—Submitted,Complete,Inline'''
+
+        for uuid, url in self.articles.iteritems():
+            self.mock_collection.find_one.return_value = {
+                    '_id': uuid.hex,
+                    'url': url,
+                    'etag': 'bf6285d832a356e1bf509a63edc8870f',
+                    'text': 'Redacted for testing purposes',
+                    }
+
+            response = self.application.get(self.base_url + str(uuid))
+
+            self.assertFalse(self.mock_container.fetch_object.called)
+
+            self.assertIn('200', response.status)
+            self.assertIn('"body": "Redacted for testing purposes"', response.data)
+            self.assertNotIn('"text"', response.data)
+
+    def test_article_read_submitted_complete_compressed(self):
+        '''Blend::Article Read—Submitted,Complete,Compressed'''
+
+        import zlib
+
+        from margarine.objectstores import ObjectReader
+
+        for uuid, url in self.articles.iteritems():
+            article = {
+                    '_id': uuid.hex,
+                    'url': url,
+                    'etag': 'bf6285d832a356e1bf509a63edc8870f',
+                    'encoding': 'zlib',
+                    'text_container_name': '44d85795',
+                    'text_object_name': '248d-5899-b8ca-ac2bd8233755',
+                    }
+
+            self.mock_collection.find_one.side_effect = lambda *args: dict(article)
+
+            self.mock_container.open_object.return_value = ObjectReader(zlib.compress('Redacted for testing purposes'))
+            self.mock_container.fetch_object.return_value = zlib.compress('Redacted for testing purposes')
+
+            response = self.application.get(self.base_url + str(uuid), headers = { 'Accept': 'text/html', 'Accept-Encoding': 'gzip, deflate' })
+
+            self.assertEqual('deflate', response.headers.get('Content-Encoding'))
+            self.assertEqual('Redacted for testing purposes', zlib.decompress(response.data))
+            self.assertFalse(self.mock_container.fetch_object.called)
+
+            response = self.application.get(self.base_url + str(uuid), headers = { 'Accept': 'text/html', 'Accept-Encoding': 'gzip' })
+
+            self.assertIsNone(response.headers.get('Content-Encoding'))
+            self.assertEqual('Redacted for testing purposes', response.data)
+            self.assertIn('Accept-Encoding', response.headers.get('Vary'))
+
+            response = self.application.get(self.base_url + str(uuid))
+
+            self.assertIn('"body": "Redacted for testing purposes"', response.data)
+
+            self.mock_container.reset_mock()
+
+class BlendArticleNotationsTest(BaseBlendArticleTest):
+    # TODO Make this simpler.
+    mock_mask = BaseBlendArticleTest.mock_mask | set(['publish'])
+
+    def test_article_read_notation_count(self):
+        '''Blend::Article Read—Notation Count'''
+
+        from margarine.blend import article
+
+        self.notations = [ { 'location': 12, 'note': 'LVM' } ]
+
+        for uuid, url in self.articles.iteritems():
+            self.mock_collection.find_one.return_value = {
+                    '_id': uuid.hex,
+                    'url': url,
+                    'etag': 'bf6285d832a356e1bf509a63edc8870f',
+                    'text': 'Redacted for testing purposes',
+                    }
+
+            response = self.application.get(self.base_url + str(uuid))
+
+            self.assertIn('"notation_count": 1', response.data)
+            self.assertIn('"note": "LVM"', response.data)
+
+        self.assertFalse(article.count_notations.called)
+
+    def test_article_read_notation_count_full_page(self):
+        '''Blend::Article Read—Notation Count (Full Page)'''
+
+        from margarine.blend import article
+
+        self.notations = [ { 'location': _, 'note': 'LVM' } for _ in range(25) ]
+
+        article.get_notations.side_effect = lambda *args, **kwargs: ( list(self.notations[:20]), 19 )
+
+        for uuid, url in self.articles.iteritems():
+            self.mock_collection.find_one.return_value = {
+                    '_id': uuid.hex,
+                    'url': url,
+                    'etag': 'bf6285d832a356e1bf509a63edc8870f',
+                    'text': 'Redacted for testing purposes',
+                    }
+
+            response = self.application.get(self.base_url + str(uuid))
+
+            self.assertIn('"notation_count": 25', response.data)
+
+            article.count_notations.assert_called_with(uuid.hex)
+
+    def test_article_notations_page(self):
+        '''Blend::Article Notations—Page'''
+
+        from margarine.blend import article
+
+        self.notations = [ { 'location': 12, 'note': 'LVM' } ]
+
+        article.get_notations.side_effect = lambda *args, **kwargs: ( list(self.notations), 12 )
+
+        for uuid, url in self.articles.iteritems():
+            response = self.application.get(self.base_url + str(uuid) + '/notations?after=3&limit=500')
+
+            article.get_notations.assert_called_with(uuid.hex, after = 3, limit = 100)
+
+            self.assertIn('200', response.status)
+            self.assertIn('"note": "LVM"', response.data)
+            self.assertIn('after=12', response.data)
+
+    def test_article_notations_bad_after(self):
+        '''Blend::Article Notations—Bad after'''
+
+        for uuid, url in self.articles.iteritems():
+            response = self.application.get(self.base_url + str(uuid) + '/notations?after={')
+
+            self.assertIn('400', response.status)
+
 class BlendArticleUpdateTest(BaseBlendArticleTest):
     # TODO Make this simpler.
     mock_mask = BaseBlendArticleTest.mock_mask | set([
         'collection',
-        'channel',
+        'publish',
         ])
 
     def test_article_update(self):
@@ -159,7 +340,7 @@ class BlendArticleDeleteTest(BaseBlendArticleTest):
     # TODO Make this simpler.
     mock_mask = BaseBlendArticleTest.mock_mask | set([
         'collection',
-        'channel',
+        'publish',
         ])
 
     def test_article_delete(self):
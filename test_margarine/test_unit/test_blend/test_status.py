@@ -0,0 +1,56 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import logging
+import mock
+
+from test_margarine.test_unit.test_blend import BaseBlendTest
+
+from margarine.blend import information
+
+logger = logging.getLogger(__name__)
+
+class BlendStatusKeystoreTest(BaseBlendTest):
+    mock_mask = BaseBlendTest.mocks
+
+    def setUp(self):
+        super(BlendStatusKeystoreTest, self).setUp()
+
+        patcher = mock.patch("margarine.blend.status.get_keystore_status")
+        self.addCleanup(patcher.stop)
+        self.mock_status = patcher.start()
+
+        self.url = '/{i.API_VERSION}/status/keystore'.format(i = information)
+
+    def test_keystore_healthy(self):
+        '''Blend::Status Keystore—Healthy'''
+
+        self.mock_status.return_value = [ { "shard": "redis://localhost:6379/0", "healthy": True, "pool": { "connections": 1, "idle": 1, "max_connections": 50 } } ]
+
+        with mock.patch("margarine.blend.status.logger") as mock_logger:
+            response = self.application.get(self.url)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([ { "shard": 0, "healthy": True } ], json.loads(response.data))
+
+        mock_logger.info.assert_called_once_with(mock.ANY, 0, "redis://localhost:6379/0", True, { "connections": 1, "idle": 1, "max_connections": 50 })
+
+    def test_keystore_unhealthy(self):
+        '''Blend::Status Keystore—Unhealthy'''
+
+        self.mock_status.return_value = [
+                { "shard": "redis://first:6379/0", "healthy": True },
+                { "shard": "redis://second:6379/0", "healthy": False, "error": "Connection refused" },
+                ]
+
+        response = self.application.get(self.url)
+
+        self.assertEqual(503, response.status_code)
+        self.assertEqual([ { "shard": 0, "healthy": True }, { "shard": 1, "healthy": False } ], json.loads(response.data))
+        self.assertNotIn("second", response.data)
+        self.assertNotIn("Connection refused", response.data)
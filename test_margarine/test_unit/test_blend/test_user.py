@@ -5,11 +5,8 @@
 # margarine is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
-import mock
-
 import logging
 import bson
-import json
 
 from test_margarine.test_unit.test_blend import BaseBlendTest
 
@@ -60,16 +57,9 @@ class BlendUserCreateTest(BaseBlendUserTest):
             response = self.application.put(self.base_url + account, data = properties)
 
             properties.update({ 'username': account })
-            message = json.dumps(properties)
-
-            self.mock_channel.basic_publish.assert_called_once_with(
-                    body = message,
-                    exchange = 'margarine.users.topic',
-                    properties = mock.ANY,
-                    routing_key = 'users.create',
-                    )
+            self.mock_publish.assert_called_once_with('margarine.users.topic', 'users.create', properties)
 
-            self.mock_channel.reset_mock()
+            self.mock_publish.reset_mock()
 
             self.assertIn('202', response.status)
 
@@ -170,16 +160,9 @@ class BlendUserUpdateTest(BaseBlendUserTest):
             # TODO Only pass modifications and merge on back-end.
             properties.update({ 'username': account })
             properties['requested_username'] = modifications[account].pop('username', account)
-            message = json.dumps(properties)
-
-            self.mock_channel.basic_publish.assert_called_once_with(
-                    body = message,
-                    exchange = 'margarine.users.topic',
-                    properties = mock.ANY,
-                    routing_key = 'users.update',
-                    )
+            self.mock_publish.assert_called_once_with('margarine.users.topic', 'users.update', properties)
 
-            self.mock_channel.reset_mock()
+            self.mock_publish.reset_mock()
 
             self.assertIn('202', response.status)
 
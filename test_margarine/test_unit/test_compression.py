@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import mock
+import unittest
+import logging
+
+from margarine.compression import CODECS
+from margarine.compression import compress
+from margarine.compression import content_coding
+from margarine.compression import decompress
+from margarine.compression import get_codec
+
+logger = logging.getLogger(__name__)
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("margarine.compression.Parameters", return_value = { "compression.level": "6" })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.data = b"Redacted for testing purposes" * 100
+
+    def test_uncompressed(self):
+        self.assertEqual(self.data, compress(None, self.data))
+        self.assertEqual(self.data, decompress(None, self.data))
+        self.assertIsNone(content_coding(None))
+
+    def test_zlib(self):
+        compressed = compress("zlib", self.data)
+
+        self.assertLess(len(compressed), len(self.data))
+        self.assertEqual(self.data, decompress("zlib", compressed))
+        self.assertEqual("deflate", content_coding("zlib"))
+
+    def test_lzma(self):
+        if "lzma" not in CODECS:
+            raise unittest.SkipTest("lzma is not available")
+
+        compressed = compress("lzma", self.data)
+
+        self.assertLess(len(compressed), len(self.data))
+        self.assertEqual(self.data, decompress("lzma", compressed))
+        self.assertEqual("xz", content_coding("lzma"))
+
+class GetCodecTest(unittest.TestCase):
+    def test_codec(self):
+        for codec, expected in [ ( "none", None ), ( "zlib", "zlib" ) ]:
+            with mock.patch("margarine.compression.Parameters", return_value = { "compression.codec": codec }):
+                self.assertEqual(expected, get_codec())
+
+    def test_unavailable(self):
+        with mock.patch.dict("margarine.compression.CODECS", clear = True):
+            with mock.patch("margarine.compression.Parameters", return_value = { "compression.codec": "lzma" }):
+                self.assertRaises(ValueError, get_codec)
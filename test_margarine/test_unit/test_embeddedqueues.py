@@ -0,0 +1,303 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import logging
+
+from margarine import communication
+from margarine import spread
+from margarine.embeddedqueues import EmbeddedConnection
+from margarine.embeddedqueues import MemoryBroker
+from margarine.embeddedqueues import Properties
+from margarine.embeddedqueues import SQLiteBroker
+from margarine.embeddedqueues import connect
+from margarine.helpers import ConnectionSpec
+from margarine.embeddedqueues import matches
+from margarine.messages import decode
+from margarine.spread import articles
+from margarine.spread import users
+
+logger = logging.getLogger(__name__)
+
+class MatchesTest(unittest.TestCase):
+    def test_topic(self):
+        self.assertTrue(matches("topic", "articles.create", "articles.create"))
+        self.assertFalse(matches("topic", "articles.create", "articles.update"))
+        self.assertTrue(matches("topic", "articles.*", "articles.update"))
+        self.assertFalse(matches("topic", "articles.*", "articles"))
+        self.assertTrue(matches("topic", "articles.#", "articles"))
+        self.assertTrue(matches("topic", "#.create", "users.email.create"))
+
+    def test_fanout_direct(self):
+        self.assertTrue(matches("fanout", "articles.update", "articles.create"))
+        self.assertFalse(matches("direct", "articles.update", "articles.create"))
+
+class BaseEmbeddedQueueTest(object):
+    def setUp(self):
+        self.channel = EmbeddedConnection(self.broker).channel()
+
+        users.register(self.channel)
+        articles.register(self.channel)
+
+    def _consume(self, queue, count = 1):
+        """Consume count messages from queue (acking them)."""
+
+        bodies = []
+
+        def consumer(channel, method, header, body):
+            bodies.append(body)
+
+            channel.basic_ack(delivery_tag = method.delivery_tag)
+
+            if len(bodies) == count:
+                channel.stop_consuming()
+
+        channel = EmbeddedConnection(self.broker).channel()
+        channel.basic_consume(consumer, queue = queue)
+        channel.start_consuming()
+
+        return bodies
+
+    def test_spread_topology(self):
+        self.channel.basic_publish(exchange = "margarine.articles.topic", routing_key = "articles.create", body = '{"_id": "a"}')
+        self.channel.basic_publish(exchange = "margarine.articles.create", routing_key = "articles.create", body = '{"_id": "b"}')
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.email", body = '{"username": "c"}')
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.unknown", body = '{}')
+
+        self.assertEqual([ '{"_id": "a"}' ], self._consume("margarine.articles.create"))
+        self.assertEqual([ '{"_id": "b"}' ], self._consume("margarine.articles.references"))
+        self.assertEqual([ '{"_id": "b"}' ], self._consume("margarine.articles.sanitization"))
+        self.assertEqual([ '{"username": "c"}' ], self._consume("margarine.users.email"))
+
+        self.assertIsNone(self.broker.get([ "margarine.users.create", "margarine.users.update", "margarine.users.password" ]))
+
+    def test_reject_requeues(self):
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.email", body = '{}')
+
+        delivery = self.broker.get([ "margarine.users.email" ])
+
+        self.assertFalse(delivery.redelivered)
+
+        self.channel.basic_reject(delivery_tag = delivery.tag)
+
+        delivery = self.broker.get([ "margarine.users.email" ])
+
+        self.assertTrue(delivery.redelivered)
+
+        self.channel.basic_ack(delivery_tag = delivery.tag)
+
+        self.assertIsNone(self.broker.get([ "margarine.users.email" ]))
+
+    def test_batch_confirmed_publish(self):
+        parameters = {
+                "queue.url": "memory://",
+                "queue.publishers": 8,
+                "queue.confirms": "batch",
+                "queue.deadline": 5,
+                }
+
+        for target, value in [
+                ( "margarine.communication._connect", lambda: EmbeddedConnection(self.broker) ),
+                ( "margarine.communication.PUBLISHERS", [] ),
+                ( "margarine.communication.Parameters", mock.MagicMock(return_value = parameters) ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        communication.publish("margarine.users.topic", "users.password", { "username": "alunduil" })
+
+        self.assertEqual([ { "username": "alunduil" } ], [ decode(_) for _ in self._consume("margarine.users.password") ])
+
+class MemoryBrokerTest(BaseEmbeddedQueueTest, unittest.TestCase):
+    def setUp(self):
+        self.broker = MemoryBroker()
+
+        super(MemoryBrokerTest, self).setUp()
+
+    def test_publish_unserialized(self):
+        parameters = {
+                "queue.url": "memory://",
+                "queue.publishers": 8,
+                "queue.confirms": "none",
+                "queue.deadline": 5,
+                }
+
+        for target, value in [
+                ( "margarine.communication._connect", lambda: EmbeddedConnection(self.broker) ),
+                ( "margarine.communication.PUBLISHERS", [] ),
+                ( "margarine.communication.Parameters", mock.MagicMock(return_value = parameters) ),
+                ( "margarine.communication.get_connection_spec", mock.MagicMock(return_value = ConnectionSpec("memory://")) ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        payload = { "username": "alunduil" }
+
+        communication.publish("margarine.users.topic", "users.password", payload)
+
+        delivery = self.broker.get([ "margarine.users.password" ])
+
+        self.assertIs(payload, delivery.body["payload"])
+        self.assertEqual(payload, decode(delivery.body, Properties(delivery.content_type)))
+
+    def test_consumer_woken(self):
+        bodies = []
+
+        thread = threading.Thread(target = lambda: bodies.extend(self._consume("margarine.users.create")))
+        thread.start()
+
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.create", body = '{}')
+
+        thread.join(5)
+
+        self.assertEqual([ '{}' ], bodies)
+
+    def test_abandoned_requeued(self):
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.email", body = '{"username": "a"}')
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.email", body = '{"username": "b"}')
+
+        delivery = self.broker.get([ "margarine.users.email" ])
+
+        self.assertFalse(delivery.redelivered)
+
+        self.broker.abandon(delivery.tag)
+
+        self.assertEqual('{"username": "b"}', self.broker.get([ "margarine.users.email" ]).body)
+
+        delivery = self.broker.get([ "margarine.users.email" ])
+
+        self.assertEqual('{"username": "a"}', delivery.body)
+        self.assertTrue(delivery.redelivered)
+
+    def test_abandoned_dropped(self):
+        self.broker.max_deliveries = 2
+
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.email", body = '{}')
+
+        for _ in range(2):
+            self.broker.abandon(self.broker.get([ "margarine.users.email" ]).tag)
+
+        self.assertIsNone(self.broker.get([ "margarine.users.email" ]))
+
+class ConnectTest(unittest.TestCase):
+    def setUp(self):
+        self.started = threading.Event()
+
+        for target, value in [
+                ( "margarine.embeddedqueues.BROKERS", {} ),
+                ( "margarine.spread.run", self.started.set ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def test_memory_consumers_started(self):
+
+        broker = connect(ConnectionSpec("memory://")).broker
+
+        self.assertTrue(self.started.wait(5))
+        self.started.clear()
+
+        self.assertIs(broker, connect(ConnectionSpec("memory://")).broker)
+        self.assertFalse(self.started.wait(0.1))
+
+    def test_memory_topology_declared(self):
+
+        connect(ConnectionSpec("memory://")).channel().basic_publish(exchange = "margarine.users.topic", routing_key = "users.create", body = '{}')
+
+        self.assertEqual('{}', connect(ConnectionSpec("memory://")).broker.get([ "margarine.users.create" ]).body)
+
+class RunTest(unittest.TestCase):
+    def test_consume_failed(self):
+
+        class Stop(BaseException):
+            pass
+
+        consume = mock.MagicMock(side_effect = [ ValueError("failed"), None, Stop() ])
+
+        for target, value in [
+                ( "margarine.spread.consume", consume ),
+                ( "margarine.spread.time", mock.MagicMock() ),
+                ( "margarine.spread.Parameters", mock.MagicMock(return_value = { "queue.wait": 5 }) ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        self.assertRaises(Stop, spread.run)
+
+        self.assertEqual(3, consume.call_count)
+        spread.time.sleep.assert_called_once_with(5)
+
+    def test_memory_refused(self):
+        for target, value in [
+                ( "margarine.spread.Parameters", mock.MagicMock() ),
+                ( "margarine.spread.get_connection_spec", mock.MagicMock(return_value = ConnectionSpec("memory://")) ),
+                ( "margarine.spread.run", mock.MagicMock() ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        self.assertRaises(SystemExit, spread.main)
+
+        self.assertFalse(spread.run.called)
+
+    def test_unavailable_codec_refused(self):
+        for target, value in [
+                ( "margarine.spread.Parameters", mock.MagicMock() ),
+                ( "margarine.spread.get_connection_spec", mock.MagicMock(return_value = ConnectionSpec("amqp://localhost")) ),
+                ( "margarine.spread.get_codec", mock.MagicMock(side_effect = ValueError("lzma")) ),
+                ( "margarine.spread.run", mock.MagicMock() ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        self.assertRaises(SystemExit, spread.main)
+
+        self.assertFalse(spread.run.called)
+
+class SQLiteBrokerTest(BaseEmbeddedQueueTest, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.broker = SQLiteBroker(os.path.join(self.directory, "queue.sqlite"), visibility_timeout = 0.2, poll_interval = 0.01)
+
+        super(SQLiteBrokerTest, self).setUp()
+
+    def test_visibility_timeout(self):
+        self.channel.basic_publish(exchange = "margarine.users.topic", routing_key = "users.email", body = '{}')
+
+        delivery = self.broker.get([ "margarine.users.email" ])
+
+        self.assertIsNone(self.broker.get([ "margarine.users.email" ]))
+
+        time.sleep(0.25)
+
+        redelivery = self.broker.get([ "margarine.users.email" ])
+
+        self.assertEqual(delivery.tag, redelivery.tag)
+        self.assertTrue(redelivery.redelivered)
+
+    def test_durable(self):
+        self.channel.basic_publish(exchange = "margarine.articles.topic", routing_key = "articles.create", body = '{"_id": "a"}')
+
+        self.broker = SQLiteBroker(os.path.join(self.directory, "queue.sqlite"))
+
+        EmbeddedConnection(self.broker).channel().basic_publish(exchange = "margarine.articles.topic", routing_key = "articles.create", body = '{"_id": "b"}')
+
+        self.assertEqual([ '{"_id": "a"}', '{"_id": "b"}' ], self._consume("margarine.articles.create", 2))
@@ -2,3 +2,289 @@
 #
 # margarine is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import datetime
+import mock
+import os
+import redis
+import shutil
+import tempfile
+import time
+import unittest
+import logging
+
+from margarine.keystores import ConnectionPool
+from margarine.keystores import Keyspace
+from margarine.keystores import MemoryClient
+from margarine.keystores import SCRIPTS
+from margarine.keystores import ShardedClient
+from margarine.keystores import delete_if_equal
+from margarine.keystores import promote
+from margarine.keystores import batch
+
+logger = logging.getLogger(__name__)
+
+class FakeConnection(object):
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_connections = 2, timeout = 0.01, connection_class = FakeConnection, host = "localhost")
+
+    def test_connection_reused(self):
+        connection = self.pool.get_connection("GET")
+        self.pool.release(connection)
+
+        self.assertIs(connection, self.pool.get_connection("GET"))
+
+    def test_connection_arguments(self):
+        self.assertEqual({ "host": "localhost" }, self.pool.get_connection("GET").kwargs)
+
+    def test_checkout_timeout(self):
+        self.pool.get_connection("GET")
+        self.pool.get_connection("GET")
+
+        self.assertRaises(redis.ConnectionError, self.pool.get_connection, "GET")
+
+    def test_idle_connections_reaped(self):
+        self.pool.idle_timeout = 60
+
+        connection = self.pool.get_connection("GET")
+        self.pool.release(connection)
+
+        with mock.patch("margarine.keystores.time.time", return_value = time.time() + 120):
+            self.assertIsNot(connection, self.pool.get_connection("GET"))
+
+        self.assertFalse(connection.connected)
+
+    def test_fork_discards_connections(self):
+        first = self.pool.get_connection("GET")
+        second = self.pool.get_connection("GET")
+
+        self.pool.release(first)
+
+        with mock.patch("margarine.keystores.os.getpid", return_value = self.pool.pid + 1):
+            self.assertIsNot(first, self.pool.get_connection("GET"))
+            self.assertIsNotNone(self.pool.get_connection("GET"))
+
+        self.assertTrue(first.connected)
+        self.assertTrue(second.connected)
+
+class KeyspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.keyspace = Keyspace("tokens", self.client)
+
+    def test_get(self):
+        self.keyspace.get("token")
+
+        self.client.get.assert_called_once_with("tokens:{token}")
+
+    def test_setex(self):
+        self.keyspace.setex("token", "username", 60)
+
+        self.client.setex.assert_called_once_with("tokens:{token}", "username", 60)
+
+    def test_delete(self):
+        self.keyspace.delete("first", "second")
+
+        self.client.delete.assert_called_once_with("tokens:{first}", "tokens:{second}")
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.pipeline = self.client.pipeline.return_value
+
+        patcher = mock.patch("margarine.keystores.get_keyspace", side_effect = lambda _: Keyspace(_, self.client))
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_single_round_trip(self):
+        self.pipeline.execute.return_value = [ "username", 1, True ]
+
+        with batch() as _:
+            token = _.keyspace("tokens").get("token")
+            deleted = _.keyspace("verifications").delete("token")
+            stored = _.keyspace("verifications").setex("other", "username", 60)
+
+        self.client.pipeline.assert_called_once_with(transaction = True)
+        self.pipeline.execute.assert_called_once_with()
+
+        self.pipeline.get.assert_called_once_with("tokens:{token}")
+        self.pipeline.delete.assert_called_once_with("verifications:{token}")
+
+        self.assertEqual("username", token.value)
+        self.assertEqual(1, deleted.value)
+        self.assertTrue(stored.value)
+
+    def test_not_executed_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with batch() as _:
+                _.keyspace("tokens").get("token")
+
+                raise RuntimeError()
+
+        self.assertFalse(self.pipeline.execute.called)
+
+class MemoryClientTest(unittest.TestCase):
+    def setUp(self):
+        self.client = MemoryClient()
+
+        patcher = mock.patch("margarine.keystores._now", return_value = 1000.0)
+        self.addCleanup(patcher.stop)
+        self.now = patcher.start()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.client.get("token"))
+
+    def test_setex_expires(self):
+        self.client.setex("token", "username", datetime.timedelta(minutes = 3))
+
+        self.now.return_value = 1179.0
+        self.assertEqual("username", self.client.get("token"))
+        self.assertEqual(1, self.client.ttl("token"))
+
+        self.now.return_value = 1180.0
+        self.assertIsNone(self.client.get("token"))
+
+    def test_rewritten_key_not_expired_early(self):
+        self.client.setex("token", "first", 10)
+        self.client.setex("token", "second", 100)
+
+        self.now.return_value = 1050.0
+        self.assertEqual("second", self.client.get("token"))
+
+        self.client.set("token", "third")
+
+        self.now.return_value = 2000.0
+        self.assertEqual("third", self.client.get("token"))
+
+    def test_delete(self):
+        self.client.set("first", "value")
+        self.client.set("second", "value")
+
+        self.assertEqual(2, self.client.delete("first", "second", "third"))
+        self.assertFalse(self.client.exists("first"))
+
+    def test_pipeline(self):
+        self.client.set("token", "username")
+
+        pipeline = self.client.pipeline()
+        pipeline.get("token")
+        pipeline.delete("token")
+
+        self.assertEqual([ "username", 1 ], pipeline.execute())
+        self.assertIsNone(self.client.get("token"))
+
+    def test_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        path = os.path.join(directory, "keystore.json")
+
+        client = MemoryClient(path)
+        client.setex("token", "username", 60)
+        client.setex("expired", "username", 1)
+        client.snapshot()
+
+        self.now.return_value = 1030.0
+
+        client = MemoryClient(path)
+
+        self.assertEqual("username", client.get("token"))
+        self.assertIsNone(client.get("expired"))
+
+class ShardedClientTest(unittest.TestCase):
+    def setUp(self):
+        self.shards = [ MemoryClient() for _ in range(3) ]
+        self.client = ShardedClient([ ( "shard-{0}".format(index), shard, 1 ) for index, shard in enumerate(self.shards) ])
+
+        self.keys = [ "tokens:{{{0}}}".format(_) for _ in range(3000) ]
+
+    def test_routing(self):
+        for key in self.keys:
+            self.client.set(key, key)
+
+        for key in self.keys:
+            self.assertEqual(key, self.client.route(key).get(key))
+
+        for shard in self.shards:
+            self.assertGreater(len(shard._data), 700)
+
+    def test_hash_tags_colocated(self):
+        for _ in range(100):
+            self.assertEqual(self.client.shard("tokens:{{{0}}}".format(_)), self.client.shard("verifications:{{{0}}}".format(_)))
+
+    def test_added_shard_moves_few_keys(self):
+        before = [ self.client.shard(_) for _ in self.keys ]
+
+        client = ShardedClient([ ( "shard-{0}".format(index), MemoryClient(), 1 ) for index in range(4) ])
+
+        moved = len([ _ for _, key in zip(before, self.keys) if client.shard(key) != _ ])
+
+        self.assertLess(moved, len(self.keys) * 0.35)
+
+    def test_pipeline(self):
+        for key in self.keys[:10]:
+            self.client.set(key, key)
+
+        pipeline = self.client.pipeline()
+
+        for key in self.keys[:10]:
+            pipeline.get(key)
+
+        self.assertEqual(self.keys[:10], pipeline.execute())
+
+    def test_delete(self):
+        for key in self.keys[:10]:
+            self.client.set(key, key)
+
+        self.assertEqual(10, self.client.delete(*self.keys[:10]))
+
+class ScriptTest(unittest.TestCase):
+    def setUp(self):
+        self.client = MemoryClient()
+
+        patcher = mock.patch("margarine.keystores.get_keystore", return_value = self.client)
+        self.addCleanup(patcher.stop)
+        self.keystore = patcher.start()
+
+    def test_delete_if_equal(self):
+        self.client.set("verifications:{token}", "alunduil")
+
+        self.assertFalse(delete_if_equal("verifications", "token", "other"))
+        self.assertTrue(delete_if_equal("verifications", "token", "alunduil"))
+        self.assertFalse(delete_if_equal("verifications", "token", "alunduil"))
+
+    def test_promote(self):
+        self.client.set("tokens:{token}", "alunduil")
+
+        self.assertFalse(promote("tokens", "verifications", "token", "other", 180))
+        self.assertIsNone(self.client.get("verifications:{token}"))
+
+        self.assertTrue(promote("tokens", "verifications", "token", "alunduil", datetime.timedelta(minutes = 3)))
+        self.assertEqual("alunduil", self.client.get("verifications:{token}"))
+        self.assertEqual(180, self.client.ttl("verifications:{token}"))
+
+    def test_redis_evalsha(self):
+        client = self.keystore.return_value = mock.MagicMock(spec = [ "evalsha", "script_load" ])
+        client.evalsha.return_value = 1
+
+        self.assertTrue(delete_if_equal("verifications", "token", "alunduil"))
+
+        client.evalsha.assert_called_once_with(SCRIPTS["delete_if_equal"].sha, 1, "verifications:{token}", "alunduil")
+        self.assertFalse(client.script_load.called)
+
+    def test_redis_noscript(self):
+        client = self.keystore.return_value = mock.MagicMock(spec = [ "evalsha", "script_load" ])
+        client.evalsha.side_effect = [ redis.exceptions.NoScriptError(), 1 ]
+
+        self.assertTrue(delete_if_equal("verifications", "token", "alunduil"))
+
+        client.script_load.assert_called_once_with(SCRIPTS["delete_if_equal"].source)
+        self.assertEqual(2, client.evalsha.call_count)
@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import unittest
+import logging
+
+from margarine.loggers import AsynchronousHandler
+from margarine.loggers import SamplingFilter
+from margarine.loggers import abbreviate
+from margarine.loggers import configure
+
+logger = logging.getLogger(__name__)
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def _record(level = logging.DEBUG, msg = "message: %s", args = (), lineno = 1):
+    return logging.LogRecord(__name__, level, __file__, lineno, msg, args, None)
+
+class AbbreviateTest(unittest.TestCase):
+    def test_short_value(self):
+        self.assertEqual(str(abbreviate("short", 10)), "short")
+
+    def test_long_value(self):
+        self.assertEqual(str(abbreviate("x" * 20, 10)), "xxxxxxxxxx... (20 characters total)")
+
+    def test_lazy_rendering(self):
+        class Expensive(object):
+            rendered = False
+
+            def __str__(self):
+                Expensive.rendered = True
+                return "expensive"
+
+        disabled = logging.getLogger(__name__ + ".disabled")
+        disabled.setLevel(logging.INFO)
+
+        disabled.debug("value: %s", abbreviate(Expensive()))
+
+        self.assertFalse(Expensive.rendered)
+
+class SamplingFilterTest(unittest.TestCase):
+    def test_debug_sampled_per_site(self):
+        sampler = SamplingFilter(3)
+
+        first = [ sampler.filter(_record(lineno = 1)) for _ in range(6) ]
+        second = [ sampler.filter(_record(lineno = 2)) for _ in range(3) ]
+
+        self.assertEqual(first, [ True, False, False, True, False, False ])
+        self.assertEqual(second, [ True, False, False ])
+
+    def test_warnings_not_sampled(self):
+        sampler = SamplingFilter(3)
+
+        self.assertTrue(all(sampler.filter(_record(level = logging.WARNING)) for _ in range(6)))
+
+class AsynchronousHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.target = RecordingHandler()
+        self.handler = AsynchronousHandler([ self.target ])
+
+        self.addCleanup(self.handler.close)
+
+    def test_records_written(self):
+        arguments = { "key": "value" }
+
+        self.handler.handle(_record(args = (arguments,)))
+
+        arguments["key"] = "changed"
+
+        self.handler.flush()
+
+        self.assertEqual([ _.getMessage() for _ in self.target.records ], [ "message: {'key': 'value'}" ])
+
+class ConfigureTest(unittest.TestCase):
+    def setUp(self):
+        self.target = RecordingHandler()
+
+        self.logger = logging.getLogger(__name__ + ".configured")
+        self.logger.propagate = False
+        self.logger.addHandler(self.target)
+
+        self.addCleanup(self.logger.removeHandler, self.target)
+        self.addCleanup(configure)
+
+    def test_repeated(self):
+        configure(asynchronous = True, sample = 3)
+
+        first = self.logger.handlers[0]
+
+        configure(asynchronous = True, sample = 3)
+
+        self.assertEqual(1, len(self.logger.handlers))
+        self.assertIsInstance(self.logger.handlers[0], AsynchronousHandler)
+        self.assertEqual([ self.target ], self.logger.handlers[0].handlers)
+        self.assertFalse(first._writer.is_alive())
+        self.assertEqual(1, len([ _ for _ in self.logger.handlers[0].filters if isinstance(_, SamplingFilter) ]))
+        self.assertEqual([], [ _ for _ in self.target.filters if isinstance(_, SamplingFilter) ])
+
+    def test_unwrapped(self):
+        configure(asynchronous = True, sample = 3)
+        configure()
+
+        self.assertEqual([ self.target ], self.logger.handlers)
+        self.assertEqual([], [ _ for _ in self.target.filters if isinstance(_, SamplingFilter) ])
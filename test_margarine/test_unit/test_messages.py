@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import json
+import mock
+import unittest
+import logging
+
+from margarine import messages
+from margarine.messages import decode
+from margarine.messages import encode
+
+logger = logging.getLogger(__name__)
+
+class MessagesTest(unittest.TestCase):
+    def setUp(self):
+        self.payload = { "_id": "44d85795248d5899b8caac2bd8233755", "url": u"http://example.com/ünïcode" }
+
+    def test_round_trip(self):
+        for codec, content_type in [ ( "json", "application/json" ), ( "bson", "application/bson" ) ]:
+            body, _ = encode("articles.create", self.payload, codec)
+
+            self.assertEqual(content_type, _)
+            self.assertEqual(self.payload, decode(body, mock.MagicMock(content_type = content_type)))
+
+    def test_bson_packs_ids(self):
+        body, _ = encode("articles.update", { "_id": self.payload["_id"] }, "bson")
+
+        self.assertLess(len(body), len(encode("articles.update", { "_id": self.payload["_id"] }, "json")[0]))
+        self.assertEqual({ "_id": self.payload["_id"] }, decode(body, mock.MagicMock(content_type = "application/bson")))
+
+    def test_object_codec(self):
+        body, content_type = encode("articles.create", self.payload, "object")
+
+        self.assertIs(self.payload, body["payload"])
+
+        payload = decode(body, mock.MagicMock(content_type = content_type))
+
+        self.assertEqual(self.payload, payload)
+        self.assertIsNot(self.payload, payload)
+
+    def test_default_codec(self):
+        with mock.patch("margarine.messages.Parameters", return_value = { "messages.codec": "bson" }):
+            body, content_type = encode("articles.create", self.payload)
+
+        self.assertEqual("application/bson", content_type)
+
+    def test_envelope(self):
+        body, _ = encode("users.email", { "username": "alunduil" }, "json")
+
+        self.assertEqual({ "type": "users.email", "version": 1, "payload": { "username": "alunduil" } }, json.loads(body))
+
+    def test_bare_json(self):
+        self.assertEqual(self.payload, decode(json.dumps(self.payload)))
+        self.assertEqual(self.payload, decode(json.dumps(self.payload), None))
+
+    def test_unknown_content_type(self):
+        self.assertRaises(ValueError, decode, "", mock.MagicMock(content_type = "application/x-unknown"))
+
+    def test_upgrade(self):
+        for target in [ "margarine.messages.MESSAGES", "margarine.messages.UPGRADES" ]:
+            patcher = mock.patch.dict(target)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        body, _ = encode("users.email", { "user": "alunduil" }, "json")
+
+        messages.register_message("users.email", 2)
+        messages.register_upgrade("users.email", 1, lambda _: { "username": _["user"] })
+
+        self.assertEqual({ "username": "alunduil" }, decode(body))
+
+        body, _ = encode("users.email", { "username": "alunduil", "added": True }, "json")
+
+        messages.register_message("users.email", 1)
+
+        self.assertEqual({ "username": "alunduil", "added": True }, decode(body)) # Newer versions pass through.
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+
+from margarine.migrate import move_body
+from margarine.objectstores import get_article_location
+from margarine.packfiles import PackfileStore
+from margarine.sqlitestore import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+class MoveBodyTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.store = PackfileStore(os.path.join(directory, "objects"), compaction_interval = 0)
+        self.articles = SQLiteDatabase(os.path.join(directory, "margarine.sqlite"))["articles"]
+
+        for target, value in [
+                ( "margarine.migrate.get_container", self.store.create_container ),
+                ( "margarine.migrate.get_collection", lambda _: self.articles ),
+                ( "margarine.migrate.get_article_location", lambda _: get_article_location(_, 256) ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        self.article = {
+                "_id": "44d85795248d5899b8caac2bd8233755",
+                "text_container_name": "margarine-44d85795",
+                "text_object_name": "248d-5899-b8ca-ac2bd8233755",
+                }
+
+        self.articles.insert(dict(self.article))
+        self.store.store_object("margarine-44d85795", "248d-5899-b8ca-ac2bd8233755", b"body")
+
+    def test_moved(self):
+        self.assertTrue(move_body(self.article))
+
+        article = self.articles.find_one({ "_id": self.article["_id"] })
+
+        self.assertEqual("margarine-256-55", article["text_container_name"])
+        self.assertEqual("hashed-256", article["text_layout"])
+
+        self.assertEqual(b"body", self.store.fetch_object(article["text_container_name"], article["text_object_name"]))
+        self.assertRaises(KeyError, self.store.fetch_object, "margarine-44d85795", "248d-5899-b8ca-ac2bd8233755")
+
+    def test_changed_article_kept(self):
+        self.articles.update({ "_id": self.article["_id"] }, { "$set": { "text_object_name": "other" } })
+
+        self.assertFalse(move_body(self.article))
+
+        self.assertEqual(b"body", self.store.fetch_object("margarine-44d85795", "248d-5899-b8ca-ac2bd8233755"))
+
+    def test_current_location_kept(self):
+        with mock.patch("margarine.migrate.get_article_location", lambda _: get_article_location(_, 0)):
+            self.assertFalse(move_body(self.article))
+
+        article = self.articles.find_one({ "_id": self.article["_id"] })
+
+        self.assertEqual("margarine-44d85795", article["text_container_name"])
+        self.assertEqual("uuid", article["text_layout"])
+
+        self.assertEqual(b"body", self.store.fetch_object("margarine-44d85795", "248d-5899-b8ca-ac2bd8233755"))
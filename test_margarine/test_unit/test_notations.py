@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+import uuid
+
+from margarine.aggregates import COMPACT_CODECS
+from margarine.aggregates import CompactCollection
+from margarine.aggregates import INDEXES
+from margarine.notations import add_notation
+from margarine.notations import count_notations
+from margarine.notations import get_notations
+from margarine.notations import remove_notation
+from margarine.notations import split_notations
+from margarine.sqlitestore import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+class NotationsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.database = SQLiteDatabase(os.path.join(directory, "margarine.sqlite"))
+
+        for keys, options in INDEXES["notations"]:
+            self._collection("notations").ensure_index(keys, unique = options.get("unique", False))
+
+        patcher = mock.patch("margarine.notations.get_collection", self._collection)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        self.article_id = "44d85795248d5899b8caac2bd8233755"
+
+    def _collection(self, name):
+        return self.database[name]
+
+    def test_pages(self):
+        for location in range(5):
+            add_notation(self.article_id, location, "note {0}".format(location))
+
+        add_notation("5e8d1b3f0a2c4e6b8d0f1a3c5e7b9d1f", 0, "elsewhere")
+
+        self.assertEqual(5, count_notations(self.article_id))
+
+        page, after = get_notations(self.article_id, limit = 2)
+
+        self.assertEqual([ { "location": 0, "note": "note 0" }, { "location": 1, "note": "note 1" } ], page)
+        self.assertEqual(1, after)
+
+        page, after = get_notations(self.article_id, after = after, limit = 2)
+
+        self.assertEqual([ 2, 3 ], [ _["location"] for _ in page ])
+
+        page, after = get_notations(self.article_id, after = after, limit = 2)
+
+        self.assertEqual([ 4 ], [ _["location"] for _ in page ])
+        self.assertIsNone(after)
+
+    def test_replace_remove(self):
+        add_notation(self.article_id, 12, "first")
+        add_notation(self.article_id, 12, "second")
+
+        self.assertEqual([ { "location": 12, "note": "second" } ], get_notations(self.article_id)[0])
+
+        remove_notation(self.article_id, 12)
+
+        self.assertEqual(0, count_notations(self.article_id))
+
+    def test_split_notations(self):
+        article = {
+                "_id": self.article_id,
+                "notations": [ { "location": 7, "note": "b" }, { "location": 3, "note": "a" } ],
+                }
+
+        self._collection("articles").insert(dict(article))
+
+        self.assertEqual(2, split_notations(article))
+        self.assertEqual(2, split_notations(article))
+
+        self.assertEqual([ 3, 7 ], [ _["location"] for _ in get_notations(self.article_id)[0] ])
+        self.assertNotIn("notations", self._collection("articles").find_one({ "_id": self.article_id }))
+
+    def test_split_notations_merged(self):
+        article = {
+                "_id": self.article_id,
+                "notations": [ { "location": 3, "note": "a" }, { "location": 3, "note": "b" }, { "location": 3, "note": "a" }, { "location": 7, "note": "c" } ],
+                }
+
+        self._collection("articles").insert(dict(article))
+
+        with mock.patch("margarine.notations.logger") as mock_logger:
+            self.assertEqual(2, split_notations(article))
+
+        self.assertEqual([ ( 3, "a\n\nb" ), ( 7, "c" ) ], [ ( _["location"], _["note"] ) for _ in get_notations(self.article_id)[0] ])
+        mock_logger.warning.assert_called_once_with(mock.ANY, 2, self.article_id)
+
+class CompactNotationsTest(NotationsTest):
+    def _collection(self, name):
+        return CompactCollection(self.database[name], COMPACT_CODECS[name])
+
+    def test_stored_compactly(self):
+        add_notation(self.article_id, 1, "note")
+
+        self.assertEqual(set([ "_id", "a", "l", "n" ]), set(self.database["notations"].find_one().keys()))
+        self.assertEqual(1, self.database["notations"].find({ "a": uuid.UUID(self.article_id) }).count())
@@ -0,0 +1,139 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import datetime
+import mock
+import unittest
+import logging
+import uuid
+
+from swiftclient import ClientException
+
+from margarine.objectstores import CloudFilesClient
+from margarine.objectstores import LRUCache
+from margarine.objectstores import get_article_location
+from margarine.objectstores import get_container
+
+logger = logging.getLogger(__name__)
+
+class LRUCacheTest(unittest.TestCase):
+    def test_least_recently_used_evicted(self):
+        cache = LRUCache(2)
+
+        cache.put("first", 1)
+        cache.put("second", 2)
+
+        cache.get("first")
+
+        cache.put("third", 3)
+
+        self.assertEqual(1, cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+        self.assertEqual(3, cache.get("third"))
+        self.assertEqual(2, len(cache))
+
+class GetContainerTest(unittest.TestCase):
+    def setUp(self):
+        for target, value in [
+                ( "margarine.objectstores.OBJECTSTORE_CONTAINERS", LRUCache(2) ),
+                ( "margarine.objectstores.get_objectstore", mock.MagicMock() ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def test_container_created_once(self):
+        from margarine.objectstores import get_objectstore
+
+        self.assertIs(get_container("margarine-44d85795"), get_container("margarine-44d85795"))
+
+        get_objectstore.return_value.create_container.assert_called_once_with("margarine-44d85795")
+
+class FakeConnection(object):
+    http_conn = None
+
+    rejected = 0
+
+    def get_object(self, container, name):
+        if FakeConnection.rejected:
+            FakeConnection.rejected -= 1
+
+            raise ClientException("Unauthorized", http_status = 401)
+
+        return {}, "data"
+
+class CloudFilesClientTest(unittest.TestCase):
+    def setUp(self):
+        self.client = CloudFilesClient("pyrax.ini", "rackspace", 300)
+
+        def _authenticate():
+            self.client.cloudfiles = mock.MagicMock(connection = FakeConnection())
+            self.client.expires = self.expires
+            self.client.generation += 1
+
+        patcher = mock.patch.object(self.client, "_authenticate", side_effect = _authenticate)
+        self.addCleanup(patcher.stop)
+        self.authenticate = patcher.start()
+
+        self.expires = datetime.datetime.now() + datetime.timedelta(hours = 24)
+
+    def test_authenticates_once(self):
+        self.assertEqual("data", self.client.fetch_object("container", "first"))
+        self.assertEqual("data", self.client.fetch_object("container", "second"))
+
+        self.assertEqual(1, self.authenticate.call_count)
+
+    def test_refreshes_before_expiry(self):
+        self.expires = datetime.datetime.now() + datetime.timedelta(seconds = 60)
+
+        self.client.fetch_object("container", "first")
+        self.client.fetch_object("container", "second")
+
+        self.assertEqual(2, self.authenticate.call_count)
+
+    def test_connection_reused(self):
+        self.client.fetch_object("container", "first")
+
+        connection = self.client._get_connection()
+
+        self.client.fetch_object("container", "second")
+
+        self.assertIs(connection, self.client._get_connection())
+
+    def test_reauthenticates_on_401(self):
+        self.client.fetch_object("container", "first")
+
+        patcher = mock.patch.object(FakeConnection, "rejected", 1)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        self.assertEqual("data", self.client.fetch_object("container", "second"))
+
+        self.assertEqual(2, self.authenticate.call_count)
+
+    def test_retried_once(self):
+        patcher = mock.patch.object(FakeConnection, "rejected", 2)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        self.assertRaises(ClientException, self.client.fetch_object, "container", "first")
+
+        self.assertEqual(2, self.authenticate.call_count)
+
+class GetArticleLocationTest(unittest.TestCase):
+    def test_hashed(self):
+        container, name, layout = get_article_location("44d85795248d5899b8caac2bd8233755", 256)
+
+        self.assertEqual(( "margarine-256-55", "44d85795248d5899b8caac2bd8233755", "hashed-256" ), ( container, name, layout ))
+
+    def test_bounded(self):
+        containers = set([ get_article_location(uuid.uuid4().hex, 16)[0] for _ in range(1000) ])
+
+        self.assertEqual(16, len(containers))
+
+    def test_uuid(self):
+        self.assertEqual(( "margarine-44d85795", "248d-5899-b8ca-ac2bd8233755", "uuid" ), get_article_location("44d85795248d5899b8caac2bd8233755", 0))
@@ -0,0 +1,190 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import logging
+import mock
+
+from margarine.packfiles import PackfileIndex
+from margarine.packfiles import PackfileStore
+
+logger = logging.getLogger(__name__)
+
+class PackfileStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.store = PackfileStore(self.directory, segment_size = 64, compaction_interval = 0)
+
+    def _segments(self):
+        return sorted([ _ for _ in os.listdir(self.directory) if _.startswith("segment-") ])
+
+    def test_store_fetch(self):
+        self.store.store_object("container", "object", b"data")
+
+        self.assertEqual(b"data", self.store.fetch_object("container", "object"))
+
+    def test_fetch_missing(self):
+        self.assertRaises(KeyError, self.store.fetch_object, "container", "missing")
+
+    def test_overwrite(self):
+        self.store.store_object("container", "object", b"first")
+        self.store.store_object("container", "object", b"second")
+
+        self.assertEqual(b"second", self.store.fetch_object("container", "object"))
+
+    def test_open_object(self):
+        self.store.store_object("container", "first", b"first")
+        self.store.store_object("container", "second", b"second")
+
+        body = self.store.open_object("container", "first")
+        self.addCleanup(body.close)
+
+        self.assertEqual(5, len(body))
+        self.assertEqual(b"fir", body.read(3))
+        self.assertEqual(b"st", body.read())
+        self.assertEqual(b"", body.read())
+
+    def test_persistent(self):
+        self.store.store_object("container", "object", b"data")
+
+        store = PackfileStore(self.directory, compaction_interval = 0)
+
+        self.assertEqual(b"data", store.fetch_object("container", "object"))
+
+    def test_resized_by_another_process(self):
+        directory = os.path.join(self.directory, "resized")
+        os.makedirs(directory)
+
+        PackfileIndex(os.path.join(directory, "index"), slots = 4)
+
+        writer = PackfileStore(directory, compaction_interval = 0)
+        reader = PackfileStore(directory, compaction_interval = 0)
+
+        writer.store_object("container", "object", b"first")
+
+        self.assertEqual(b"first", reader.fetch_object("container", "object"))
+
+        for _ in range(10):
+            writer.store_object("container", str(_), b"x")
+
+        writer.store_object("container", "object", b"second")
+
+        self.assertEqual(b"second", reader.fetch_object("container", "object"))
+
+    def test_write_lock_released(self):
+        with mock.patch("margarine.packfiles.fcntl.flock", side_effect = IOError("flock")):
+            self.assertRaises(IOError, self.store.store_object, "container", "object", b"data")
+
+        acquired = []
+
+        def acquire():
+            acquired.append(self.store._lock.acquire(False))
+
+            if acquired[0]:
+                self.store._lock.release()
+
+        thread = threading.Thread(target = acquire)
+        thread.start()
+        thread.join(5)
+
+        self.assertEqual([ True ], acquired)
+
+        self.store.store_object("container", "object", b"data")
+
+    def test_segments_rolled(self):
+        for _ in range(4):
+            self.store.store_object("container", str(_), b"x" * 60)
+
+        self.assertEqual(4, len(self._segments()))
+
+        for _ in range(4):
+            self.assertEqual(b"x" * 60, self.store.fetch_object("container", str(_)))
+
+    def test_compaction(self):
+        store = PackfileStore(self.directory, segment_size = 150, compaction_interval = 0)
+
+        for name, data in [ ( "first", b"x" ), ( "second", b"y" ), ( "third", b"z" ) ]:
+            store.store_object("container", name, data * 40)
+
+        store.store_object("container", "first", b"w" * 40)
+        store.delete_object("container", "second")
+
+        self.assertEqual([ "segment-00000001", "segment-00000002" ], self._segments())
+
+        store.compact()
+
+        self.assertEqual([ "segment-00000002" ], self._segments())
+
+        self.assertEqual(b"w" * 40, store.fetch_object("container", "first"))
+        self.assertEqual(b"z" * 40, store.fetch_object("container", "third"))
+        self.assertRaises(KeyError, store.fetch_object, "container", "second")
+
+    def test_compacted_by_another_process(self):
+        reader = PackfileStore(self.directory, segment_size = 64, compaction_interval = 0)
+
+        self.store.store_object("container", "a", b"A" * 60)
+        self.store.store_object("container", "b", b"B" * 60)
+
+        self.assertEqual(b"B" * 60, reader.fetch_object("container", "b"))
+
+        self.store.store_object("container", "b", b"C" * 60)
+        self.store.delete_object("container", "b")
+
+        self.store.compact()
+
+        self.store.store_object("container", "d", b"D" * 60)
+
+        self.assertEqual(b"D" * 60, reader.fetch_object("container", "d"))
+        self.assertEqual([ "segment-00000001", "segment-00000004" ], self._segments())
+
+    def test_replaced_segment_remapped(self):
+        self.store.store_object("container", "object", b"first")
+
+        self.assertEqual(b"first", self.store.fetch_object("container", "object"))
+
+        path = os.path.join(self.directory, "segment-00000001")
+
+        with open(path, "rb") as fh:
+            record = fh.read()
+
+        os.unlink(path)
+
+        with open(path, "wb") as fh:
+            fh.write(record.replace(b"first", b"other"))
+
+        self.assertEqual(b"other", self.store.fetch_object("container", "object"))
+
+class PackfileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_resize(self):
+        path = os.path.join(self.directory, "index")
+
+        index = PackfileIndex(path, slots = 4)
+        reader = PackfileIndex(path)
+
+        from margarine.packfiles import _digest
+
+        for _ in range(10):
+            index.put(_digest("container", str(_)), 1, _, 1)
+
+        self.assertEqual(16, index.slots)
+        self.assertEqual(10, len(list(index.entries())))
+
+        self.assertIsNone(reader.get("container", "9"))
+
+        reader.refresh()
+
+        self.assertEqual(( 1, 9, 1 ), reader.get("container", "9"))
@@ -12,6 +12,7 @@ import os
 import logging
 
 from margarine.parameters import Parameters
+from margarine.parameters import boolean
 
 logger = logging.getLogger(__name__)
 
@@ -93,6 +94,34 @@ class ParametersRespectsDoubleAsteriskTest(unittest.TestCase):
 
         self.assertEqual(parameters_to_dict(**self.parameters), {})
 
+class BooleanTest(unittest.TestCase):
+    def test_bool(self):
+        self.assertTrue(boolean(True))
+        self.assertFalse(boolean(False))
+
+    def test_strings(self):
+        self.assertEqual([ True ] * 4, [ boolean(_) for _ in [ "true", "Yes", "on", "1" ] ])
+        self.assertEqual([ False ] * 5, [ boolean(_) for _ in [ "false", "No", "off", "0", "" ] ])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, boolean, "sometimes")
+
+    def test_argument(self):
+        orig_argv = sys.argv
+        self.addCleanup(setattr, sys, "argv", orig_argv)
+
+        Parameters._Parameters__shared_state = {}
+
+        sys.argv = [ "test_script", "--boolean-enabled", "--boolean-disabled=no" ]
+
+        parameters = Parameters("boolean", parameters = [
+            { "options": [ "--enabled" ], "type": boolean, "nargs": "?", "const": True, "default": False, },
+            { "options": [ "--disabled" ], "type": boolean, "nargs": "?", "const": True, "default": True, },
+            ]).parse()
+
+        self.assertIs(True, parameters["boolean.enabled"])
+        self.assertIs(False, parameters["boolean.disabled"])
+
 class ParametersResolutionTest(unittest.TestCase):
     def setUp(self):
         Parameters._Parameters__shared_state = {}
@@ -133,3 +162,87 @@ class ParametersResolutionTest(unittest.TestCase):
 
     def test_argument(self):
         self.assertEqual(self.parameters["{0}.argument".format(self.name)], "argument")
+
+class ParametersSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        Parameters._Parameters__shared_state = {}
+
+        self.name = "test-section"
+
+        self.orig_environ = os.environ
+        os.environ = {}
+
+        self.temp = tempfile.NamedTemporaryFile(mode = "w")
+
+        self.temp.write("[{0}]\n".format(self.name))
+        self.temp.write("configuration = configuration\n")
+        self.temp.flush()
+
+        self.addCleanup(self.temp.close)
+
+        self.orig_argv = sys.argv
+        sys.argv = [ "test_script" ]
+
+        self.parameters = Parameters(self.name, self.temp.name, TEST_PARAMETERS)
+        self.parameters.parse()
+
+    def tearDown(self):
+        sys.argv = self.orig_argv
+        os.environ = self.orig_environ
+
+    def test_contains(self):
+        self.assertIn("{0}.configuration".format(self.name), self.parameters)
+        self.assertNotIn("{0}.missing".format(self.name), self.parameters)
+
+    def test_missing_key(self):
+        self.assertRaises(KeyError, lambda: self.parameters["{0}.missing".format(self.name)])
+
+    def test_environment_change_requires_resolution(self):
+        os.environ["TEST_SCRIPT_TEST_SECTION_ENVIRONMENT"] = "environment"
+
+        self.assertEqual(self.parameters["{0}.environment".format(self.name)], "default")
+
+        self.parameters.parse(components = { "environment" })
+
+        self.assertEqual(self.parameters["{0}.environment".format(self.name)], "environment")
+
+    def test_reinitialize(self):
+        self.temp.seek(0)
+        self.temp.truncate()
+        self.temp.write("[{0}]\n".format(self.name))
+        self.temp.write("configuration = changed\n")
+        self.temp.flush()
+
+        self.assertEqual(self.parameters["{0}.configuration".format(self.name)], "configuration")
+
+        self.parameters.reinitialize()
+
+        self.assertEqual(self.parameters["{0}.configuration".format(self.name)], "changed")
+
+    def test_registration(self):
+        Parameters._Parameters__shared_state = {}
+
+        parameters = Parameters(self.name, parameters = TEST_PARAMETERS)
+
+        self.assertNotIn("other.option", parameters)
+
+        Parameters("other", parameters = [ { "options": [ "--option" ], "default": "value", }, ])
+
+        self.assertEqual(parameters["other.option"], "value")
+
+    def test_reload(self):
+        changes = []
+
+        self.parameters.subscribe("{0}.configuration".format(self.name), lambda *args: changes.append(args))
+        self.parameters.subscribe("{0}.default".format(self.name), lambda *args: changes.append(args))
+
+        self.temp.seek(0)
+        self.temp.truncate()
+        self.temp.write("[{0}]\n".format(self.name))
+        self.temp.write("configuration = changed\n")
+        self.temp.flush()
+
+        self.parameters.reload()
+
+        self.assertEqual(self.parameters["{0}.configuration".format(self.name)], "changed")
+        self.assertEqual(changes, [ ("{0}.configuration".format(self.name), "configuration", "changed") ])
@@ -16,6 +16,7 @@ from test_margarine.test_unit.test_spread import BaseSpreadTest
 
 # TODO Remove pluralization of articles
 from margarine.spread.articles import create_article_consumer
+from margarine.messages import encode
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +45,10 @@ class SpreadArticleCreateTest(BaseSpreadArticleTest):
 
         self.method.delivery_tag.return_value = 'create'
 
+        patcher = mock.patch('margarine.messages.Parameters', mock.MagicMock(return_value = { 'messages.codec': 'json' }))
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
     def _validate_mocks(self, _id, article):
         '''Validate mock calls.
 
@@ -56,7 +61,7 @@ class SpreadArticleCreateTest(BaseSpreadArticleTest):
         self.mock_collection.reset_mock()
 
         self.mock_channel.basic_publish.assert_called_once_with(
-                body = json.dumps({ '_id': _id }),
+                body = encode('articles.update', { '_id': _id }, 'json')[0],
                 exchange = 'margarine.articles.create',
                 properties = mock.ANY,
                 routing_key = 'articles.create')
@@ -215,3 +220,50 @@ class SpreadArticleSanitizationTest(BaseSpreadArticleTest):
         '''Spread::Article Sanitize'''
 
         self.fail('Implement this stub! Refactor sanitization.')
+
+    def _sanitize(self, article, threshold, location):
+        '''Run sanitize_html_consumer over article with a changed etag.'''
+
+        from margarine.spread.articles import sanitize_html_consumer
+
+        response = mock.MagicMock()
+        response.info.return_value.getheader.return_value = 'changed'
+        response.read.return_value = '<html><body>text</body></html>'
+
+        for target, value in [
+                ( 'margarine.spread.articles.urllib2.urlopen', mock.MagicMock(return_value = response) ),
+                ( 'margarine.spread.articles.get_codec', mock.MagicMock(return_value = None) ),
+                ( 'margarine.spread.articles.get_article_location', mock.MagicMock(return_value = location) ),
+                ( 'margarine.spread.articles.Parameters', mock.MagicMock(return_value = { 'inline.threshold': threshold }) ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+        self.mock_collection.find_one.return_value = article
+
+        sanitize_html_consumer(mock.MagicMock(), self.method, None, json.dumps({ '_id': self.articles[0]['_id'] }))
+
+    def test_article_sanitize_inlined(self):
+        '''Spread::Article Sanitize—Previous Body Deleted (Inlined)'''
+
+        self._sanitize(dict(self.articles[0], text_container_name = 'margarine-44d85795', text_object_name = '248d-5899-b8ca-ac2bd8233755', text_layout = 'uuid'), 16, None)
+
+        self.mock_container.delete_object.assert_called_once_with('248d-5899-b8ca-ac2bd8233755')
+
+    def test_article_sanitize_moved(self):
+        '''Spread::Article Sanitize—Previous Body Deleted (Moved)'''
+
+        self._sanitize(dict(self.articles[0], text_container_name = 'margarine-44d85795', text_object_name = '248d-5899-b8ca-ac2bd8233755', text_layout = 'uuid'), 0, ( 'margarine-256-55', '44d85795248d5899b8caac2bd8233755', 'hashed-256' ))
+
+        self.mock_container.store_object.assert_called_once_with('44d85795248d5899b8caac2bd8233755', mock.ANY, content_type = 'text/html')
+        self.mock_container.delete_object.assert_called_once_with('248d-5899-b8ca-ac2bd8233755')
+
+    def test_article_sanitize_overwritten(self):
+        '''Spread::Article Sanitize—Body Overwritten In Place'''
+
+        location = ( 'margarine-256-55', '44d85795248d5899b8caac2bd8233755', 'hashed-256' )
+
+        self._sanitize(dict(self.articles[0], text_container_name = location[0], text_object_name = location[1], text_layout = location[2]), 0, location)
+
+        self.assertFalse(self.mock_container.delete_object.called)
@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+from margarine.aggregates import ASCENDING
+from margarine.aggregates import DESCENDING
+from margarine.sqlitestore import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+class SQLiteCollectionTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.database = SQLiteDatabase(os.path.join(directory, "margarine.sqlite"), multikey = { "articles": [ "tags" ] })
+
+        self.users = self.database["users"]
+        self.articles = self.database["articles"]
+
+    def test_insert_find_one(self):
+        self.users.insert({ "username": "alunduil", "email": "alunduil@example.com", "hash": "x" })
+
+        user = self.users.find_one({ "username": "alunduil" }, { "hash": 0 })
+
+        self.assertEqual("alunduil@example.com", user["email"])
+        self.assertNotIn("hash", user)
+        self.assertIn("_id", user)
+
+        self.assertIsNone(self.users.find_one({ "username": "missing" }))
+
+    def test_update_set_unset(self):
+        self.users.insert({ "username": "alunduil", "email": "alunduil@example.com" })
+
+        self.users.update({ "username": "alunduil" }, { "$set": { "hash": "x" }, "$unset": { "email": "" } })
+
+        user = self.users.find_one({ "username": "alunduil" })
+
+        self.assertEqual("x", user["hash"])
+        self.assertNotIn("email", user)
+
+    def test_upsert(self):
+        self.articles.update({ "_id": "a" }, { "$set": { "url": "http://example.com/" } }, upsert = True)
+        self.articles.update({ "_id": "a" }, { "$set": { "votes": 1 } }, upsert = True)
+
+        self.assertEqual({ "_id": "a", "url": "http://example.com/", "votes": 1 }, self.articles.find_one({ "_id": "a" }))
+        self.assertEqual(1, self.articles.count())
+
+    def test_remove(self):
+        self.users.insert([ { "username": "first" }, { "username": "second" } ])
+
+        self.users.remove({ "username": "first" })
+
+        self.assertEqual([ "second" ], [ _["username"] for _ in self.users.find() ])
+
+    def test_datetimes(self):
+        created_at = datetime.datetime(2013, 8, 4, 14, 16, 20, 77000)
+
+        self.articles.insert([ { "_id": str(_), "created_at": created_at + datetime.timedelta(days = _) } for _ in range(5) ])
+
+        self.assertEqual(created_at, self.articles.find_one({ "_id": "0" })["created_at"])
+
+        newest = self.articles.find({ "created_at": { "$lt": created_at + datetime.timedelta(days = 3) } }, { "_id": 1 }).sort("created_at", DESCENDING).limit(2)
+
+        self.assertEqual([ { "_id": "2" }, { "_id": "1" } ], list(newest))
+
+    def test_array_fields(self):
+        self.articles.insert([ { "_id": "a", "tags": [ "python", "lvm" ] }, { "_id": "b", "tags": [ "lvm" ] } ])
+
+        self.assertEqual([ "a" ], [ _["_id"] for _ in self.articles.find({ "tags": "python" }) ])
+        self.assertEqual(2, self.articles.find({ "tags": "lvm" }).count())
+
+    def test_array_fields_not_indexed(self):
+        self.assertIsNone(self.articles.ensure_index([ ( "tags", ASCENDING ), ( "created_at", DESCENDING ) ]))
+
+        self.assertIsNotNone(self.database["other"].ensure_index([ ( "tags", ASCENDING ) ]))
+
+    def test_ensure_index(self):
+        self.users.insert({ "username": "alunduil" })
+
+        self.users.ensure_index([ ( "username", ASCENDING ) ], unique = True, drop_dups = True)
+
+        plan = " ".join([ str(_) for _ in self.database.connection().execute("EXPLAIN QUERY PLAN SELECT document FROM users WHERE f_username = ?", [ "alunduil" ]) ])
+
+        self.assertIn("users_f_username_1", plan)
+
+        self.assertRaises(DuplicateKeyError, self.users.insert, { "username": "alunduil" })
+        self.assertRaises(DuplicateKeyError, self.users.update, { "username": "other" }, { "username": "alunduil" }, upsert = True)
+
+        self.assertEqual("alunduil", self.users.find_one({ "username": "alunduil" })["username"])
+
+    def test_connection_per_thread(self):
+        connections = []
+
+        thread = threading.Thread(target = lambda: connections.append(self.database.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(connections[0], self.database.connection())
+        self.assertIs(self.database.connection(), self.database.connection())
+
+        self.assertEqual("wal", self.database.connection().execute("PRAGMA journal_mode").fetchone()[0])
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import datetime
+import mock
+import unittest
+import logging
+
+import margarine.tokens
+
+from margarine.keystores import Keyspace
+from margarine.keystores import MemoryClient
+from margarine.tokens import BloomFilter
+from margarine.tokens import is_signed
+from margarine.tokens import issue
+from margarine.tokens import revoke
+from margarine.tokens import signing_enabled
+from margarine.tokens import verify
+
+logger = logging.getLogger(__name__)
+
+class BloomFilterTest(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+
+        items = [ str(_) for _ in range(1000) ]
+
+        for item in items:
+            bloom.add(item)
+
+        self.assertTrue(all([ _ in bloom for _ in items ]))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+
+        for _ in range(1000):
+            bloom.add(str(_))
+
+        false_positives = len([ _ for _ in range(1000, 11000) if str(_) in bloom ])
+
+        self.assertLess(false_positives, 300)
+
+class TokenTest(unittest.TestCase):
+    def setUp(self):
+        self.client = MemoryClient()
+
+        self.parameters = parameters = {
+                "tokens.signed": True,
+                "tokens.secret": "5e8d1b3f0a2c4e6b8d0f1a3c5e7b9d1f",
+                "tokens.refresh": 3600,
+                "tokens.capacity": 1000,
+                }
+
+        for target, value in [
+                ( "margarine.tokens.Parameters", mock.MagicMock(return_value = parameters) ),
+                ( "margarine.tokens.get_keyspace", mock.MagicMock(side_effect = lambda _: Keyspace(_, self.client)) ),
+                ( "margarine.keystores.get_keyspace", mock.MagicMock(side_effect = lambda _: Keyspace(_, self.client)) ),
+                ( "margarine.tokens.REVOCATION_FILTER", None ),
+                ]:
+            patcher = mock.patch(target, value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def test_verify(self):
+        token = issue(u"alunduil")
+
+        self.assertTrue(is_signed(token))
+        self.assertEqual(u"alunduil", verify(token))
+
+    def test_tampered(self):
+        token = issue(u"alunduil")
+
+        payload, signature = token.split(".")
+
+        self.assertIsNone(verify(issue(u"other").split(".")[0] + "." + signature))
+        self.assertIsNone(verify(payload + "." + signature[:-2]))
+        self.assertIsNone(verify("garbage.token"))
+
+    def test_expired(self):
+        self.assertIsNone(verify(issue(u"alunduil", datetime.timedelta(seconds = -1))))
+
+    def test_revoked(self):
+        token = issue(u"alunduil")
+        other = issue(u"alunduil")
+
+        self.assertEqual(u"alunduil", verify(token))
+        self.assertTrue(revoke(token))
+
+        self.assertIsNone(verify(token))
+        self.assertEqual(u"alunduil", verify(other))
+
+    def test_revocations_loaded(self):
+        token = issue(u"alunduil")
+
+        revoke(token)
+
+        margarine.tokens.REVOCATION_FILTER = None
+
+        self.assertIsNone(verify(token))
+
+    def test_keystore_not_consulted(self):
+        token = issue(u"alunduil")
+
+        verify(token)
+
+        with mock.patch.object(Keyspace, "exists") as exists:
+            self.assertEqual(u"alunduil", verify(token))
+
+        self.assertFalse(exists.called)
+
+    def test_secret_required(self):
+        token = issue(u"alunduil")
+
+        self.parameters["tokens.secret"] = None
+
+        self.assertRaises(ValueError, signing_enabled)
+        self.assertRaises(ValueError, issue, u"alunduil")
+        self.assertIsNone(verify(token))
+
+    def test_secret_changed(self):
+        token = issue(u"alunduil")
+
+        self.parameters["tokens.secret"] = "another secret"
+
+        self.assertIsNone(verify(token))
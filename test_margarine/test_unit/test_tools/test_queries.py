@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright (C) 2013 by Alex Brandt <alex.brandt@rackspace.com>
+#
+# margarine is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import unittest
+import logging
+
+from margarine.tools.queries import _percentile
+from margarine.tools.queries import _plan
+
+logger = logging.getLogger(__name__)
+
+class PlanTest(unittest.TestCase):
+    def test_legacy_index(self):
+        self.assertEqual(( "url_1", False ), _plan({ "cursor": "BtreeCursor url_1", "indexOnly": False, "n": 1 }))
+
+    def test_legacy_covered(self):
+        self.assertEqual(( "parsed_at_1__id_1", True ), _plan({ "cursor": "BtreeCursor parsed_at_1__id_1", "indexOnly": True }))
+
+    def test_legacy_collection_scan(self):
+        self.assertEqual(( "COLLSCAN", False ), _plan({ "cursor": "BasicCursor", "indexOnly": False }))
+
+    def test_index(self):
+        explanation = { "queryPlanner": { "winningPlan": {
+            "stage": "LIMIT",
+            "inputStage": {
+                "stage": "FETCH",
+                "inputStage": { "stage": "IXSCAN", "indexName": "tags_1_created_at_-1" },
+                },
+            } } }
+
+        self.assertEqual(( "tags_1_created_at_-1", False ), _plan(explanation))
+
+    def test_covered(self):
+        explanation = { "queryPlanner": { "winningPlan": {
+            "stage": "LIMIT",
+            "inputStage": {
+                "stage": "PROJECTION",
+                "inputStage": { "stage": "IXSCAN", "indexName": "parsed_at_1__id_1" },
+                },
+            } } }
+
+        self.assertEqual(( "parsed_at_1__id_1", True ), _plan(explanation))
+
+    def test_collection_scan(self):
+        explanation = { "queryPlanner": { "winningPlan": {
+            "stage": "SORT",
+            "inputStage": { "stage": "COLLSCAN" },
+            } } }
+
+        self.assertEqual(( "COLLSCAN", False ), _plan(explanation))
+
+class PercentileTest(unittest.TestCase):
+    def test_single(self):
+        self.assertEqual(3, _percentile([ 3 ], 0.5))
+        self.assertEqual(3, _percentile([ 3 ], 0.95))
+
+    def test_unsorted(self):
+        self.assertEqual(3, _percentile([ 5, 1, 4, 2, 3 ], 0.5))
+
+    def test_edges(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(1, _percentile(values, 0))
+        self.assertEqual(96, _percentile(values, 0.95))
+        self.assertEqual(100, _percentile(values, 0.999))
+        self.assertEqual(100, _percentile(values, 1))